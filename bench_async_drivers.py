@@ -0,0 +1,35 @@
+import asyncio
+import sys
+import time
+
+from smart_home import SmartHome
+from smart_devices import SmartTV
+from smart_home_async import AsyncSmartHome, SimulatedDriver
+
+
+def bench_switch_all(count, concurrency, latency):
+    home = SmartHome(max_limit = count)
+    home.add_devices([SmartTV() for _ in range(count)])
+    controller = AsyncSmartHome(home, SimulatedDriver(latency = latency, jitter = latency / 2, seed = 1), concurrency = concurrency)
+
+    start = time.perf_counter()
+    result = asyncio.run(controller.switch_all_on())
+    elapsed = time.perf_counter() - start
+
+    assert result.ok and home.devices_on == count
+    return elapsed
+
+
+def run_benchmarks(count = 500, latency = 0.02):
+    print(f"switch_all_on over {count} devices, {latency * 1000:.0f}ms simulated round trip\n")
+    print(f"{'concurrency':>12} {'seconds':>10} {'devices / s':>14} {'speedup':>8}")
+
+    serial = None
+    for concurrency in (1, 8, 64, 256):
+        elapsed = bench_switch_all(count, concurrency, latency)
+        serial = serial or elapsed
+        print(f"{concurrency:>12} {elapsed:>10.3f} {count / elapsed:>14,.0f} {serial / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,96 @@
+import sys
+import threading
+import time
+
+from smart_devices import SmartTV
+from smart_home_concurrent import ConcurrentSmartHome
+
+
+def bench_writers(threads, shards, devices = 1024, ops = 400, device_io = 0.0002):
+    home = ConcurrentSmartHome(shards = shards, max_limit = devices)
+    device_ids = home.add_devices([SmartTV() for _ in range(devices)])
+
+    # Each change waits on the device (the GIL is released, as it would be for real I/O) and then commits.
+    def next_channel(state):
+        time.sleep(device_io)
+        return state.switch_on, state.option % 734 + 1
+
+    def writer(offset):
+        for i in range(ops):
+            home.update_device(device_ids[(offset + i * 7) % devices], next_channel)
+
+    elapsed = run_threads(writer, threads)
+    return threads * ops / elapsed
+
+
+def bench_readers(threads, read, devices = 10_000, reads = 2000, writer = False):
+    home = ConcurrentSmartHome(max_limit = devices)
+    device_ids = home.add_devices([SmartTV() for _ in range(devices)])
+    done = threading.Event()
+
+    def write():
+        i = 0
+        while not done.is_set():
+            home.toggle_device_by_id(device_ids[i % devices])
+            i += 1
+            time.sleep(0.0001)
+
+    def reader(offset):
+        for i in range(reads):
+            read(home, device_ids[(offset + i) % devices])
+
+    background = threading.Thread(target=write)
+    if writer:
+        background.start()
+
+    elapsed = run_threads(reader, threads)
+    done.set()
+    if writer:
+        background.join()
+    return threads * reads / elapsed
+
+
+def point_read(home, device_id):
+    home.get_device_by_id(device_id)
+    home.total_power_draw
+
+
+def snapshot_read(home, device_id):
+    home.snapshot().devices_on
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target, args=(offset * 97,)) for offset in range(count)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def run_benchmarks(max_threads = 16):
+    counts = [count for count in (1, 2, 4, 8, 16, 32) if count <= max_threads]
+
+    print("Writers: read-modify-write of one device with 0.2ms of device I/O per change\n")
+    print(f"{'threads':>8} {'1 shard ops/s':>16} {'16 shards ops/s':>16} {'speedup':>8}")
+    for count in counts:
+        single = bench_writers(count, 1)
+        sharded = bench_writers(count, 16)
+        print(f"{count:>8} {single:>16,.0f} {sharded:>16,.0f} {sharded / single:>7.1f}x")
+
+    print("\nReaders of a 10,000 device home, without and with a writer thread\n")
+    print(f"{'threads':>8} {'point reads/s':>14} {'with writer':>12} {'snapshots/s':>12} {'with writer':>12}")
+    for count in counts:
+        rates = [
+            bench_readers(count, point_read),
+            bench_readers(count, point_read, writer = True),
+            bench_readers(count, snapshot_read, reads = 200),
+            bench_readers(count, snapshot_read, reads = 200, writer = True),
+        ]
+        print(f"{count:>8} {rates[0]:>14,.0f} {rates[1]:>12,.0f} {rates[2]:>12,.0f} {rates[3]:>12,.0f}")
+
+
+if __name__ == "__main__":
+    run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 16)
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV
+from smart_home_fleet import HomeManager
+
+
+def fleet_devices(devices):
+    return [SmartPlug(i % 151) if i % 2 else SmartTV(i % 734 + 1) for i in range(devices)]
+
+
+def bench_in_process(homes, devices, rounds):
+    fleet = {}
+    for home_id in range(homes):
+        fleet[home_id] = SmartHome(max_limit = devices)
+        fleet[home_id].add_devices(fleet_devices(devices))
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for home in fleet.values():
+            home.switch_all_on()
+        for home in fleet.values():
+            home.switch_all_off()
+        for home_id, home in fleet.items():
+            home.toggle_devices(range(1, devices + 1, 2))
+        sum(home.total_power_draw for home in fleet.values())
+    return rounds * homes / (time.perf_counter() - start)
+
+
+def bench_manager(workers, homes, devices, rounds):
+    with HomeManager(workers = workers) as manager:
+        with manager.batch():
+            for home_id in range(homes):
+                manager.add_home(home_id, max_limit = devices, devices = fleet_devices(devices))
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            manager.switch_all_on()
+            manager.switch_all_off()
+            with manager.batch():
+                for home_id in range(homes):
+                    manager.call(home_id, "toggle_devices", range(1, devices + 1, 2))
+            manager.aggregates()
+        return rounds * homes / (time.perf_counter() - start)
+
+
+def run_benchmarks(homes = 2000, devices = 50, rounds = 5):
+    print(f"Fleet of {homes} homes with {devices} devices each; per round every home is switched")
+    print(f"on, off, has half its devices toggled, and the fleet draw is summed ({os.cpu_count()} CPU(s))\n")
+    print(f"{'':>16} {'homes/s':>12} {'speedup':>8}")
+
+    baseline = bench_in_process(homes, devices, rounds)
+    print(f"{'one process':>16} {baseline:>12,.0f} {1:>7.1f}x")
+
+    for workers in (1, 2, 4, 8):
+        rate = bench_manager(workers, homes, devices, rounds)
+        print(f"{f'{workers} worker(s)':>16} {rate:>12,.0f} {rate / baseline:>7.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,60 @@
+import sys
+import time
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV
+from smart_home_metrics import Metrics
+
+
+def make_home():
+    home = SmartHome(max_limit = 1000)
+    home.add_devices([SmartTV(i % 734 + 1) if i % 2 else SmartPlug(i % 151) for i in range(1000)])
+    return home
+
+
+def bench_operations(home, count):
+    device_ids = home.device_ids()
+
+    def toggle():
+        for i in range(count):
+            home.toggle_device_by_id(device_ids[i % 1000])
+
+    def update():
+        for i in range(count):
+            home.update_option_by_id(device_ids[i % 1000 | 1], i % 734 + 1)
+
+    return [count / best_of(3, run) for run in (toggle, update)]
+
+
+def best_of(repeats, run):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(count = 100_000):
+    print(f"Metrics overhead, {count} operations per measurement\n")
+    print(f"{'':>22} {'toggle/s':>12} {'update/s':>12}")
+
+    home, other = make_home(), make_home()
+    metrics = Metrics(home)
+    rows = [("never enabled", bench_operations(home, count))]
+    with metrics:
+        rows.append(("enabled", bench_operations(home, count)))
+        rows.append(("other home", bench_operations(other, count)))
+    rows.append(("disabled again", bench_operations(home, count)))
+
+    for label, (toggle, update) in rows:
+        print(f"{label:>22} {toggle:>12,.0f} {update:>12,.0f}")
+
+    print()
+    for operation, snapshot in metrics.snapshot().items():
+        if snapshot.calls:
+            print(f"{operation}: {snapshot}")
+
+
+if __name__ == "__main__":
+    run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
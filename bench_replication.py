@@ -0,0 +1,56 @@
+import random
+import sys
+import time
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV
+from smart_home_replication import ChangeTracker, Replica, encode_delta, decode_delta
+
+
+def build_pair(devices):
+    primary = SmartHome(max_limit = devices)
+    primary.add_devices([SmartTV(i % 734 + 1) if i % 2 else SmartPlug(i % 151) for i in range(devices)])
+    tracker = ChangeTracker(primary)
+
+    replica = Replica()
+    replica.apply(decode_delta(encode_delta(tracker.diff())))
+    return primary, tracker, replica
+
+
+def bench_sync(devices, changes, seed = 1):
+    rng = random.Random(seed)
+    primary, tracker, replica = build_pair(devices)
+    device_ids = primary.device_ids()
+
+    for _ in range(changes):
+        device_id = rng.choice(device_ids)
+        if rng.random() < 0.5:
+            primary.toggle_device_by_id(device_id)
+        else:
+            device = primary.get_device_by_id(device_id)
+            primary.update_option_by_id(device_id, device.option % 150 + 1)
+
+    start = time.perf_counter()
+    data = encode_delta(tracker.diff(replica.version))
+    replica.apply(decode_delta(data))
+    delta_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    full = encode_delta(tracker.diff())
+    Replica().apply(decode_delta(full))
+    full_time = time.perf_counter() - start
+
+    return len(data), delta_time, len(full), full_time
+
+
+def run_benchmarks(devices = 100_000):
+    print(f"Syncing a replica of a {devices:,} device home: delta vs full state\n")
+    print(f"{'changes':>8} {'delta bytes':>12} {'delta ms':>9} {'full bytes':>12} {'full ms':>9}")
+
+    for changes in (1, 10, 100, 1000, 10_000):
+        delta_bytes, delta_time, full_bytes, full_time = bench_sync(devices, changes)
+        print(f"{changes:>8} {delta_bytes:>12,} {delta_time * 1000:>9.2f} {full_bytes:>12,} {full_time * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
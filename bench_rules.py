@@ -0,0 +1,86 @@
+import random
+import sys
+import time
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor
+from smart_home_rules import Rule, RuleEngine
+
+
+class ScanningRuleEngine(RuleEngine):
+    # What the engine would cost without its index: every rule is checked against every change.
+    def _candidates(self, attribute, device_id, device_type, old, new):
+        for rule in self.rules:
+            if rule.applies_to(device_id, device_type, attribute):
+                yield rule
+
+    def _evaluate_draw(self, change):
+        for device_type in change.device_type.__mro__:
+            if device_type in self._draw:
+                old_total = self._draw[device_type]
+                self._draw[device_type] = old_total - change.old_draw + change.new_draw
+                self._check(self._candidates("draw", change.device_id, change.device_type, None, None),
+                            old_total, self._draw[device_type], change)
+
+
+def build_home(devices):
+    home = SmartHome(max_limit = devices)
+    home.add_devices([SmartTV(i % 734 + 1) for i in range(devices // 2)])
+    home.add_devices([SmartPlug(i % 151) for i in range(devices // 2 - 1)])
+    home.add_device(SmartDoor())
+    return home
+
+
+def add_rules(engine, rules, rng):
+    tv_ids = engine.home.query(SmartTV)
+    fired = []
+
+    def note(home, change):
+        fired.append(change.device_id)
+
+    # Mostly rules about one device, some about a whole class, a few on plug draw.
+    for i in range(rules):
+        kind = i % 10
+        if kind < 8:
+            engine.add_rule(Rule(f"tv {i}", rng.choice(tv_ids), "option", note, above = rng.randrange(1, 734)))
+        elif kind == 8:
+            engine.add_rule(Rule(f"channel {i}", SmartTV, "channel", note, equals = rng.randrange(1, 735)))
+        else:
+            engine.add_rule(Rule(f"draw {i}", SmartPlug, "draw", note, above = rng.randrange(5000, 20000)))
+
+    return fired
+
+
+def bench_engine(engine_class, devices, rules, changes, seed = 1):
+    rng = random.Random(seed)
+    home = build_home(devices)
+    engine = engine_class(home, time_budget = 1.0)
+    fired = add_rules(engine, rules, rng)
+
+    tv_ids = home.query(SmartTV)
+    plug_ids = home.query(SmartPlug)
+    updates = [(rng.choice(tv_ids), rng.randrange(1, 735)) for _ in range(changes // 2)]
+    toggles = [rng.choice(plug_ids) for _ in range(changes - len(updates))]
+
+    start = time.perf_counter()
+    for device_id, channel in updates:
+        home.update_option_by_id(device_id, channel)
+    for device_id in toggles:
+        home.toggle_device_by_id(device_id)
+    elapsed = time.perf_counter() - start
+
+    return changes / elapsed, engine.rules_checked / changes, len(fired)
+
+
+def run_benchmarks(devices = 10_000, changes = 2000):
+    print(f"Rule engine, {devices} devices, {changes} changes per run\n")
+    print(f"{'rules':>8} {'indexed ch/s':>14} {'checks/ch':>10} {'scanning ch/s':>14} {'checks/ch':>10} {'fired':>7}")
+
+    for rules in (100, 1000, 5000, 20000):
+        indexed, indexed_checks, fired = bench_engine(RuleEngine, devices, rules, changes)
+        scanning, scanning_checks, scanned_fired = bench_engine(ScanningRuleEngine, devices, rules, changes // 10)
+        print(f"{rules:>8} {indexed:>14,.0f} {indexed_checks:>10.1f} {scanning:>14,.0f} {scanning_checks:>10.1f} {fired:>7}")
+
+
+if __name__ == "__main__":
+    run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,150 @@
+import sys
+import time
+import tracemalloc
+
+from smart_devices import SmartPlug, SmartTV, SmartDoor
+
+
+# Copies of the device classes as they were before validators were compiled
+# per class and __slots__ were added, kept here so the two can be compared.
+class LegacyDeviceBase:
+    def __init__(self, option):
+        if option not in self._valid_range():
+            raise ValueError(f"The {self._option_label()} is {option}, which is not valid {self._valid_range_str()}")
+
+        self.switch_on = False
+        self.option = option
+
+    @property
+    def option(self):
+        return self._option
+
+    @option.setter
+    def option(self, value):
+        if value not in self._valid_range():
+            raise ValueError(f"The {self._option_label()} is {value}, which is not valid {self._valid_range_str()}")
+
+        self._option = value
+
+    def __str__(self):
+        device_status = "on" if self.switch_on else "off"
+
+        return f"{self.__class__.__name__} is {device_status} with {self._option_label()} {self.option}"
+
+
+class LegacySmartPlug(LegacyDeviceBase):
+    def __init__(self, consumption_rate: int):
+        super().__init__(consumption_rate)
+
+    def _valid_range(self):
+        return range(0, 151)
+
+    def _valid_range_str(self):
+        return f"(0 - 150)"
+
+    def _option_label(self):
+        return "consumption rate"
+
+
+class LegacySmartTV(LegacyDeviceBase):
+    def __init__(self, channel : int = 1):
+        super().__init__(channel)
+
+    def _valid_range(self):
+        return range(1, 735)
+
+    def _valid_range_str(self):
+        return f"(1 - 734)"
+
+    def _option_label(self):
+        return "channel"
+
+
+class LegacySmartDoor(LegacyDeviceBase):
+    def __init__(self, locked : bool = True):
+        super().__init__(locked)
+
+    def _valid_range(self):
+        return [True, False]
+
+    def _valid_range_str(self):
+        return f"True or False"
+
+    def _option_label(self):
+        return "locked"
+
+
+CASES = [
+    ("SmartPlug", LegacySmartPlug, SmartPlug, [0, 45, 150, 75]),
+    ("SmartTV", LegacySmartTV, SmartTV, [1, 10, 734, 200]),
+    ("SmartDoor", LegacySmartDoor, SmartDoor, [True, False, False, True]),
+]
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_construction(device_class, values, count):
+    def run():
+        for i in range(count):
+            device_class(values[i & 3])
+    return count / best_of(3, run)
+
+
+def bench_setter(device_class, values, count):
+    device = device_class(values[0])
+
+    def run():
+        for i in range(count):
+            device.option = values[i & 3]
+    return count / best_of(3, run)
+
+
+def bench_str(device_class, values, count):
+    devices = [device_class(values[i & 3]) for i in range(1000)]
+
+    # A home printed repeatedly while only a few devices change between prints.
+    def run():
+        for i in range(count // 1000):
+            devices[i % 1000].option = values[i & 3]
+            for device in devices:
+                str(device)
+    return count / best_of(3, run)
+
+
+def bytes_per_device(device_class, values, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    devices = [device_class(values[i & 3]) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    list_overhead = sys.getsizeof(devices)
+    return (after - before - list_overhead) / count
+
+
+def run_benchmarks(count = 200_000):
+    print(f"Device benchmark, {count} operations per measurement\n")
+    print(f"{'device':<10} {'metric':<22} {'legacy':>14} {'current':>14} {'change':>8}")
+
+    for name, legacy, current, values in CASES:
+        rows = [
+            ("construct / s", bench_construction(legacy, values, count), bench_construction(current, values, count)),
+            ("option set / s", bench_setter(legacy, values, count), bench_setter(current, values, count)),
+            ("str / s", bench_str(legacy, values, count), bench_str(current, values, count)),
+            ("bytes / device", bytes_per_device(legacy, values, count), bytes_per_device(current, values, count)),
+        ]
+
+        for metric, old, new in rows:
+            print(f"{name:<10} {metric:<22} {old:>14,.0f} {new:>14,.0f} {new / old:>7.2f}x")
+
+
+if __name__ == "__main__":
+    run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,398 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor
+from smart_home_app import SmartHomeApp, DeviceList
+
+SIZES = (10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+# Operations that touch one device are timed over at most this many calls per size.
+SAMPLE = 100_000
+
+# Each measurement runs a benchmark again (with a fresh setup) until this many seconds were timed.
+MIN_TIME = 0.1
+
+# A result more than this much slower than the baseline is reported as a regression.
+TOLERANCE = 0.10
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    # A benchmark takes the home size and returns (operations, run); only run() is timed.
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def make_devices(count, seed = 1):
+    rng = random.Random(seed)
+    devices = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            devices.append(SmartPlug(rng.randrange(151)))
+        elif kind == 1:
+            devices.append(SmartTV(rng.randrange(1, 735)))
+        else:
+            devices.append(SmartDoor(rng.random() < 0.5))
+    return devices
+
+
+def make_home(size):
+    home = SmartHome(max_limit = size)
+    home.add_devices(make_devices(size))
+    return home
+
+
+_shared = {}
+
+def shared_home(size):
+    # Benchmarks that leave the home as they found it share one per size; building a million
+    # devices once is enough.
+    if size not in _shared:
+        _shared.clear()
+        _shared[size] = make_home(size)
+    return _shared[size]
+
+
+def sample_ids(home, count, seed = 2):
+    device_ids = home.device_ids()
+    rng = random.Random(seed)
+    return [rng.choice(device_ids) for _ in range(count)]
+
+
+@benchmark("device_construct")
+def bench_device_construct(size):
+    count = min(size, SAMPLE)
+
+    def run():
+        for i in range(count):
+            SmartPlug(i % 151)
+            SmartTV(i % 734 + 1)
+            SmartDoor()
+    return 3 * count, run
+
+
+@benchmark("setter_validation")
+def bench_setter_validation(size):
+    # Every fourth value is out of range and rejected.
+    count = min(size, SAMPLE)
+    plug, tv = SmartPlug(0), SmartTV(1)
+    values = [(i % 151 if i & 3 else 999, i % 734 + 1 if i & 3 else 0) for i in range(count)]
+
+    def run():
+        for plug_value, tv_value in values:
+            try:
+                plug.consumption_rate = plug_value
+            except ValueError:
+                pass
+            try:
+                tv.channel = tv_value
+            except ValueError:
+                pass
+    return 2 * count, run
+
+
+@benchmark("home_add_device")
+def bench_home_add_device(size):
+    devices = make_devices(size)
+
+    def run():
+        home = SmartHome(max_limit = size)
+        for device in devices:
+            home.add_device(device)
+    return size, run
+
+
+@benchmark("home_add_devices")
+def bench_home_add_devices(size):
+    devices = make_devices(size)
+
+    def run():
+        SmartHome(max_limit = size).add_devices(devices)
+    return size, run
+
+
+@benchmark("home_get_device")
+def bench_home_get_device(size):
+    home = shared_home(size)
+    device_ids = sample_ids(home, min(size, SAMPLE))
+
+    def run():
+        get_device = home.get_device_by_id
+        for device_id in device_ids:
+            get_device(device_id)
+    return len(device_ids), run
+
+
+@benchmark("home_remove_device")
+def bench_home_remove_device(size):
+    # A tenth of the home, in random order, from a fresh copy each time.
+    home = make_home(size)
+    device_ids = home.device_ids()
+    random.Random(3).shuffle(device_ids)
+    device_ids = device_ids[:max(1, min(size // 10, SAMPLE))]
+
+    def run():
+        for device_id in device_ids:
+            home.remove_device_by_id(device_id)
+    return len(device_ids), run
+
+
+@benchmark("home_update_option")
+def bench_home_update_option(size):
+    home = shared_home(size)
+    device_ids = [device_id for device_id in sample_ids(home, min(size, SAMPLE) * 3)
+                  if not isinstance(home.get_device_by_id(device_id), SmartDoor)][:min(size, SAMPLE)]
+    values = [(device_id, (i % 150) + 1) for i, device_id in enumerate(device_ids)]
+
+    def run():
+        for device_id, value in values:
+            home.update_option_by_id(device_id, value)
+    return len(values), run
+
+
+@benchmark("home_switch_all")
+def bench_home_switch_all(size):
+    home = shared_home(size)
+
+    def run():
+        home.switch_all_on()
+        home.switch_all_off()
+    return 2 * size, run
+
+
+@benchmark("home_str")
+def bench_home_str(size):
+    # Every device changed since the last render.
+    home = shared_home(size)
+    home.switch_all_on()
+    home.switch_all_off()
+
+    def run():
+        str(home)
+    return size, run
+
+
+@benchmark("home_str_cached")
+def bench_home_str_cached(size):
+    home = shared_home(size)
+    str(home)
+
+    def run():
+        str(home)
+    return size, run
+
+
+class StubListbox:
+    # Enough of tkinter.Listbox for DeviceList, with the same index rules ("end", inclusive deletes).
+    def __init__(self, height = 30):
+        self.items = []
+        self.selection = set()
+        self.height = height
+
+    def cget(self, option):
+        return self.height if option == "height" else None
+
+    def configure(self, **options):
+        pass
+
+    def bind(self, sequence, callback):
+        pass
+
+    def _index(self, index):
+        return len(self.items) if index == "end" else int(index)
+
+    def insert(self, index, *items):
+        index = self._index(index)
+        self.items[index:index] = items
+
+    def delete(self, first, last = None):
+        first = self._index(first)
+        last = first if last is None else min(self._index(last), len(self.items) - 1)
+        del self.items[first:last + 1]
+
+    def size(self):
+        return len(self.items)
+
+    def curselection(self):
+        return tuple(sorted(self.selection))
+
+    def selection_set(self, index):
+        self.selection.add(int(index))
+
+    def yview(self, *args):
+        return 0.0, 1.0
+
+
+class StubScrollbar:
+    def configure(self, **options):
+        pass
+
+    def set(self, first, last):
+        pass
+
+
+def stub_app(home, virtual = None):
+    # The real SmartHomeApp.update_device_list, without a Tk root: only the device list is built.
+    app = SmartHomeApp.__new__(SmartHomeApp)
+    app.home = home
+    app.device_list = DeviceList(StubListbox(), StubScrollbar(), home, lambda callback: callback(), virtual = virtual)
+    return app
+
+
+@benchmark("gui_update_device_list")
+def bench_gui_update_device_list(size):
+    # As the app runs it: large homes switch to the virtual list and only format the visible rows.
+    app = stub_app(shared_home(size))
+    return size, app.update_device_list
+
+
+@benchmark("gui_update_device_list_full")
+def bench_gui_update_device_list_full(size):
+    app = stub_app(shared_home(size), virtual = False)
+    return size, app.update_device_list
+
+
+def time_benchmark(setup, size, repeat, min_time = MIN_TIME):
+    # The best of repeat measurements, each made of as many runs as fit in min_time, so small homes
+    # are timed over more than a few microseconds.
+    best = None
+    for _ in range(repeat):
+        operations = seconds = 0
+        gc.collect()
+        gc.disable()
+        try:
+            while seconds < min_time:
+                count, run = setup(size)
+                start = time.perf_counter()
+                run()
+                seconds += time.perf_counter() - start
+                operations += count
+        finally:
+            gc.enable()
+
+        if best is None or operations / seconds > best[0] / best[1]:
+            best = operations, seconds
+    return best
+
+
+def run_suite(sizes = SIZES, names = None, repeat = 3, min_time = MIN_TIME, out = sys.stdout):
+    results = {}
+    names = list(BENCHMARKS) if names is None else names
+
+    print(f"{'benchmark':<30} {'size':>9} {'ops':>9} {'seconds':>9} {'ops/s':>13}", file=out)
+    for name in names:
+        for size in sizes:
+            operations, seconds = time_benchmark(BENCHMARKS[name], size, repeat, min_time)
+            ops_per_s = operations / seconds
+            results[f"{name}/{size}"] = {"benchmark": name, "size": size, "operations": operations,
+                                         "seconds": seconds, "ops_per_s": ops_per_s}
+            print(f"{name:<30} {size:>9,} {operations:>9,} {seconds:>9.4f} {ops_per_s:>13,.0f}", file=out)
+        _shared.clear()
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+            "min_time": min_time,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, tolerance = TOLERANCE, out = sys.stdout):
+    # Ratios are current / baseline throughput; below 1 - tolerance is a regression.
+    regressions = []
+
+    print(f"{'benchmark':<30} {'size':>9} {'baseline':>13} {'current':>13} {'ratio':>7}", file=out)
+    for key, result in current["results"].items():
+        old = baseline["results"].get(key)
+        if old is None:
+            continue
+
+        ratio = result["ops_per_s"] / old["ops_per_s"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{result['benchmark']:<30} {result['size']:>9,} {old['ops_per_s']:>13,.0f} "
+              f"{result['ops_per_s']:>13,.0f} {ratio:>6.2f}x{flag}", file=out)
+
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    if missing:
+        print(f"Not in this run: {', '.join(missing)}", file=out)
+
+    print(f"\n{len(regressions)} regression(s) beyond {tolerance:.0%}", file=out)
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the SmartHome model and the GUI refresh path.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma separated home sizes")
+    parser.add_argument("--max-size", type=int, help="skip sizes above this")
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest is kept")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME, help="seconds timed per measurement")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs="+", metavar="JSON",
+                        help="baseline results to compare against; with a second file, compare the two without running")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="slowdown reported as a regression")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes a baseline and at most one more results file")
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as file:
+            baseline = json.load(file)
+        with open(args.compare[1]) as file:
+            current = json.load(file)
+        return 1 if compare(baseline, current, args.tolerance) else 0
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.max_size is not None:
+        sizes = [size for size in sizes if size <= args.max_size]
+
+    names = None
+    if args.only:
+        names = args.only.split(",")
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    current = run_suite(sizes, names, args.repeat, args.min_time)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare[0]) as file:
+            baseline = json.load(file)
+        print()
+        return 1 if compare(baseline, current, args.tolerance) else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
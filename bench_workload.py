@@ -0,0 +1,41 @@
+import argparse
+import sys
+
+from smart_home_workload import HOUR, HOURLY_LOAD, WorkloadGenerator, read_trace, replay, write_trace
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Record synthetic SmartHome workloads and replay them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a trace of a generated workload")
+    generate.add_argument("output", help="trace file (JSON lines)")
+    generate.add_argument("--devices", type=int, default=1000, help="devices in the home at the start")
+    generate.add_argument("--hours", type=float, default=24, help="simulated time covered by the trace")
+    generate.add_argument("--rate", type=float, default=1.0, help=f"commands per second at an hour with load 1.0; the busiest evening hours run at {max(HOURLY_LOAD):g} times that")
+    generate.add_argument("--option-churn", type=float, default=0.2, help="share of option changes outside the evening")
+    generate.add_argument("--device-churn", type=float, default=0.01, help="share of device adds and removes")
+    generate.add_argument("--seed", type=int, default=1)
+
+    run = commands.add_parser("replay", help="replay a trace against a fresh home and report latency")
+    run.add_argument("trace")
+    pace = run.add_mutually_exclusive_group()
+    pace.add_argument("--rate", type=float, help="commands per second; as fast as possible without")
+    pace.add_argument("--speed", type=float, help="follow the trace timing, this many times faster")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        generator = WorkloadGenerator(args.devices, args.rate, args.option_churn, args.device_churn, seed = args.seed)
+        count = write_trace(args.output, generator.header(), generator.commands(args.hours * HOUR))
+        print(f"{count} commands over {args.hours:g}h written to {args.output}")
+        return 0
+
+    header, trace = read_trace(args.trace)
+    print(f"Replaying {len(trace)} commands against {len(header['devices'])} devices")
+    print(replay(header, trace, rate = args.rate, speed = args.speed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,85 @@
+import inspect
+
 class SmartDeviceBase:
+    __slots__ = ("_switch_on", "_option", "_watchers", "_text")
+
+    # Compiled once per subclass by _compile_validator().
+    _valid_options = ()
+    _option_label_text = ""
+    _valid_range_text = ""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile_validator()
+
+    @classmethod
+    def _compile_validator(cls):
+        try:
+            valid = cls._class_hook("_valid_range")
+        except NotImplementedError:
+            return
+
+        # Large integer ranges already have O(1) membership, small domains become a frozenset.
+        if isinstance(valid, range) and len(valid) > 4096:
+            cls._valid_options = valid
+        else:
+            cls._valid_options = frozenset(valid)
+
+        cls._option_label_text = cls._class_hook("_option_label")
+        cls._valid_range_text = cls._class_hook("_valid_range_str")
+
+    @classmethod
+    def _class_hook(cls, name):
+        # Device classes written before the hooks became static define them as instance methods;
+        # those are called on a bare instance, since they only return constants.
+        hook = inspect.getattr_static(cls, name)
+        if isinstance(hook, (staticmethod, classmethod)):
+            return getattr(cls, name)()
+        return hook(cls.__new__(cls))
+
+    @classmethod
+    def _accepts(cls, value):
+        try:
+            return value in cls._valid_options
+        except TypeError:
+            return False
+
+    @classmethod
+    def _invalid_option(cls, value):
+        return ValueError(f"The {cls._option_label_text} is {value}, which is not valid {cls._valid_range_text}")
+
     def __init__(self, option):
-        if option not in self._valid_range():
-            raise ValueError(f"The {self._option_label()} is {option}, which is not valid {self._valid_range_str()}")
-        
-        self.switch_on = False
-        self.option = option
+        if not self._accepts(option):
+            raise self._invalid_option(option)
+
+        self._watchers = ()
+        self._switch_on = False
+        self._option = option
+        # Cached __str__, cleared whenever the switch or option changes.
+        self._text = None
+
+    def add_watcher(self, watcher):
+        self._watchers += (watcher,)
+
+    def remove_watcher(self, watcher):
+        self._watchers = tuple(w for w in self._watchers if w is not watcher)
+
+    @property
+    def switch_on(self):
+        return self._switch_on
+
+    @switch_on.setter
+    def switch_on(self, value):
+        old = self._switch_on
+
+        for watcher in self._watchers:
+            watcher.before_device_change(self, "switch_on", old, value)
+
+        self._switch_on = value
+        self._text = None
+
+        for watcher in self._watchers:
+            watcher.on_device_changed(self, "switch_on", old, value)
 
     @property
     def option(self):
@@ -12,30 +87,85 @@ class SmartDeviceBase:
     
     @option.setter
     def option(self, value):
-        if value not in self._valid_range():
-            raise ValueError(f"The {self._option_label()} is {value}, which is not valid {self._valid_range_str()}")
-        
+        try:
+            valid = value in self._valid_options
+        except TypeError:
+            valid = False
+
+        if not valid:
+            raise self._invalid_option(value)
+
+        # Unwatched devices skip the notification loops, which cost more than the check itself for
+        # small domains like SmartDoor's two values.
+        watchers = self._watchers
+        if not watchers:
+            self._option = value
+            self._text = None
+            return
+
+        old = self._option
+
+        for watcher in watchers:
+            watcher.before_device_change(self, "option", old, value)
+
         self._option = value
+        self._text = None
+
+        for watcher in watchers:
+            watcher.on_device_changed(self, "option", old, value)
 
     def toggle_switch(self):
-        self.switch_on = not self.switch_on
+        self.switch_on = not self._switch_on
+
+    # Trusted paths for callers that already validated the change, e.g. SmartHome batches.
+    def _apply_switch(self, value):
+        old = self._switch_on
+        self._switch_on = value
+        self._text = None
+
+        for watcher in self._watchers:
+            watcher.on_device_changed(self, "switch_on", old, value)
+
+    def _apply_option(self, value):
+        old = self._option
+        self._option = value
+        self._text = None
+
+        for watcher in self._watchers:
+            watcher.on_device_changed(self, "option", old, value)
+
+    @staticmethod
+    def _power_draw(switch_on, option):
+        return 0
     
-    def __str__(self):
-        device_status = "on" if self.switch_on else "off"
+    @classmethod
+    def _describe(cls, switch_on, option):
+        device_status = "on" if switch_on else "off"
+
+        return f"{cls.__name__} is {device_status} with {cls._option_label_text} {option}"
 
-        return f"{self.__class__.__name__} is {device_status} with {self._option_label()} {self.option}"
+    def __str__(self):
+        text = self._text
+        if text is None:
+            text = self._text = self._describe(self._switch_on, self._option)
+        return text
     
     
-    def _valid_range(self):
+    @staticmethod
+    def _valid_range():
         raise NotImplementedError
 
-    def _valid_range_str(self):
+    @staticmethod
+    def _valid_range_str():
         raise NotImplementedError
     
-    def _option_label(self):
+    @staticmethod
+    def _option_label():
         raise NotImplementedError
 
 class SmartPlug(SmartDeviceBase):
+    __slots__ = ()
+
     def __init__(self, consumption_rate: int):
         super().__init__(consumption_rate)
     
@@ -47,13 +177,20 @@ class SmartPlug(SmartDeviceBase):
     def consumption_rate(self, value):
         self.option = value
 
-    def _valid_range(self):
+    @staticmethod
+    def _power_draw(switch_on, option):
+        return option if switch_on else 0
+
+    @staticmethod
+    def _valid_range():
         return range(0, 151)
 
-    def _valid_range_str(self):
+    @staticmethod
+    def _valid_range_str():
         return f"(0 - 150)"
     
-    def _option_label(self):
+    @staticmethod
+    def _option_label():
         return "consumption rate"
         
             
@@ -108,6 +245,8 @@ def test_smart_plug():
         print(f"Test failed: {str(e)}")
 
 class SmartTV(SmartDeviceBase):
+    __slots__ = ()
+
     def __init__(self, channel : int = 1):
         super().__init__(channel)
 
@@ -119,16 +258,21 @@ class SmartTV(SmartDeviceBase):
     def channel(self, value):
         self.option = value
     
-    def _valid_range(self):
+    @staticmethod
+    def _valid_range():
         return range(1, 735)
     
-    def _valid_range_str(self):
+    @staticmethod
+    def _valid_range_str():
         return f"(1 - 734)"
     
-    def _option_label(self):
+    @staticmethod
+    def _option_label():
         return "channel"
     
 class SmartDoor(SmartDeviceBase):
+    __slots__ = ()
+
     def __init__(self, locked : bool = True):
         super().__init__(locked)
 
@@ -140,15 +284,155 @@ class SmartDoor(SmartDeviceBase):
     def locked(self, value):
         self.option = value
     
-    def _valid_range(self):
+    @staticmethod
+    def _valid_range():
         return [True, False]
     
-    def _valid_range_str(self):
+    @staticmethod
+    def _valid_range_str():
         return f"True or False"
     
-    def _option_label(self):
+    @staticmethod
+    def _option_label():
         return "locked"
 
+class DeviceType:
+    __slots__ = ("device_class", "name", "code", "option_attr", "setter", "validator",
+                 "prompt", "option_kind", "min_value", "max_value", "choices")
+
+    def __init__(self, device_class, code: int, option_attr: str, prompt: str):
+        self.device_class = device_class
+        self.name = device_class.__name__
+        self.code = code
+        self.option_attr = option_attr
+        self.setter = getattr(device_class, option_attr).fset
+        self.validator = device_class._accepts
+        self.prompt = prompt
+
+        valid = device_class._valid_options
+        self.min_value = self.max_value = None
+        self.choices = None
+
+        if isinstance(valid, range):
+            self.option_kind = "int"
+            self.min_value = min(valid[0], valid[-1])
+            self.max_value = max(valid[0], valid[-1])
+        elif all(type(value) is bool for value in valid):
+            self.option_kind = "bool"
+        elif all(type(value) is int for value in valid):
+            self.option_kind = "int"
+            self.min_value = min(valid)
+            self.max_value = max(valid)
+        else:
+            self.option_kind = "choice"
+            self.choices = tuple(valid)
+
+
+# Lookups used for dispatch; every entry is resolved once, at registration.
+DEVICE_TYPES = {}
+DEVICE_TYPES_BY_NAME = {}
+DEVICE_TYPES_BY_CODE = {}
+
+# Codes are stored in one byte by snapshots and the event log, and as int8 by the columnar home.
+MAX_DEVICE_CODE = 127
+
+def register_device_type(device_class, option_attr: str, prompt: str, code: int = None):
+    if code is None:
+        code = next((code for code in range(MAX_DEVICE_CODE + 1) if code not in DEVICE_TYPES_BY_CODE), None)
+        if code is None:
+            raise ValueError(f"No device type codes left; all {MAX_DEVICE_CODE + 1} are in use")
+
+    if isinstance(code, bool) or not isinstance(code, int) or not 0 <= code <= MAX_DEVICE_CODE:
+        raise ValueError(f"Device type code {code!r} is not valid (0 - {MAX_DEVICE_CODE})")
+
+    if code in DEVICE_TYPES_BY_CODE and DEVICE_TYPES_BY_CODE[code].device_class is not device_class:
+        raise ValueError(f"Device type code {code} is already used by {DEVICE_TYPES_BY_CODE[code].name}")
+
+    if device_class.__name__ in DEVICE_TYPES_BY_NAME and DEVICE_TYPES_BY_NAME[device_class.__name__].device_class is not device_class:
+        raise ValueError(f"Device type {device_class.__name__} is already registered")
+
+    device_type = DeviceType(device_class, code, option_attr, prompt)
+    DEVICE_TYPES[device_class] = device_type
+    DEVICE_TYPES_BY_NAME[device_type.name] = device_type
+    DEVICE_TYPES_BY_CODE[code] = device_type
+    return device_type
+
+register_device_type(SmartPlug, "consumption_rate", "Enter consumption rate (0-150W):", code=0)
+register_device_type(SmartTV, "channel", "Enter channel (1-734):", code=1)
+register_device_type(SmartDoor, "locked", "Is the door locked? (yes/no):", code=2)
+
+def test_device_registry():
+
+    print("\n Testing the device type registry")
+
+    class SmartLight(SmartDeviceBase):
+        __slots__ = ()
+
+        def __init__(self, brightness: int = 100):
+            super().__init__(brightness)
+
+        @property
+        def brightness(self):
+            return self.option
+
+        @brightness.setter
+        def brightness(self, value):
+            self.option = value
+
+        @staticmethod
+        def _valid_range():
+            return range(0, 101)
+
+        @staticmethod
+        def _valid_range_str():
+            return "(0 - 100)"
+
+        @staticmethod
+        def _option_label():
+            return "brightness"
+
+    light_type = register_device_type(SmartLight, "brightness", "Enter brightness (0-100):")
+
+    for device_type in DEVICE_TYPES.values():
+        print(f"{device_type.code}: {device_type.name} sets {device_type.option_attr}, {device_type.option_kind} option")
+
+    light = SmartLight()
+    light_type.setter(light, 40)
+    print(light)
+
+    try:
+        light_type.setter(light, 140)
+    except ValueError as e:
+        print(f"Invalid Input: {str(e)}")
+
+    for code in (0, 300):
+        try:
+            register_device_type(SmartLight, "brightness", "Enter brightness (0-100):", code=code)
+        except ValueError as e:
+            print(f"Invalid registration: {str(e)}")
+
+    del DEVICE_TYPES[SmartLight], DEVICE_TYPES_BY_NAME["SmartLight"], DEVICE_TYPES_BY_CODE[light_type.code]
+
+    # Written the older way, with the range hooks as instance methods.
+    class SmartFan(SmartDeviceBase):
+        __slots__ = ()
+
+        def _valid_range(self):
+            return range(0, 4)
+
+        def _valid_range_str(self):
+            return "(0 - 3)"
+
+        def _option_label(self):
+            return "speed"
+
+    fan = SmartFan(2)
+    print(fan)
+    try:
+        fan.option = 5
+    except ValueError as e:
+        print(f"Invalid Input: {str(e)}")
+
 def test_custom_device():
     
     try:
@@ -235,6 +519,7 @@ def test_custom_device():
 if __name__ == "__main__":
     test_smart_plug()
     test_custom_device()
+    test_device_registry()
 
 
 
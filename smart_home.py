@@ -1,64 +1,602 @@
-from smart_devices import SmartPlug, SmartTV, SmartDoor
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES
+from smart_home_events import (
+    DeviceToggled, OptionChanged, DeviceAdded, DeviceRemoved, LimitChanged, BudgetChanged, ChangeBatch
+)
+
+# Holes left by removed devices are compacted away once there are more of them than this and than devices.
+COMPACT_MIN_HOLES = 64
+
+
+class OptionIndex:
+    # Device ids of one class and switch state, bucketed by option. Options are small bounded values,
+    # so adding or moving a device is a dict update; only a value not seen before goes into the
+    # sorted list of options, which stays as short as the option range.
+    __slots__ = ("buckets", "options")
+
+    def __init__(self):
+        self.buckets = {}
+        self.options = []
+
+    def add(self, option, device_id):
+        bucket = self.buckets.get(option)
+        if bucket is None:
+            bucket = self.buckets[option] = {}
+            insort(self.options, option)
+        bucket[device_id] = None
+
+    def remove(self, option, device_id):
+        bucket = self.buckets[option]
+        del bucket[device_id]
+        if not bucket:
+            del self.buckets[option]
+            del self.options[bisect_left(self.options, option)]
+
+    def ids(self, min_option=None, max_option=None):
+        # Ordered by option, then id.
+        options = self.options
+        start = 0 if min_option is None else bisect_left(options, min_option)
+        stop = len(options) if max_option is None else bisect_right(options, max_option)
+
+        result = []
+        for option in options[start:stop]:
+            result.extend(sorted(self.buckets[option]))
+        return result
+
+
+class LiveSlots:
+    # A Fenwick tree counting the live slots, so the n-th device is found in O(log n) however many
+    # holes removals have left. Appending a slot or emptying one is O(log n) as well.
+    __slots__ = ("tree",)
+
+    def __init__(self, slot_ids):
+        # Built in O(n): each node adds its own slot and passes its total on to its parent.
+        tree = [0] + [int(device_id is not None) for device_id in slot_ids]
+        for node in range(1, len(tree)):
+            parent = node + (node & -node)
+            if parent < len(tree):
+                tree[parent] += tree[node]
+        self.tree = tree
+
+    def _prefix(self, node):
+        total = 0
+        while node > 0:
+            total += self.tree[node]
+            node -= node & -node
+        return total
+
+    def append(self):
+        # The new node covers slots (node - lowbit, node]; all but the new slot are already in the tree.
+        node = len(self.tree)
+        self.tree.append(1 + self._prefix(node - 1) - self._prefix(node - (node & -node)))
+
+    def remove(self, slot):
+        tree = self.tree
+        node = slot + 1
+        while node < len(tree):
+            tree[node] -= 1
+            node += node & -node
+
+    def find(self, index):
+        # The slot of the index-th live device, by walking down from the largest power of two.
+        tree = self.tree
+        node = 0
+        remaining = index + 1
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            child = node + step
+            if child < len(tree) and tree[child] < remaining:
+                node = child
+                remaining -= tree[child]
+            step >>= 1
+        return node
+
 
 class SmartHome:
-    def __init__(self, max_limit = 5):
-        self.devices = []
+    def __init__(self, max_limit = 5, power_budget = None):
+        # Optional write-ahead journal (see smart_home_log), told about every change.
+        self.journal = None
+        self._journal_muted = False
+        # Cleared by unchecked_budget() while applying changes that were checked elsewhere.
+        self._budget_enforced = True
+
+        # Change subscribers get typed events as they happen; coalescing ones get one ChangeBatch per operation.
+        self._subscribers = ()
+        self._coalescing = ()
+        self._batch_depth = 0
+        self._pending_batch = None
+
+        self._max_limit = None
+        self._power_budget = None
         self.max_limit = max_limit
+        self.power_budget = power_budget
+
+        # Devices live in slots, in the order they were added (which is id order); removing one
+        # leaves a hole, and holes are squeezed out once they outnumber the devices.
+        self._slots = []
+        self._slot_ids = []
+        self._id_to_slot = {}
+        self._holes = 0
+        self._next_id = 1
+        # Built the first time a device is looked up by index while there are holes.
+        self._live_slots = None
+
+        # (device class, switch state) -> OptionIndex of the device ids.
+        self._index = {}
+        self._ids_by_device = {}
+
+        # Running aggregates, adjusted on every change so reads are O(1).
+        self._total_draw = 0
+        self._devices_on = 0
+        self._type_counts = {}
+
+    def __len__(self):
+        return len(self._id_to_slot)
+
+    @property
+    def max_limit(self):
+        return self._max_limit
+
+    @max_limit.setter
+    def max_limit(self, value):
+        # Journaled before it is applied, so a value the journal cannot record leaves the home unchanged.
+        if self.journal is not None:
+            self.journal.limit_changed(value)
+        old, self._max_limit = self._max_limit, value
+        if self._subscribers or self._coalescing:
+            self._publish(LimitChanged(old, value))
+
+    @property
+    def power_budget(self):
+        return self._power_budget
+
+    @power_budget.setter
+    def power_budget(self, value):
+        if self.journal is not None:
+            self.journal.budget_changed(value)
+        old, self._power_budget = self._power_budget, value
+        if self._subscribers or self._coalescing:
+            self._publish(BudgetChanged(old, value))
+
+    @property
+    def devices(self):
+        return [device for device in self._slots if device is not None]
+
+    @property
+    def total_power_draw(self):
+        return self._total_draw
+
+    @property
+    def devices_on(self):
+        return self._devices_on
+
+    def count_of(self, device_type):
+        return self._type_counts.get(device_type, 0)
+
+    def type_counts(self):
+        return dict(self._type_counts)
+
+    def device_ids(self):
+        return [device_id for device_id in self._slot_ids if device_id is not None]
+
+    def items(self):
+        for device_id, device in zip(self._slot_ids, self._slots):
+            if device is not None:
+                yield device_id, device
 
-    
     def add_device(self, device: object):
-        if len(self.devices) < self.max_limit:
-            self.devices.append(device)
-        else:
+        if len(self._id_to_slot) >= self.max_limit:
             raise ValueError("Max limit reached, cannot add more devices")
 
-    def get_device(self, index: int):
+        if device in self._ids_by_device:
+            raise ValueError("Device is already in this home")
 
-        if 0 <= index < len(self.devices):
-            return self.devices[index]
-        else:
-            raise IndexError("Cannot get device. Index out of bound")
+        draw = device._power_draw(device.switch_on, device.option)
+        self._check_power_budget(self._total_draw + draw)
+
+        return self._insert(device)
+
+    def _insert(self, device, device_id=None):
+        if device_id is None:
+            device_id = self._next_id
+        self._next_id = max(self._next_id, device_id + 1)
+
+        slot = len(self._slots)
+        self._slots.append(device)
+        self._slot_ids.append(device_id)
+        if self._live_slots is not None:
+            self._live_slots.append()
+
+        self._id_to_slot[device_id] = slot
+        self._ids_by_device[device] = device_id
+        self._index_insert(device_id, type(device), device.switch_on, device.option)
+        self._count_device(device, 1)
+        device.add_watcher(self)
+
+        if self.journal is not None:
+            self.journal.device_added(device_id, device)
+        if self._subscribers or self._coalescing:
+            self._publish(DeviceAdded(device_id, device))
+        return device_id
+
+    def add_devices(self, devices):
+        devices = list(devices)
+
+        if len(self._id_to_slot) + len(devices) > self.max_limit:
+            raise ValueError("Max limit reached, cannot add more devices")
+
+        if len(set(devices)) != len(devices) or any(device in self._ids_by_device for device in devices):
+            raise ValueError("Device is already in this home")
+
+        added_draw = sum(device._power_draw(device.switch_on, device.option) for device in devices)
+        self._check_power_budget(self._total_draw + added_draw)
+
+        self._batch_depth += 1
+        try:
+            return [self._insert(device) for device in devices]
+        finally:
+            self._end_batch()
+
+    @property
+    def next_device_id(self):
+        return self._next_id
+
+    def restore_devices(self, devices, next_device_id: int = 1):
+        # Puts back (device id, device) pairs saved elsewhere, e.g. in a snapshot; limits were checked when they were first added.
+        devices = list(devices)
+
+        seen = set()
+        for device_id, device in devices:
+            if device_id in self._id_to_slot or device_id in seen or device in self._ids_by_device:
+                raise ValueError(f"Device {device_id} is already in this home")
+            seen.add(device_id)
+
+        # Ids older than the newest device (or out of order) are put back in their place by id.
+        device_ids = [device_id for device_id, _ in devices]
+        newest = next((device_id for device_id in reversed(self._slot_ids) if device_id is not None), 0)
+        in_order = all(a < b for a, b in zip(device_ids, device_ids[1:])) and (not device_ids or device_ids[0] > newest)
+
+        self._batch_depth += 1
+        try:
+            for device_id, device in devices:
+                self._insert(device, device_id)
+        finally:
+            if not in_order:
+                self._compact_slots()
+            self._end_batch()
+
+        self._next_id = max(self._next_id, next_device_id)
+
+    def get_device_by_id(self, device_id: int):
+        slot = self._id_to_slot.get(device_id)
+
+        if slot is None:
+            raise KeyError(f"Cannot get device. No device with id {device_id}")
+
+        return self._slots[slot]
+
+    def toggle_device_by_id(self, device_id: int):
+        self.get_device_by_id(device_id).toggle_switch()
+
+    def remove_device_by_id(self, device_id: int):
+        slot = self._id_to_slot.pop(device_id, None)
+
+        if slot is None:
+            raise KeyError(f"Cannot remove device. No device with id {device_id}")
+
+        device = self._slots[slot]
+        self._slots[slot] = None
+        self._slot_ids[slot] = None
+        self._holes += 1
+        if self._live_slots is not None:
+            self._live_slots.remove(slot)
+        if self._holes > COMPACT_MIN_HOLES and self._holes > len(self._id_to_slot):
+            self._compact_slots()
+
+        device.remove_watcher(self)
+        del self._ids_by_device[device]
+        self._index_remove(device_id, type(device), device.switch_on, device.option)
+        self._count_device(device, -1)
+
+        if self.journal is not None:
+            self.journal.device_removed(device_id)
+        if self._subscribers or self._coalescing:
+            self._publish(DeviceRemoved(device_id, device))
+        return device
+
+    def update_option_by_id(self, device_id: int, value):
+        device = self.get_device_by_id(device_id)
+        device_type = DEVICE_TYPES.get(type(device))
+
+        if device_type is None:
+            raise ValueError("No such type available")
+
+        device_type.setter(device, value)
+
+    def device_id_at(self, index: int, action: str = "get"):
+        if not 0 <= index < len(self._id_to_slot):
+            raise IndexError(f"Cannot {action} device. Index out of bound")
+
+        # Without holes the slot is the index; otherwise the live slots are counted in the tree.
+        if not self._holes:
+            return self._slot_ids[index]
+
+        if self._live_slots is None:
+            self._live_slots = LiveSlots(self._slot_ids)
+        return self._slot_ids[self._live_slots.find(index)]
+
+    def _compact_slots(self):
+        # Drops the holes and puts the devices in id order, renumbering their slots.
+        live = sorted((device_id, device) for device_id, device in zip(self._slot_ids, self._slots) if device is not None)
+        self._slot_ids = [device_id for device_id, _ in live]
+        self._slots = [device for _, device in live]
+        self._id_to_slot = {device_id: slot for slot, device_id in enumerate(self._slot_ids)}
+        self._holes = 0
+        self._live_slots = None
+
+    def get_device(self, index: int):
+        return self.get_device_by_id(self.device_id_at(index))
 
     def toggle_device(self, index: int):
-        self.devices[index].toggle_switch()
+        self.toggle_device_by_id(self.device_id_at(index, "toggle"))
     
     def remove_device(self, index: int):
-        if 0 <= index < len(self.devices):
-            del self.devices[index]
-        else:
-            raise IndexError("Cannot remove device. Index out of bound")
+        self.remove_device_by_id(self.device_id_at(index, "remove"))
         
     def switch_all_on(self):
-        for device in self.devices:
-            if not device.switch_on:
-                device.toggle_switch()
+        devices = [self.get_device_by_id(device_id) for device_id in self.query(switch_on=False)]
+
+        # Check the final draw up front so a budget failure leaves every device untouched.
+        added_draw = sum(device._power_draw(True, device.option) for device in devices)
+        self._check_power_budget(self._total_draw + added_draw)
+
+        self._switch_all(devices, True)
     
     def switch_all_off(self):
-        for device in self.devices:
-            if device.switch_on:
-                device.toggle_switch()
+        self._switch_all([self.get_device_by_id(device_id) for device_id in self.query(switch_on=True)], False)
+
+    def _switch_all(self, devices, switch_on):
+        # The journal gets one record for the whole operation rather than one per device, written
+        # before the batch is published so whatever subscribers do in response is logged after it.
+        self._batch_depth += 1
+        self._journal_muted = True
+        try:
+            for device in devices:
+                device._apply_switch(switch_on)
+            self._journal_muted = False
+            if self.journal is not None:
+                self.journal.all_switched(switch_on)
+        finally:
+            self._journal_muted = False
+            self._end_batch()
+
+    def toggle_devices(self, device_ids):
+        # An id listed twice is toggled twice, which leaves it unchanged.
+        flips = {}
+        for device_id in device_ids:
+            flips[device_id] = not flips.get(device_id, False)
+
+        devices = [self.get_device_by_id(device_id) for device_id, flip in flips.items() if flip]
+
+        draw_change = sum(
+            device._power_draw(not device.switch_on, device.option) - device._power_draw(device.switch_on, device.option)
+            for device in devices
+        )
+        self.check_draw_change(draw_change)
+
+        self._batch_depth += 1
+        try:
+            for device in devices:
+                device._apply_switch(not device.switch_on)
+        finally:
+            self._end_batch()
+
+    def update_options(self, updates):
+        if hasattr(updates, "items"):
+            updates = updates.items()
+
+        # Later updates to the same device win, as they would in a loop of update_option_by_id calls.
+        changes = {}
+        for device_id, value in updates:
+            device = self.get_device_by_id(device_id)
+            device_type = DEVICE_TYPES.get(type(device))
+
+            if device_type is None:
+                raise ValueError("No such type available")
+
+            if not device_type.validator(value):
+                raise type(device)._invalid_option(value)
+
+            changes[device_id] = (device, value)
+
+        draw_change = sum(
+            device._power_draw(device.switch_on, value) - device._power_draw(device.switch_on, device.option)
+            for device, value in changes.values()
+        )
+        self.check_draw_change(draw_change)
+
+        self._batch_depth += 1
+        try:
+            for device, value in changes.values():
+                if value != device.option:
+                    device._apply_option(value)
+        finally:
+            self._end_batch()
 
     def update_option(self, index: int, value):
-            device = self.get_device(index)
-        
-            if type(device) == SmartPlug:
-                device.consumption_rate = value
-            elif type(device) == SmartDoor:
-                device.locked = value
-            elif type(device) == SmartTV:
-                device.channel = value
-            else:
-                raise ValueError("No such type available")
+        self.update_option_by_id(self.device_id_at(index, "update"), value)
         
     
-    def __str__(self):
-        
-        summary = [f"SmartHome with {len(self.devices)} device(s):"]
+    def _index_insert(self, device_id, device_type, switch_on, option):
+        index = self._index.get((device_type, bool(switch_on)))
+        if index is None:
+            index = self._index[(device_type, bool(switch_on))] = OptionIndex()
+        index.add(option, device_id)
+
+    def _index_remove(self, device_id, device_type, switch_on, option):
+        self._index[(device_type, bool(switch_on))].remove(option, device_id)
+
+    def _count_device(self, device, sign):
+        device_type = type(device)
+        self._type_counts[device_type] = self._type_counts.get(device_type, 0) + sign
+        self._total_draw += sign * device._power_draw(device.switch_on, device.option)
+        if device.switch_on:
+            self._devices_on += sign
+
+    def check_draw_change(self, draw_change):
+        # Raising the draw is checked against the budget; lowering it is always allowed.
+        if draw_change > 0:
+            self._check_power_budget(self._total_draw + draw_change)
+
+    def _check_power_budget(self, total_draw):
+        if self.power_budget is not None and self._budget_enforced and total_draw > self.power_budget:
+            raise ValueError(f"Power budget exceeded: total draw would be {total_draw}W, budget is {self.power_budget}W")
+
+    def before_device_change(self, device, attribute, old, new):
+        if self.power_budget is None or not self._budget_enforced:
+            return
+
+        if attribute == "switch_on":
+            old_draw = device._power_draw(old, device.option)
+            new_draw = device._power_draw(new, device.option)
+        else:
+            old_draw = device._power_draw(device.switch_on, old)
+            new_draw = device._power_draw(device.switch_on, new)
 
-        for i, device in enumerate(self.devices):
-            summary.append(f"{i+1}- {device}")
+        # Changes that lower the draw are always allowed, even above the budget.
+        if new_draw > old_draw:
+            self._check_power_budget(self._total_draw - old_draw + new_draw)
 
-        return "\n".join(summary)
+    def on_device_changed(self, device, attribute, old, new):
+        device_id = self._ids_by_device[device]
+
+        if attribute == "switch_on":
+            self._index_remove(device_id, type(device), old, device.option)
+            self._index_insert(device_id, type(device), new, device.option)
+            self._total_draw += device._power_draw(new, device.option) - device._power_draw(old, device.option)
+            self._devices_on += bool(new) - bool(old)
+        else:
+            self._index_remove(device_id, type(device), device.switch_on, old)
+            self._index_insert(device_id, type(device), device.switch_on, new)
+            self._total_draw += device._power_draw(device.switch_on, new) - device._power_draw(device.switch_on, old)
+
+        if self.journal is not None and not self._journal_muted:
+            if attribute == "switch_on":
+                self.journal.switch_changed(device_id, new)
+            else:
+                self.journal.option_changed(device_id, new)
+
+        if self._subscribers:
+            self._publish(DeviceToggled(device_id, new) if attribute == "switch_on" else OptionChanged(device_id, old, new))
+        elif self._coalescing:
+            # Only coalescing subscribers: record the id without building an event.
+            self._batch().device_changed(device_id)
+            if not self._batch_depth:
+                self._flush_batch()
+
+    def subscribe(self, callback, coalesce=False):
+        if coalesce:
+            self._coalescing += (callback,)
+        else:
+            self._subscribers += (callback,)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers = tuple(subscriber for subscriber in self._subscribers if subscriber != callback)
+        self._coalescing = tuple(subscriber for subscriber in self._coalescing if subscriber != callback)
+
+    @contextmanager
+    def batch(self):
+        # Coalescing subscribers hear about everything changed inside the block as one ChangeBatch.
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._end_batch()
+
+    @contextmanager
+    def unchecked_budget(self):
+        # For changes already checked against a budget elsewhere, e.g. a primary's deltas: the
+        # budget is kept but not enforced, so nothing is published or journaled to lift it.
+        enforced, self._budget_enforced = self._budget_enforced, False
+        try:
+            yield self
+        finally:
+            self._budget_enforced = enforced
+
+    def _batch(self):
+        if self._pending_batch is None:
+            self._pending_batch = ChangeBatch()
+        return self._pending_batch
+
+    def _end_batch(self):
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            self._flush_batch()
+
+    def _flush_batch(self):
+        batch, self._pending_batch = self._pending_batch, None
+        if batch is None:
+            return
+
+        error = self._notify(self._coalescing, batch)
+        if error is not None:
+            raise error
+
+    def _publish(self, event):
+        error = self._notify(self._subscribers, event)
+        try:
+            if self._coalescing:
+                self._batch().add(event)
+                if not self._batch_depth:
+                    self._flush_batch()
+        finally:
+            if error is not None:
+                raise error
+
+    @staticmethod
+    def _notify(callbacks, message):
+        # Every subscriber hears about the change even if an earlier one fails; the change has
+        # already been made, so the first failure is raised to the caller once all have been called.
+        error = None
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception as exception:
+                if error is None:
+                    error = exception
+        return error
+
+    def query(self, device_type=None, switch_on=None, option=None, min_option=None, max_option=None):
+        if option is not None:
+            min_option = max_option = option
+
+        # Each index is already narrowed to one class and switch state, so only the option range is searched.
+        result = []
+        for (bucket_type, bucket_state), index in self._index.items():
+            if device_type is not None and not issubclass(bucket_type, device_type):
+                continue
+            if switch_on is not None and bucket_state != switch_on:
+                continue
+
+            result.extend(index.ids(min_option, max_option))
+
+        return result
+
+    def iter_summary(self):
+        # One line at a time, for logging or exporting a home without building the whole string.
+        yield f"SmartHome with {len(self)} device(s):"
+
+        i = 0
+        for device in self._slots:
+            if device is not None:
+                i += 1
+                yield f"{i}- {device}"
+
+    def __str__(self):
+        return "\n".join(self.iter_summary())
     
 def test_smart_home():
 
@@ -148,11 +686,225 @@ def test_smart_home():
     except IndexError as i:
         print(f"Error: {i}")
 
+    print("\n       Stable device ids       ")
+
+    tv_id, door_id = home.device_ids()
+    print(f"Device ids: {home.device_ids()}")
+
+    home.remove_device_by_id(tv_id)
+    print(f"Removed device {tv_id}, device {door_id} is still: {home.get_device_by_id(door_id)}")
+
+    new_id = home.add_device(SmartPlug(30))
+    print(f"Added device {new_id} at the end: {home.get_device(len(home) - 1)}")
+
+    try:
+        home.get_device_by_id(tv_id)
+    except KeyError as k:
+        print(f"Error: {k}")
+
     print("\n       Final State of Smart Home       ")
     print(home)
 
+    print("\n       Indexes with holes left by removals       ")
+    home = SmartHome(max_limit = 100)
+    device_ids = home.add_devices([SmartPlug(i) for i in range(40)])
+    for device_id in device_ids[::3]:
+        home.remove_device_by_id(device_id)
+    home.remove_device(0)
+    new_id = home.add_device(SmartTV(4))
+    live = home.device_ids()
+    print(f"{home._holes} hole(s), every index finds its device: {[home.device_id_at(i) for i in range(len(home))] == live}, last is {new_id}: {live[-1] == new_id}")
+
+def test_smart_home_queries():
+
+    print(f"        Smart Home queries      \n")
+
+    home = SmartHome(max_limit = 10)
+
+    plug_ids = [home.add_device(SmartPlug(rate)) for rate in (20, 101, 120, 150)]
+    tv_id = home.add_device(SmartTV(30))
+    door_ids = [home.add_device(SmartDoor(locked)) for locked in (True, False)]
+
+    home.toggle_device_by_id(plug_ids[1])
+    home.toggle_device_by_id(plug_ids[3])
+    home.toggle_device_by_id(tv_id)
+
+    print(home)
+
+    print("\n       Plugs that are on and drawing more than 100W       ")
+    for device_id in home.query(SmartPlug, switch_on=True, min_option=101):
+        print(f"{device_id}: {home.get_device_by_id(device_id)}")
+
+    print("\n       Unlocked doors       ")
+    for device_id in home.query(SmartDoor, option=False):
+        print(f"{device_id}: {home.get_device_by_id(device_id)}")
+
+    print("\n       Indexes follow setters and toggles       ")
+    home.get_device_by_id(plug_ids[0]).consumption_rate = 140
+    home.get_device_by_id(plug_ids[0]).toggle_switch()
+    home.get_device_by_id(door_ids[0]).locked = False
+    print(f"Plugs on above 100W: {home.query(SmartPlug, switch_on=True, min_option=101)}")
+    print(f"Unlocked doors: {home.query(SmartDoor, option=False)}")
+    print(f"TVs on channels 1 - 50: {home.query(SmartTV, min_option=1, max_option=50)}")
+
+    print("\n       Removed devices leave the indexes       ")
+    home.remove_device_by_id(plug_ids[3])
+    print(f"Plugs on above 100W: {home.query(SmartPlug, switch_on=True, min_option=101)}")
+    print(f"Devices off: {home.query(switch_on=False)}")
+
+def test_smart_home_aggregates():
+
+    print(f"        Smart Home aggregates      \n")
+
+    home = SmartHome(max_limit = 10, power_budget = 200)
+
+    plug_ids = [home.add_device(SmartPlug(rate)) for rate in (50, 100, 120)]
+    home.add_device(SmartTV(7))
+    home.add_device(SmartDoor())
+
+    def show():
+        print(f"Total draw: {home.total_power_draw}W, devices on: {home.devices_on}, plugs: {home.count_of(SmartPlug)}")
+
+    show()
+
+    print("\n       Toggling and updating plugs       ")
+    home.toggle_device_by_id(plug_ids[0])
+    home.toggle_device_by_id(plug_ids[1])
+    show()
+
+    home.update_option_by_id(plug_ids[0], 80)
+    show()
+
+    print("\n       Power budget guard       ")
+
+    try:
+        home.toggle_device_by_id(plug_ids[2])
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    try:
+        home.update_option_by_id(plug_ids[1], 150)
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    try:
+        home.switch_all_on()
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    print("Nothing was changed by the rejected operations")
+    show()
+
+    print("\n       Removing a plug that is on       ")
+    home.remove_device_by_id(plug_ids[1])
+    show()
+    print(f"Type counts: { {t.__name__: n for t, n in home.type_counts().items()} }")
+
+def test_smart_home_batches():
+
+    print(f"        Smart Home batches      \n")
+
+    home = SmartHome(max_limit = 6, power_budget = 250)
+
+    plug_ids = home.add_devices([SmartPlug(50), SmartPlug(100), SmartPlug(120)])
+    tv_id, door_id = home.add_devices([SmartTV(3), SmartDoor()])
+    print(home)
+
+    print("\n       Batch toggle and update       ")
+    home.toggle_devices(plug_ids[:2] + [tv_id])
+    home.update_options({plug_ids[0]: 80, tv_id: 12, door_id: False})
+    print(home)
+    print(f"Total draw: {home.total_power_draw}W")
+
+    print("\n       Batches that fail leave the home untouched       ")
+
+    try:
+        home.add_devices([SmartPlug(10), SmartTV(1)])
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    try:
+        home.update_options([(plug_ids[1], 140), (tv_id, 900)])
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    try:
+        home.toggle_devices([plug_ids[2], door_id])
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    try:
+        home.toggle_devices([door_id, 99])
+    except KeyError as k:
+        print(f"Error: {k}")
+
+    print(home)
+    print(f"Total draw: {home.total_power_draw}W")
+
+def test_smart_home_events():
+
+    print(f"        Smart Home change events      \n")
+
+    home = SmartHome(max_limit = 200)
+    events = home.subscribe(lambda event: print(f"Event: {event}"))
+    home.subscribe(lambda batch: print(batch), coalesce = True)
+
+    plug_id = home.add_device(SmartPlug(45))
+    tv_id = home.add_device(SmartTV(3))
+    home.toggle_device_by_id(plug_id)
+    home.update_option_by_id(tv_id, 7)
+    home.max_limit = 150
+    home.remove_device_by_id(plug_id)
+
+    print("\n       Bulk operations are one batch       ")
+    home.unsubscribe(events)
+    home.add_devices([SmartTV(i + 1) for i in range(100)])
+    home.switch_all_on()
+
+    print("\n       Grouping changes by hand       ")
+    with home.batch():
+        door_id = home.add_device(SmartDoor())
+        home.toggle_device_by_id(door_id)
+        home.toggle_device_by_id(tv_id)
+        home.remove_device_by_id(door_id)
+
+    print("\n       A failing subscriber       ")
+    home = SmartHome(max_limit = 20)
+    def failing(event):
+        raise RuntimeError(f"subscriber failed on {event}")
+    home.subscribe(failing)
+    home.subscribe(lambda event: print(f"Still heard: {event}"))
+    home.subscribe(failing, coalesce = True)
+    home.subscribe(lambda batch: print(f"Still heard: {batch}"), coalesce = True)
+    try:
+        home.add_device(SmartPlug(20))
+    except RuntimeError as error:
+        print(f"Raised afterwards: {error}")
+    print(f"Devices: {len(home.devices)}")
+
+def test_smart_home_summary():
+
+    print(f"\n        Smart Home summary      \n")
+
+    home = SmartHome(max_limit = 5)
+    plug_id = home.add_device(SmartPlug(45))
+    home.add_device(SmartTV(3))
+
+    for line in home.iter_summary():
+        print(f"> {line}")
+
+    print("\n       A changed device is rendered again       ")
+    home.toggle_device_by_id(plug_id)
+    home.update_option_by_id(plug_id, 60)
+    print(home)
+
 if __name__ == "__main__":
     test_smart_home()
+    test_smart_home_queries()
+    test_smart_home_aggregates()
+    test_smart_home_batches()
+    test_smart_home_events()
+    test_smart_home_summary()
 
     
 
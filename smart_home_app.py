@@ -1,10 +1,395 @@
+import queue
+import threading
 import tkinter as tk
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox, simpledialog, font
 from smart_home import SmartHome
-from smart_devices import SmartPlug, SmartTV, SmartDoor
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES, DEVICE_TYPES_BY_NAME
+
+# Homes with more rows than this only format the rows that are on screen.
+VIRTUAL_THRESHOLD = 2000
+VIRTUAL_BUFFER = 20
+
+# How often the mainloop checks for finished background work while any is outstanding.
+WORKER_POLL_MS = 50
+
+# How often the mainloop picks up changes made to the home outside the app, e.g. by other threads.
+CHANGE_POLL_MS = 200
+
+class WorkerPool:
+    def __init__(self, schedule, workers=1, lock=None, on_error=None, on_status=None):
+        self.schedule = schedule
+        self.lock = lock
+        self.on_error = on_error
+        self.on_status = on_status
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smart-home-worker")
+        # Workers only ever put events here; every counter and callback is handled on the Tk thread.
+        self._events = queue.Queue()
+        self._poll_id = None
+
+        self.pending = 0
+        self.in_flight = 0
+        self.completed = 0
+
+    @property
+    def busy(self):
+        return bool(self.pending or self.in_flight)
+
+    def submit(self, work, on_done=None, on_error=None):
+        self.pending += 1
+        self._executor.submit(self._run, work, on_done, on_error)
+        self._report()
+
+        if self._poll_id is None:
+            self._poll_id = self.schedule(WORKER_POLL_MS, self.poll)
+
+    def _run(self, work, on_done, on_error):
+        self._events.put(("started", None, None, None))
+
+        try:
+            if self.lock is None:
+                result = work()
+            else:
+                with self.lock:
+                    result = work()
+        except Exception as error:
+            self._events.put(("failed", on_error or self.on_error, error, None))
+        else:
+            self._events.put(("done", on_done, result, None))
+
+    def poll(self):
+        self._poll_id = None
+
+        while True:
+            try:
+                event, callback, value, _ = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event == "started":
+                self.pending -= 1
+                self.in_flight += 1
+                continue
+
+            self.in_flight -= 1
+            self.completed += 1
+            if callback is not None:
+                callback(value)
+
+        self._report()
+
+        # Polling stops once everything has come back, so an idle app does no work.
+        if self.busy:
+            self._poll_id = self.schedule(WORKER_POLL_MS, self.poll)
+
+    def _report(self):
+        if self.on_status is not None:
+            self.on_status(self.pending, self.in_flight)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+class DeviceList:
+    def __init__(self, listbox, scrollbar, home, schedule, virtual=None, list_font=None, lock=None):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.home = home
+        self.schedule = schedule
+        self.virtual_mode = virtual
+        self.list_font = list_font
+        self.lock = lock
+        self._view = home
+
+        # Rows are kept in device id order, so new devices are appended like before
+        # and a device's row can be found by bisecting.
+        self.row_ids = []
+
+        self._changed = set()
+        self._added = set()
+        self._removed = set()
+        self._flush_pending = False
+        self.repaints = 0
+
+        # Set when painting had to wait for a worker holding the home lock.
+        self.blocked = False
+        self._reload_pending = False
+        self._render_pending = False
+
+        # Virtual mode: the listbox holds rows [window_start, window_start + its size).
+        self.virtual = False
+        self.top = 0
+        self.window_start = 0
+        self.visible_rows = int(listbox.cget("height") or 10)
+        self.selected_id = None
+
+        self.scrollbar.configure(command=self.on_scroll)
+        self.listbox.configure(yscrollcommand=self._on_listbox_scrolled)
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<Configure>", self._on_listbox_configure)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.listbox.bind(sequence, self._on_mouse_wheel)
+
+    def row_text(self, row: int, device):
+        return f"{row+1}. {device}"
+
+    def _text(self, row: int, device_id: int):
+        try:
+            device = self._view.get_device_by_id(device_id)
+        except KeyError:
+            # Removed by another thread; the row goes once the removal is marked.
+            return f"{row+1}. (removed)"
+
+        return self.row_text(row, device)
+
+    def row_of(self, device_id: int):
+        row = bisect_left(self.row_ids, device_id)
+        if row < len(self.row_ids) and self.row_ids[row] == device_id:
+            return row
+        return None
+
+    def selected_row(self):
+        selection = self.listbox.curselection()
+        if not selection:
+            return None
+        return self.window_start + selection[0] if self.virtual else selection[0]
+
+    def _acquire(self):
+        # A thread-safe home hands out immutable snapshots, so one paint reads one consistent version.
+        snapshot = getattr(self.home, "snapshot", None)
+        self._view = self.home if snapshot is None else snapshot()
+
+        # The loop never waits on a worker; painting is retried by resume() once the work is done.
+        if self.lock is None or self.lock.acquire(blocking=False):
+            return True
+
+        self.blocked = True
+        return False
+
+    def _release(self):
+        if self.lock is not None:
+            self.lock.release()
+
+    def resume(self):
+        if not self.blocked:
+            return
+
+        self.blocked = False
+        if self._reload_pending:
+            self.reload()
+        elif self._render_pending:
+            self.render_window()
+        self._request_flush()
+
+    def reload(self):
+        if not self._acquire():
+            self._reload_pending = True
+            return
+
+        try:
+            self._reload_pending = False
+            self._reload()
+        finally:
+            self._release()
+
+    def _reload(self):
+        self._changed.clear()
+        self._added.clear()
+        self._removed.clear()
+
+        self.row_ids = sorted(self._view.device_ids())
+
+        if self.virtual_mode is None:
+            self.virtual = len(self.row_ids) > VIRTUAL_THRESHOLD
+        else:
+            self.virtual = self.virtual_mode
+
+        if self.virtual:
+            self._render_window()
+            return
+
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *(self._text(row, device_id)
+                                      for row, device_id in enumerate(self.row_ids)))
+        self.repaints += 1
+
+    def mark_changed(self, device_ids):
+        self._changed.update(device_ids)
+        self._request_flush()
+
+    def mark_added(self, device_id: int):
+        self._added.add(device_id)
+        self._request_flush()
+
+    def mark_removed(self, device_id: int):
+        self._removed.add(device_id)
+        self._request_flush()
+
+    def _request_flush(self):
+        # Everything marked before the loop goes idle is painted together.
+        if not self._flush_pending:
+            self._flush_pending = True
+            self.schedule(self.flush)
+
+    def _paint_row(self, row: int, device_id: int):
+        selected = row in self.listbox.curselection()
+        self.listbox.delete(row)
+        self.listbox.insert(row, self._text(row, device_id))
+        if selected:
+            self.listbox.selection_set(row)
+
+    def flush(self):
+        self._flush_pending = False
+        if not (self._changed or self._added or self._removed):
+            return
+
+        if not self._acquire():
+            return
+
+        try:
+            self._flush()
+        finally:
+            self._release()
+
+    def _flush(self):
+        changed, added, removed = self._changed, self._added, self._removed
+        self._changed, self._added, self._removed = set(), set(), set()
+
+        if self.virtual:
+            self._flush_virtual(changed, added, removed)
+            return
+
+        if len(changed) + len(added) + len(removed) > len(self.row_ids) // 2:
+            self._reload()
+            return
+
+        repaint_from = len(self.row_ids)
+        removed_rows = [row for row in map(self.row_of, removed) if row is not None]
+        for row in sorted(removed_rows, reverse=True):
+            self.listbox.delete(row)
+            del self.row_ids[row]
+            repaint_from = row
+
+        appended = self._new_rows(added - removed)
+        for device_id in appended:
+            row = len(self.row_ids)
+            self.row_ids.append(device_id)
+            self.listbox.insert(tk.END, self._text(row, device_id))
+
+        # Rows after a deletion shift up and need their numbers repainted.
+        for row in range(repaint_from, len(self.row_ids) - len(appended)):
+            self._paint_row(row, self.row_ids[row])
+
+        for device_id in changed - added - removed:
+            row = self.row_of(device_id)
+            if row is not None and row < repaint_from:
+                self._paint_row(row, device_id)
+
+        self.repaints += 1
+
+    def _flush_virtual(self, changed, added, removed):
+        for device_id in removed:
+            row = self.row_of(device_id)
+            if row is not None:
+                del self.row_ids[row]
+
+        self.row_ids.extend(self._new_rows(added - removed))
+
+        # Only the window is formatted, so any change inside or above it just repaints the window.
+        window = range(self.window_start, self.window_start + self.listbox.size())
+        if removed or added or any(self.row_of(device_id) in window for device_id in changed):
+            self._render_window()
+
+    def _new_rows(self, added):
+        # A reload between a device being added and its mark arriving already gave it a row.
+        return sorted(device_id for device_id in added if self.row_of(device_id) is None)
+
+    def render_window(self):
+        if not self._acquire():
+            self._render_pending = True
+            return
+
+        try:
+            self._render_pending = False
+            self._render_window()
+        finally:
+            self._release()
+
+    def _render_window(self):
+        total = len(self.row_ids)
+        self.top = max(0, min(self.top, total - self.visible_rows))
+        self.window_start = max(0, self.top - VIRTUAL_BUFFER)
+        window_end = min(total, self.top + self.visible_rows + VIRTUAL_BUFFER)
+
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *(self._text(row, self.row_ids[row])
+                                      for row in range(self.window_start, window_end)))
+        self.listbox.yview(self.top - self.window_start)
+
+        selected_row = None if self.selected_id is None else self.row_of(self.selected_id)
+        if selected_row is not None and self.window_start <= selected_row < window_end:
+            self.listbox.selection_set(selected_row - self.window_start)
+
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.visible_rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.repaints += 1
+
+    def scroll_to(self, top: int):
+        top = max(0, min(top, len(self.row_ids) - self.visible_rows))
+        if top != self.top:
+            self.top = top
+            self.render_window()
+
+    def on_scroll(self, *args):
+        if not self.virtual:
+            self.listbox.yview(*args)
+            return
+
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.row_ids)))
+        elif args[0] == "scroll":
+            step = self.visible_rows if args[2] == "pages" else 1
+            self.scroll_to(self.top + int(args[1]) * step)
+
+    def _on_listbox_scrolled(self, first, last):
+        if not self.virtual:
+            self.scrollbar.set(first, last)
+
+    def _on_mouse_wheel(self, event):
+        if not self.virtual:
+            return None
+
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.scroll_to(self.top - 3)
+        else:
+            self.scroll_to(self.top + 3)
+        return "break"
+
+    def _on_select(self, event):
+        row = self.selected_row()
+        self.selected_id = None if row is None else self.row_ids[row]
+
+    def _on_listbox_configure(self, event):
+        if self.list_font is None:
+            return
+
+        visible_rows = max(1, event.height // self.list_font.metrics("linespace"))
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            if self.virtual:
+                self.render_window()
+
+RESIZE_DEBOUNCE_MS = 100
+WRAP_STEP = 20
+
+# (max window width, button font size, list font size); None is the catch-all.
+FONT_BUCKETS = ((400, 8, 9), (600, 9, 10), (None, 10, 11))
 
 class SmartHomeApp:
-    def __init__(self, root):
+    def __init__(self, root, home=None, virtual=None, workers=1):
         self.root = root
         self.root.title("Smart Home Controller")
         self.root.geometry("600x400")
@@ -14,11 +399,14 @@ class SmartHomeApp:
         self.list_font = font.Font(family=self.default_font.cget("family"), size=self.default_font.cget("size"))
         self.button_font = font.Font(family=self.default_font.cget("family"), size=self.default_font.cget("size"))
         
-        self.home = SmartHome()
-        
-        self.home.add_device(SmartPlug(50))
-        self.home.add_device(SmartTV(10))
-        self.home.add_device(SmartDoor())
+        if home is None:
+            home = SmartHome()
+            
+            home.add_device(SmartPlug(50))
+            home.add_device(SmartTV(10))
+            home.add_device(SmartDoor())
+
+        self.home = home
         
         self.main_frame = tk.Frame(root)
         self.main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -28,23 +416,40 @@ class SmartHomeApp:
         
         self.device_listbox = tk.Listbox(
             self.device_list_frame, 
-            yscrollcommand=lambda *args: self.scrollbar.set(*args),
             font=self.list_font
         )
         self.device_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
-        self.scrollbar = tk.Scrollbar(self.device_list_frame, orient=tk.VERTICAL, command=self.device_listbox.yview)
+        self.scrollbar = tk.Scrollbar(self.device_list_frame, orient=tk.VERTICAL)
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         self.limit_label = tk.Label(self.main_frame, text=f"Max limit of devices: {self.home.max_limit}")
         self.limit_label.pack(pady=5)
+
+        self.status_label = tk.Label(self.main_frame, text="Ready")
+        self.status_label.pack()
         
         self.button_frame = tk.Frame(self.main_frame)
         self.button_frame.pack(fill=tk.X, pady=10)
         
         self.buttons = {}
         self.add_buttons()
+
+        # Changes to the home run on worker threads; the list only reads it while no worker holds this lock.
+        # A home with snapshots (see smart_home_concurrent) does its own locking and is read lock-free.
+        self.home_lock = None if hasattr(self.home, "snapshot") else threading.RLock()
+        self.workers = WorkerPool(self.root.after, workers=workers, lock=self.home_lock,
+                                  on_error=self.show_error, on_status=self.show_status)
+
+        self.device_list = DeviceList(self.device_listbox, self.scrollbar, self.home, self.root.after_idle,
+                                      virtual=virtual, list_font=self.list_font, lock=self.home_lock)
         self.update_device_list()
+
+        # The list follows the home through its change events, whoever makes the change. They can
+        # arrive on any thread, so they are queued and applied on the Tk thread.
+        self.changes = queue.Queue()
+        self.home.subscribe(self.changes.put, coalesce=True)
+        self.root.after(CHANGE_POLL_MS, self.poll_changes)
         
         for i in range(4):
             self.button_frame.columnconfigure(i, weight=1)
@@ -53,39 +458,57 @@ class SmartHomeApp:
         
         self.last_width = self.root.winfo_width()
         self.last_height = self.root.winfo_height()
+
+        self.pending_size = (self.last_width, self.last_height)
+        self.resize_after_id = None
+        self.font_sizes = None
+        self.wraplength = 120
+
+        # How many <Configure> events arrived and how many of them led to a relayout.
+        self.resize_events = 0
+        self.relayout_count = 0
+        self.on_relayout = None
     
     def on_window_resize(self, event):
  
         if event.widget == self.root:
+            # A drag sends a burst of events; only the last size is applied once the burst settles.
+            self.resize_events += 1
+            self.pending_size = (event.width, event.height)
 
-            width_change = abs(self.last_width - event.width)
-            height_change = abs(self.last_height - event.height)
-            
-            if width_change > 10 or height_change > 10:
-                self.last_width = event.width
-                self.last_height = event.height
-                
-              
-                if event.width <= 400:
-                    button_size = 8
-                    list_size = 9
-                
-                elif event.width <= 600:
-                    button_size = 9
-                    list_size = 10
-             
-                else:
-                    button_size = 10
-                    list_size = 11
-                
-             
-                self.button_font.configure(size=button_size)
-                self.list_font.configure(size=list_size)
-                
-             
-                button_width = event.width // 4 - 10  
-                for button in self.buttons.values():
-                    button.configure(wraplength=button_width)
+            if self.resize_after_id is not None:
+                self.root.after_cancel(self.resize_after_id)
+            self.resize_after_id = self.root.after(RESIZE_DEBOUNCE_MS, self.apply_resize)
+
+    def apply_resize(self):
+        self.resize_after_id = None
+        width, height = self.pending_size
+        self.last_width = width
+        self.last_height = height
+
+        for max_width, button_size, list_size in FONT_BUCKETS:
+            if max_width is None or width <= max_width:
+                break
+
+        wraplength = max(WRAP_STEP, (width // 4 - 10) // WRAP_STEP * WRAP_STEP)
+        relayout = False
+
+        if (button_size, list_size) != self.font_sizes:
+            self.font_sizes = (button_size, list_size)
+            self.button_font.configure(size=button_size)
+            self.list_font.configure(size=list_size)
+            relayout = True
+
+        if wraplength != self.wraplength:
+            self.wraplength = wraplength
+            for button in self.buttons.values():
+                button.configure(wraplength=wraplength)
+            relayout = True
+
+        if relayout:
+            self.relayout_count += 1
+            if self.on_relayout is not None:
+                self.on_relayout(width, height)
     
     def add_buttons(self):
         buttons_info = [
@@ -113,105 +536,129 @@ class SmartHomeApp:
             self.buttons[text] = button
     
     def update_device_list(self):
-        self.device_listbox.delete(0, tk.END)
-        for i, device in enumerate(self.home.devices):
-            self.device_listbox.insert(tk.END, f"{i+1}. {device}")
+        self.device_list.reload()
+
+    def show_error(self, error):
+        messagebox.showerror("Error", str(error))
+
+    def show_status(self, pending, in_flight):
+        if pending or in_flight:
+            self.status_label.config(text=f"Working: {in_flight} running, {pending} queued")
+        else:
+            self.status_label.config(text="Ready")
+
+        self.apply_changes()
+        # Painting that was put off while a worker held the home can happen now.
+        self.device_list.resume()
+
+    def apply_changes(self):
+        while True:
+            try:
+                batch = self.changes.get_nowait()
+            except queue.Empty:
+                return
+
+            for device_id in batch.removed:
+                self.device_list.mark_removed(device_id)
+            for device_id in batch.added:
+                self.device_list.mark_added(device_id)
+            if batch.changed:
+                self.device_list.mark_changed(batch.changed)
+            if batch.limit is not None:
+                self.limit_label.config(text=f"Max limit of devices: {batch.limit.new}")
+
+    def poll_changes(self):
+        self.apply_changes()
+        self.root.after(CHANGE_POLL_MS, self.poll_changes)
+
+    def selected_device_id(self):
+        # Rows must match the home before a row can be mapped to a device.
+        self.device_list.flush()
+
+        row = self.device_list.selected_row()
+        if row is None:
+            messagebox.showerror("Error", "No device selected.")
+            return None
+
+        # Rows remember device ids, which stay valid when other devices are removed.
+        return self.device_list.row_ids[row]
     
     def turn_on_all(self):
-        self.home.switch_all_on()
-        self.update_device_list()
+        self.workers.submit(self.home.switch_all_on)
     
     def turn_off_all(self):
-        self.home.switch_all_off()
-        self.update_device_list()
+        self.workers.submit(self.home.switch_all_off)
     
     def toggle_selected(self):
-        selection = self.device_listbox.curselection()
-        if not selection:
-            messagebox.showerror("Error", "No device selected.")
+        device_id = self.selected_device_id()
+        if device_id is None:
             return
         
-        index = selection[0]
-        self.home.toggle_device(index)
-        self.update_device_list()
+        self.workers.submit(lambda: self.home.toggle_device_by_id(device_id))
     
     def delete_selected(self):
-        selection = self.device_listbox.curselection()
-        if not selection:
-            messagebox.showerror("Error", "No device selected.")
+        device_id = self.selected_device_id()
+        if device_id is None:
             return
         
-        index = selection[0]
-        del self.home.devices[index]
-        self.update_device_list()
+        self.workers.submit(lambda: self.home.remove_device_by_id(device_id))
     
+    def ask_option(self, device_type):
+        if device_type.option_kind == "bool":
+            answer = simpledialog.askstring("Input", device_type.prompt)
+            return None if answer is None else answer.lower() == "yes"
+
+        if device_type.option_kind == "int":
+            return simpledialog.askinteger("Input", device_type.prompt, minvalue=device_type.min_value, maxvalue=device_type.max_value)
+
+        return simpledialog.askstring("Input", device_type.prompt)
+
     def edit_device(self):
-        selection = self.device_listbox.curselection()
-        
-        if not selection:
-            messagebox.showerror("Error", "No device selected.")
+        device_id = self.selected_device_id()
+        if device_id is None:
             return
         
-        index = selection[0]
-        device_type = self.home.devices[index].__class__.__name__
-        
-        if type(self.home.devices[index]) == SmartPlug:
-            consumption_rate = simpledialog.askinteger("Input", "Enter new consumption rate (0-150W):", minvalue=0, maxvalue=150)
-            try:
-                self.home.update_option(index, consumption_rate)
-                self.update_device_list()
-            except ValueError as e:
-                messagebox.showerror("Error", str(e))
-        
-        elif device_type == "SmartTV":
-            channel = simpledialog.askinteger("Input", "Enter channel (1-734):", minvalue=1, maxvalue=734)
-            try:
-                self.home.update_option(index, channel)
-                self.update_device_list()
-            except ValueError as e:
-                messagebox.showerror("Error", str(e))
-        
-        elif device_type == "SmartDoor":
-            locked = simpledialog.askstring("Input", "Is the door locked? (yes/no):").lower() == "yes"
-            try:
-                self.home.update_option(index, locked)
-                self.update_device_list()
-            except ValueError as e:
-                messagebox.showerror("Error", str(e))
+        try:
+            device_type = DEVICE_TYPES.get(type(self.home.get_device_by_id(device_id)))
+        except KeyError as k:
+            # A queued delete may already have removed it.
+            messagebox.showerror("Error", str(k))
+            return
+
+        if device_type is None:
+            messagebox.showerror("Error", "No such type available")
+            return
+
+        value = self.ask_option(device_type)
+        if value is None:
+            return
+
+        self.workers.submit(lambda: self.home.update_option_by_id(device_id, value))
     
     def add_device(self):
-        device_type = simpledialog.askstring("Input", "Enter device type (SmartPlug, SmartTV, SmartDoor):")
-        if device_type not in ["SmartPlug", "SmartTV", "SmartDoor"]:
+        type_name = simpledialog.askstring("Input", f"Enter device type ({', '.join(DEVICE_TYPES_BY_NAME)}):")
+        device_type = DEVICE_TYPES_BY_NAME.get(type_name)
+        if device_type is None:
             messagebox.showerror("Error", "Invalid device type.")
             return
         
-        if len(self.home.devices) >= self.home.max_limit:
+        if len(self.home) >= self.home.max_limit:
             messagebox.showerror("Error", "Device limit reached.")
             return
+
+        value = self.ask_option(device_type)
+        if value is None:
+            return
         
-        if device_type == "SmartPlug":
-            consumption_rate = simpledialog.askinteger("Input", "Enter consumption rate (0-150W):", minvalue=0, maxvalue=150)
-            device = SmartPlug(consumption_rate)
-        elif device_type == "SmartTV":
-            channel = simpledialog.askinteger("Input", "Enter channel (1-734):", minvalue=1, maxvalue=734)
-            device = SmartTV(channel)
-        else:
-            locked = simpledialog.askstring("Input", "Is the door locked? (yes/no):").lower() == "yes"
-            device = SmartDoor(locked)
-        
-        try:
-            self.home.add_device(device)
-            self.update_device_list()
-        except ValueError as e:
-            messagebox.showerror("Error", str(e))
+        self.workers.submit(lambda: self.home.add_device(device_type.device_class(value)))
     
     def set_max_limit(self):
         new_limit = simpledialog.askinteger("Set Max Limit", "Enter new max limit:", minvalue=1)
         if new_limit:
-            self.home.max_limit = new_limit
-            self.limit_label.config(text=f"Max limit of devices: {self.home.max_limit}")
+            self.workers.submit(lambda: setattr(self.home, "max_limit", new_limit))
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = SmartHomeApp(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    app.workers.shutdown(wait=False)
\ No newline at end of file
@@ -0,0 +1,198 @@
+import asyncio
+import random
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor
+
+
+class DeviceDriver:
+    async def set_switch(self, device_id: int, device, switch_on):
+        raise NotImplementedError
+
+    async def set_option(self, device_id: int, device, value):
+        raise NotImplementedError
+
+
+class SimulatedDriver(DeviceDriver):
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, failure_rate: float = 0.0, seed = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _round_trip(self, device_id: int):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+            if self._random.random() < self.failure_rate:
+                raise ConnectionError(f"Device {device_id} did not respond")
+        finally:
+            self.in_flight -= 1
+
+    async def set_switch(self, device_id: int, device, switch_on):
+        await self._round_trip(device_id)
+
+    async def set_option(self, device_id: int, device, value):
+        await self._round_trip(device_id)
+
+
+class BulkResult:
+    subject = "device"
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __str__(self):
+        summary = [f"{len(self.succeeded)} succeeded, {len(self.failed)} failed"]
+
+        for device_id, error in sorted(self.failed.items()):
+            summary.append(f"  {self.subject} {device_id}: {type(error).__name__} {error or 'no response in time'}")
+
+        return "\n".join(summary)
+
+
+class AsyncSmartHome:
+    def __init__(self, home, driver, concurrency: int = 64, timeout: float = 1.0):
+        self.home = home
+        self.driver = driver
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    async def _fan_out(self, changes):
+        # changes: (device id, device, attribute, value); the home is only updated once the device confirmed.
+        result = BulkResult()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(device_id, device, attribute, value):
+            async with semaphore:
+                try:
+                    if attribute == "switch_on":
+                        await asyncio.wait_for(self.driver.set_switch(device_id, device, value), self.timeout)
+                    else:
+                        await asyncio.wait_for(self.driver.set_option(device_id, device, value), self.timeout)
+                except Exception as error:
+                    # Whatever a driver raises fails only its own device; the other sends go on.
+                    result.failed[device_id] = error
+                    return
+
+            try:
+                setattr(device, attribute, value)
+            except Exception as error:
+                # The home can still refuse if other changes landed while the request was in flight.
+                result.failed[device_id] = error
+                return
+
+            result.succeeded.append(device_id)
+
+        await asyncio.gather(*(send(*change) for change in changes))
+        return result
+
+    def _switch_changes(self, device_ids, switch_on):
+        changes = []
+        draw_change = 0
+
+        for device_id in device_ids:
+            device = self.home.get_device_by_id(device_id)
+            target = (not device.switch_on) if switch_on is None else switch_on
+            draw_change += device._power_draw(target, device.option) - device._power_draw(device.switch_on, device.option)
+            changes.append((device_id, device, "switch_on", target))
+
+        # The whole operation is checked against the budget before any device is contacted.
+        self.home.check_draw_change(draw_change)
+        return changes
+
+    async def switch_all_on(self):
+        return await self._fan_out(self._switch_changes(self.home.query(switch_on=False), True))
+
+    async def switch_all_off(self):
+        return await self._fan_out(self._switch_changes(self.home.query(switch_on=True), False))
+
+    async def toggle_devices(self, device_ids):
+        return await self._fan_out(self._switch_changes(dict.fromkeys(device_ids), None))
+
+    async def toggle_device_by_id(self, device_id: int):
+        return await self.toggle_devices([device_id])
+
+    async def update_options(self, updates):
+        if hasattr(updates, "items"):
+            updates = updates.items()
+
+        changes = []
+        draw_change = 0
+
+        for device_id, value in dict(updates).items():
+            device = self.home.get_device_by_id(device_id)
+
+            if not type(device)._accepts(value):
+                raise type(device)._invalid_option(value)
+
+            draw_change += device._power_draw(device.switch_on, value) - device._power_draw(device.switch_on, device.option)
+            changes.append((device_id, device, "option", value))
+
+        self.home.check_draw_change(draw_change)
+        return await self._fan_out(changes)
+
+    async def update_option_by_id(self, device_id: int, value):
+        return await self.update_options([(device_id, value)])
+
+
+def test_async_smart_home():
+
+    print(f"        Async Smart Home      \n")
+
+    home = SmartHome(max_limit = 20, power_budget = 1000)
+    home.add_devices([SmartPlug(20 * i) for i in range(6)] + [SmartTV(i + 1) for i in range(4)] + [SmartDoor()])
+
+    async def scenario():
+        driver = SimulatedDriver(latency = 0.01, jitter = 0.01, seed = 7)
+        controller = AsyncSmartHome(home, driver, concurrency = 4)
+
+        print("       Switching everything on concurrently       ")
+        result = await controller.switch_all_on()
+        print(result)
+        print(f"Devices on: {home.devices_on}, at most {driver.max_in_flight} requests in flight")
+
+        print("\n       Flaky and slow devices       ")
+        flaky = AsyncSmartHome(home, SimulatedDriver(latency = 0.01, jitter = 0.05, failure_rate = 0.3, seed = 3), timeout = 0.04)
+        result = await flaky.switch_all_off()
+        print(result)
+        print(f"Devices still on: {home.query(switch_on=True)}")
+
+        print("\n       Option updates       ")
+        result = await controller.update_options({1: 150, 7: 99})
+        print(result)
+        print(home.get_device_by_id(1))
+
+        try:
+            await controller.update_option_by_id(7, 900)
+        except ValueError as e:
+            print(f"Error: {e}")
+
+        print("\n       A driver bug fails only its own device       ")
+        class BuggyDriver(SimulatedDriver):
+            async def set_switch(self, device_id, device, switch_on):
+                if device_id == 2:
+                    raise RuntimeError("driver crashed")
+                await super().set_switch(device_id, device, switch_on)
+
+        result = await AsyncSmartHome(home, BuggyDriver(latency = 0.01, seed = 7)).toggle_devices([2, 3])
+        print(result)
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_async_smart_home()
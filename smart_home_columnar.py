@@ -0,0 +1,265 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES
+
+class DeviceView:
+    # Views hold the device's id, not its row, so one taken before other devices were removed
+    # still reaches the same device; a view of a removed device raises KeyError.
+    __slots__ = ("_home", "_id")
+
+    device_type = None
+
+    def __init__(self, home, device_id: int):
+        self._home = home
+        self._id = device_id
+
+    @property
+    def device_id(self):
+        return self._id
+
+    @property
+    def switch_on(self):
+        return bool(self._home._switch[self._home._row_of(self._id)])
+
+    @switch_on.setter
+    def switch_on(self, value):
+        self._home._switch[self._home._row_of(self._id)] = value
+
+    def toggle_switch(self):
+        row = self._home._row_of(self._id)
+        self._home._switch[row] = not self._home._switch[row]
+
+    @property
+    def option(self):
+        value = int(self._home._options[self._home._row_of(self._id)])
+        return bool(value) if self.device_type.option_kind == "bool" else value
+
+    @option.setter
+    def option(self, value):
+        if not self.device_type.validator(value):
+            raise self.device_type.device_class._invalid_option(value)
+
+        self._home._options[self._home._row_of(self._id)] = value
+
+    def __str__(self):
+        return self._home._describe(self._home._row_of(self._id))
+
+
+def _make_view_class(device_type):
+    namespace = {
+        "__slots__": (),
+        "device_type": device_type,
+        device_type.option_attr: DeviceView.option,
+    }
+    return type(f"{device_type.name}View", (DeviceView,), namespace)
+
+
+# Type code -> view class, built the first time a code is stored.
+VIEW_CLASSES = {}
+
+
+class ColumnarSmartHome:
+    # Devices are stored as columns rather than objects; get_device returns a view onto a row.
+    # It covers the index-based SmartHome operations plus the bulk ones numpy is good at, and
+    # has no power budget, change events or journal, so it does not stand in for SmartHome.
+    def __init__(self, max_limit = 5, capacity: int = 1024):
+        if np is None:
+            raise ImportError("ColumnarSmartHome requires numpy")
+
+        self.max_limit = max_limit
+        self._size = 0
+        self._next_id = 1
+        # Rows stay in id order (removal shifts the rows after it up), so an id's row is found by bisecting.
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._switch = np.zeros(capacity, dtype=np.bool_)
+        self._types = np.zeros(capacity, dtype=np.int8)
+        self._options = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def devices(self):
+        return [self._view(i) for i in range(self._size)]
+
+    def _view(self, index: int):
+        return VIEW_CLASSES[int(self._types[index])](self, int(self._ids[index]))
+
+    def _row_of(self, device_id: int):
+        ids = self._ids[:self._size]
+        row = int(np.searchsorted(ids, device_id))
+        if row == self._size or ids[row] != device_id:
+            raise KeyError(f"No device with id {device_id}; it was removed")
+        return row
+
+    def _describe(self, row: int):
+        device_type = VIEW_CLASSES[int(self._types[row])].device_type
+        option = int(self._options[row])
+        if device_type.option_kind == "bool":
+            option = bool(option)
+        return device_type.device_class._describe(bool(self._switch[row]), option)
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self._switch))
+        for name in ("_ids", "_switch", "_types", "_options"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add_device(self, device: object):
+        if self._size >= self.max_limit:
+            raise ValueError("Max limit reached, cannot add more devices")
+
+        device_type = DEVICE_TYPES.get(type(device))
+        if device_type is None or device_type.option_kind == "choice":
+            raise ValueError("No such type available")
+
+        code = device_type.code
+        if code not in VIEW_CLASSES:
+            VIEW_CLASSES[code] = _make_view_class(device_type)
+
+        if self._size == len(self._switch):
+            self._grow(self._size + 1)
+
+        index = self._size
+        device_id = self._next_id
+        self._next_id += 1
+        self._ids[index] = device_id
+        self._switch[index] = device.switch_on
+        self._types[index] = code
+        self._options[index] = device.option
+        self._size += 1
+        return device_id
+
+    def get_device(self, index: int):
+
+        if 0 <= index < self._size:
+            return self._view(index)
+        else:
+            raise IndexError("Cannot get device. Index out of bound")
+
+    def get_device_by_id(self, device_id: int):
+        return self._view(self._row_of(device_id))
+
+    def toggle_device(self, index: int):
+        self.get_device(index).toggle_switch()
+
+    def remove_device(self, index: int):
+        if 0 <= index < self._size:
+            for column in (self._ids, self._switch, self._types, self._options):
+                column[index:self._size - 1] = column[index + 1:self._size]
+            self._size -= 1
+        else:
+            raise IndexError("Cannot remove device. Index out of bound")
+
+    def switch_all_on(self):
+        self._switch[:self._size] = True
+
+    def switch_all_off(self):
+        self._switch[:self._size] = False
+
+    def switch_type_on(self, device_class):
+        mask = self._types[:self._size] == DEVICE_TYPES[device_class].code
+        self._switch[:self._size][mask] = True
+
+    def switch_type_off(self, device_class):
+        mask = self._types[:self._size] == DEVICE_TYPES[device_class].code
+        self._switch[:self._size][mask] = False
+
+    def count_on(self):
+        return int(np.count_nonzero(self._switch[:self._size]))
+
+    def update_option(self, index: int, value):
+        self.get_device(index).option = value
+
+    def iter_summary(self):
+        yield f"SmartHome with {self._size} device(s):"
+
+        for i in range(self._size):
+            yield f"{i+1}- {self._describe(i)}"
+
+    def __str__(self):
+        return "\n".join(self.iter_summary())
+
+
+def test_columnar_smart_home():
+
+    print(f"        Columnar Smart Home      \n")
+
+    home = ColumnarSmartHome(max_limit = 3, capacity = 2)
+
+    print("\n       Adding devices to the Columnar Smart Home.....       ")
+
+    home.add_device(SmartPlug(120))
+    home.add_device(SmartTV(5))
+    home.add_device(SmartDoor())
+
+    print(home)
+
+    print("\n       Toggle Devices individually     ")
+
+    for i in range(0, len(home)):
+        home.toggle_device(i)
+
+    print(home)
+
+    print("\n       Switching off all the devices        ")
+    home.switch_all_off()
+    print(home)
+
+    print("\n       Switching on only the SmartTVs        ")
+    home.switch_type_on(SmartTV)
+    print(home)
+    print(f"Devices on: {home.count_on()}")
+
+    print("\n       Test Max limit constraint")
+
+    try:
+        home.add_device(SmartPlug(90))
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    print("\n       Testing update function through the views       ")
+    home.update_option(0, 150)
+    home.get_device(1).channel = 10
+    home.update_option(2, False)
+    print(home)
+
+    print("\n Updating with invalid inputs      ")
+
+    try:
+        home.update_option(0, -60)
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    try:
+        home.get_device(2).locked = "yes"
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    print("\n       Removing a device.....       ")
+    tv = home.get_device(1)
+    plug = home.get_device(0)
+    home.remove_device(0)
+    print(home)
+
+    print("\n       Views follow their device after a removal       ")
+    tv.switch_on = False
+    print(f"Device {tv.device_id}: {tv}")
+    try:
+        print(plug)
+    except KeyError as k:
+        print(f"Error: {k}")
+
+    try:
+        home.remove_device(10)
+    except IndexError as i:
+        print(f"Error: {i}")
+
+
+if __name__ == "__main__":
+    test_columnar_smart_home()
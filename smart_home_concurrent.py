@@ -0,0 +1,478 @@
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES
+
+# Snapshot rows are kept in chunks of this many; a commit copies only the chunks it touched.
+SNAPSHOT_CHUNK = 512
+
+
+class DeviceState(namedtuple("DeviceState", ("device_type", "switch_on", "option"))):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.device_type._describe(self.switch_on, self.option)
+
+
+class HomeSnapshot:
+    # An immutable copy of a home at one version; it can be read from any thread. Rows are
+    # (device id, DeviceState) in chunks of SNAPSHOT_CHUNK, None where a device was removed, and
+    # chunks nobody wrote to are shared with the snapshots before and after this one.
+    def __init__(self, version, max_limit, power_budget, chunks, count, positions, total_power_draw,
+                 devices_on, type_counts):
+        self.version = version
+        self.max_limit = max_limit
+        self.power_budget = power_budget
+        self.total_power_draw = total_power_draw
+        self.devices_on = devices_on
+        self._chunks = chunks
+        self._count = count
+        # Device id -> row position, shared with the writer: it only ever gains entries, and rows
+        # are checked against the id, so later entries are harmless here.
+        self._positions = positions
+        self._type_counts = type_counts
+
+    def __len__(self):
+        return self._count
+
+    def _rows(self):
+        for chunk in self._chunks:
+            for row in chunk:
+                if row is not None:
+                    yield row
+
+    @property
+    def devices(self):
+        return [state for _, state in self._rows()]
+
+    def count_of(self, device_type):
+        return self._type_counts.get(device_type, 0)
+
+    def type_counts(self):
+        return dict(self._type_counts)
+
+    def device_ids(self):
+        return [device_id for device_id, _ in self._rows()]
+
+    def items(self):
+        return self._rows()
+
+    def get_device_by_id(self, device_id: int):
+        position = self._positions.get(device_id)
+
+        if position is not None:
+            chunk, offset = divmod(position, SNAPSHOT_CHUNK)
+            if chunk < len(self._chunks) and offset < len(self._chunks[chunk]):
+                row = self._chunks[chunk][offset]
+                if row is not None and row[0] == device_id:
+                    return row[1]
+
+        raise KeyError(f"Cannot get device. No device with id {device_id}")
+
+    def get_device(self, index: int):
+        if not 0 <= index < self._count:
+            raise IndexError("Cannot get device. Index out of bound")
+
+        for chunk in self._chunks:
+            live = len(chunk) - chunk.count(None)
+            if index >= live:
+                index -= live
+                continue
+
+            for row in chunk:
+                if row is not None:
+                    if index == 0:
+                        return row[1]
+                    index -= 1
+
+    def query(self, device_type=None, switch_on=None, option=None, min_option=None, max_option=None):
+        if option is not None:
+            min_option = max_option = option
+
+        return [
+            device_id for device_id, state in self._rows()
+            if (device_type is None or issubclass(state.device_type, device_type))
+            and (switch_on is None or state.switch_on == switch_on)
+            and (min_option is None or state.option >= min_option)
+            and (max_option is None or state.option <= max_option)
+        ]
+
+    def iter_summary(self):
+        yield f"SmartHome with {len(self)} device(s):"
+
+        for i, (_, state) in enumerate(self._rows()):
+            yield f"{i+1}- {state}"
+
+    def __str__(self):
+        return "\n".join(self.iter_summary())
+
+
+def _row(device_id, device):
+    return device_id, DeviceState(type(device), device.switch_on, device.option)
+
+
+class ConcurrentSmartHome:
+    def __init__(self, home=None, shards: int = 16, max_limit = 5, power_budget = None):
+        self.home = SmartHome(max_limit = max_limit, power_budget = power_budget) if home is None else home
+
+        # A writer holds the shard lock of every device it touches for the whole change, and the
+        # commit lock only while the shared index and aggregates are updated.
+        self._shards = [threading.Lock() for _ in range(shards)]
+        self._commit_lock = threading.Lock()
+
+        # Seqlock for point reads of the live home: odd while a commit is in progress.
+        self._version = 0
+
+        # Copy-on-write snapshot, published by the writer at the end of every operation; readers
+        # just take the latest one. Rows keep the order devices were added in.
+        self._chunks = []
+        self._positions = {}
+        self._next_position = 0
+        self._holes = 0
+        self._snapshot = None
+        self.snapshots_published = 0
+        self._rebuild_rows()
+        self._publish()
+
+        self.home.subscribe(self._on_batch, coalesce=True)
+
+    def _shard(self, device_id: int):
+        return self._shards[device_id % len(self._shards)]
+
+    @contextmanager
+    def _commit(self):
+        with self._commit_lock:
+            self._version += 1
+            try:
+                yield self.home
+            finally:
+                self._version += 1
+
+    @contextmanager
+    def _exclusive(self):
+        # Whole-home operations take every shard, always in the same order.
+        with ExitStack() as stack:
+            for lock in self._shards:
+                stack.enter_context(lock)
+            with self._commit() as home:
+                yield home
+
+    # Snapshots, maintained on the writing thread.
+
+    def _rebuild_rows(self):
+        # Positions are handed out again from 0, in a new dict, so older snapshots keep theirs.
+        rows = [_row(device_id, device) for device_id, device in self.home.items()]
+        self._chunks = [tuple(rows[start:start + SNAPSHOT_CHUNK]) for start in range(0, len(rows), SNAPSHOT_CHUNK)]
+        self._positions = {device_id: position for position, (device_id, _) in enumerate(rows)}
+        self._next_position = len(rows)
+        self._holes = 0
+
+    def _on_batch(self, batch):
+        positions = self._positions
+        updates = {}
+
+        for device_id in batch.removed:
+            updates[positions[device_id]] = None
+            self._holes += 1
+
+        get_device = self.home.get_device_by_id
+        for device_id in batch.changed:
+            updates[positions[device_id]] = _row(device_id, get_device(device_id))
+
+        for device_id, device in batch.added.items():
+            positions[device_id] = self._next_position
+            updates[self._next_position] = _row(device_id, device)
+            self._next_position += 1
+
+        if self._holes > SNAPSHOT_CHUNK and 2 * self._holes > self._next_position:
+            self._rebuild_rows()
+        else:
+            self._update_chunks(updates)
+
+        self._publish()
+
+    def _update_chunks(self, updates):
+        # Each touched chunk is copied once, however many of its rows changed.
+        by_chunk = {}
+        for position, row in updates.items():
+            by_chunk.setdefault(position // SNAPSHOT_CHUNK, []).append((position % SNAPSHOT_CHUNK, row))
+
+        chunks = self._chunks
+        for index in sorted(by_chunk):
+            rows = list(chunks[index]) if index < len(chunks) else []
+            for offset, row in sorted(by_chunk[index], key=lambda update: update[0]):
+                if offset < len(rows):
+                    rows[offset] = row
+                else:
+                    rows.append(row)
+
+            if index < len(chunks):
+                chunks[index] = tuple(rows)
+            else:
+                chunks.append(tuple(rows))
+
+    def _publish(self):
+        home = self.home
+        self.snapshots_published += 1
+        self._snapshot = HomeSnapshot(self.snapshots_published, home.max_limit, home.power_budget, tuple(self._chunks),
+                                      len(home), self._positions, home.total_power_draw, home.devices_on,
+                                      home.type_counts())
+
+    # Readers.
+
+    def snapshot(self):
+        # Lock-free: the latest published snapshot is never changed after it is handed out.
+        return self._snapshot
+
+    def _read(self, read):
+        # Point reads of the live home are retried if a commit overlapped them.
+        while True:
+            version = self._version
+
+            if version & 1:
+                time.sleep(0)
+                continue
+
+            try:
+                result = read(self.home)
+            except (RuntimeError, KeyError, IndexError):
+                if self._version == version:
+                    raise
+                continue
+
+            if self._version == version:
+                return result
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __str__(self):
+        return str(self._snapshot)
+
+    def iter_summary(self):
+        return self._snapshot.iter_summary()
+
+    @property
+    def max_limit(self):
+        return self._snapshot.max_limit
+
+    @max_limit.setter
+    def max_limit(self, value):
+        with self._exclusive() as home:
+            home.max_limit = value
+
+    @property
+    def power_budget(self):
+        return self._snapshot.power_budget
+
+    @power_budget.setter
+    def power_budget(self, value):
+        with self._exclusive() as home:
+            home.power_budget = value
+
+    @property
+    def devices(self):
+        return self._snapshot.devices
+
+    @property
+    def total_power_draw(self):
+        return self._snapshot.total_power_draw
+
+    @property
+    def devices_on(self):
+        return self._snapshot.devices_on
+
+    def count_of(self, device_type):
+        return self._snapshot.count_of(device_type)
+
+    def type_counts(self):
+        return self._snapshot.type_counts()
+
+    def device_ids(self):
+        return self._snapshot.device_ids()
+
+    def items(self):
+        return self._snapshot.items()
+
+    def get_device_by_id(self, device_id: int):
+        return self._snapshot.get_device_by_id(device_id)
+
+    def get_device(self, index: int):
+        return self._snapshot.get_device(index)
+
+    def query(self, device_type=None, switch_on=None, option=None, min_option=None, max_option=None):
+        # The live home's index answers faster than a scan of the snapshot.
+        return self._read(lambda home: home.query(device_type, switch_on, option, min_option, max_option))
+
+    def subscribe(self, callback, coalesce=False):
+        # Events are delivered on the writing thread, while it holds the commit lock.
+        return self.home.subscribe(callback, coalesce)
+
+    def unsubscribe(self, callback):
+        self.home.unsubscribe(callback)
+
+    # Writers.
+
+    def _device(self, device_id: int):
+        # Called with the device's shard held: the device cannot be removed until it is released.
+        with self._commit_lock:
+            return self.home.get_device_by_id(device_id)
+
+    def _change_device(self, device, switch_on, option):
+        # Validation and the draw change are worked out under the shard lock alone; the commit lock
+        # covers the budget check and the shared bookkeeping. Both changes are checked together,
+        # so a failure leaves the device untouched.
+        if option != device.option:
+            device_type = DEVICE_TYPES.get(type(device))
+            if device_type is None:
+                raise ValueError("No such type available")
+            if not device_type.validator(option):
+                raise type(device)._invalid_option(option)
+
+        draw_change = device._power_draw(switch_on, option) - device._power_draw(device.switch_on, device.option)
+
+        with self._commit() as home:
+            home.check_draw_change(draw_change)
+            with home.batch():
+                if option != device.option:
+                    device._apply_option(option)
+                if switch_on != device.switch_on:
+                    device._apply_switch(switch_on)
+
+    def add_device(self, device: object):
+        # The new id is not visible to anyone until the commit, so no shard is needed.
+        with self._commit() as home:
+            return home.add_device(device)
+
+    def add_devices(self, devices):
+        with self._commit() as home:
+            return home.add_devices(devices)
+
+    def remove_device_by_id(self, device_id: int):
+        with self._shard(device_id), self._commit() as home:
+            return home.remove_device_by_id(device_id)
+
+    def toggle_device_by_id(self, device_id: int):
+        with self._shard(device_id):
+            device = self._device(device_id)
+            self._change_device(device, not device.switch_on, device.option)
+
+    def update_option_by_id(self, device_id: int, value):
+        with self._shard(device_id):
+            device = self._device(device_id)
+            self._change_device(device, device.switch_on, value)
+
+    def update_device(self, device_id: int, change):
+        # Read-modify-write of one device. change(state) runs under the device's shard lock only,
+        # so it may be slow; it returns the new switch state and option, or None to leave it alone.
+        with self._shard(device_id):
+            device = self._device(device_id)
+            update = change(DeviceState(type(device), device.switch_on, device.option))
+
+            if update is None:
+                return
+
+            switch_on, option = update
+            self._change_device(device, bool(switch_on), option)
+
+    def toggle_device(self, index: int):
+        with self._exclusive() as home:
+            home.toggle_device(index)
+
+    def remove_device(self, index: int):
+        with self._exclusive() as home:
+            return home.remove_device(index)
+
+    def update_option(self, index: int, value):
+        with self._exclusive() as home:
+            home.update_option(index, value)
+
+    def switch_all_on(self):
+        with self._exclusive() as home:
+            home.switch_all_on()
+
+    def switch_all_off(self):
+        with self._exclusive() as home:
+            home.switch_all_off()
+
+    def toggle_devices(self, device_ids):
+        with self._exclusive() as home:
+            home.toggle_devices(device_ids)
+
+    def update_options(self, updates):
+        with self._exclusive() as home:
+            home.update_options(updates)
+
+
+def test_concurrent_smart_home():
+
+    print(f"        Concurrent Smart Home      \n")
+
+    home = ConcurrentSmartHome(shards = 4, max_limit = 400, power_budget = 20000)
+    plug_ids = home.add_devices([SmartPlug(i % 150) for i in range(100)])
+    tv_ids = home.add_devices([SmartTV(i + 1) for i in range(100)])
+    door_ids = home.add_devices([SmartDoor() for _ in range(100)])
+
+    before = home.snapshot()
+
+    def toggler(device_ids):
+        for _ in range(50):
+            for device_id in device_ids:
+                home.toggle_device_by_id(device_id)
+
+    def remover(device_ids):
+        for device_id in device_ids:
+            home.remove_device_by_id(device_id)
+
+    def raise_channel(device_ids):
+        for device_id in device_ids:
+            home.update_device(device_id, lambda state: (state.switch_on, min(734, state.option + 100)))
+
+    seen = []
+
+    def reader():
+        for _ in range(200):
+            snapshot = home.snapshot()
+            # Every snapshot is internally consistent, whatever the writers are doing.
+            seen.append(len(snapshot.query(switch_on=True)) == snapshot.devices_on)
+
+    threads = [
+        threading.Thread(target=toggler, args=(plug_ids[:50],)),
+        threading.Thread(target=toggler, args=(plug_ids[50:],)),
+        threading.Thread(target=remover, args=(door_ids[::2],)),
+        threading.Thread(target=raise_channel, args=(tv_ids,)),
+        threading.Thread(target=reader),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    home.switch_all_on()
+    after = home.snapshot()
+    print(f"Before: {len(before)} device(s), {before.devices_on} on")
+    print(f"After: {len(after)} device(s), {after.devices_on} on, total draw {after.total_power_draw}W")
+    print(f"The old snapshot is unchanged: {len(before)} device(s), {before.devices_on} on")
+    print(f"Every snapshot was consistent: {all(seen)}")
+    print(f"Device {tv_ids[0]}: {home.get_device_by_id(tv_ids[0])}")
+
+    try:
+        home.toggle_device_by_id(door_ids[0])
+    except KeyError as k:
+        print(f"Error: {k}")
+
+    # Switching on and raising the option are checked against the budget together.
+    home = ConcurrentSmartHome(max_limit = 2, power_budget = 100)
+    plug_id = home.add_device(SmartPlug(50))
+    try:
+        home.update_device(plug_id, lambda state: (True, 150))
+    except ValueError as e:
+        print(f"Error: {e}")
+    print(f"Device {plug_id}: {home.get_device_by_id(plug_id)}, snapshot {home.snapshot().version}")
+
+
+if __name__ == "__main__":
+    test_concurrent_smart_home()
@@ -0,0 +1,83 @@
+from collections import namedtuple
+
+
+class DeviceToggled(namedtuple("DeviceToggled", ("device_id", "switch_on"))):
+    __slots__ = ()
+
+
+class OptionChanged(namedtuple("OptionChanged", ("device_id", "old", "new"))):
+    __slots__ = ()
+
+
+class DeviceAdded(namedtuple("DeviceAdded", ("device_id", "device"))):
+    __slots__ = ()
+
+    def __str__(self):
+        return f"DeviceAdded(device_id={self.device_id}, device={self.device})"
+
+
+class DeviceRemoved(namedtuple("DeviceRemoved", ("device_id", "device"))):
+    __slots__ = ()
+
+    def __str__(self):
+        return f"DeviceRemoved(device_id={self.device_id}, device={self.device})"
+
+
+class LimitChanged(namedtuple("LimitChanged", ("old", "new"))):
+    __slots__ = ()
+
+
+class BudgetChanged(namedtuple("BudgetChanged", ("old", "new"))):
+    __slots__ = ()
+
+
+class ChangeBatch:
+    # Everything one operation (or one SmartHome.batch() block) changed, merged per device.
+    __slots__ = ("changed", "added", "removed", "limit", "budget", "events")
+
+    def __init__(self):
+        self.changed = set()
+        self.added = {}
+        self.removed = {}
+        self.limit = None
+        self.budget = None
+        self.events = 0
+
+    def add(self, event):
+        event_type = type(event)
+
+        if event_type is DeviceToggled or event_type is OptionChanged:
+            self.device_changed(event.device_id)
+            return
+
+        self.events += 1
+        if event_type is DeviceAdded:
+            self.added[event.device_id] = event.device
+        elif event_type is DeviceRemoved:
+            # A device that came and went inside the batch was never seen by the subscriber.
+            if self.added.pop(event.device_id, None) is None:
+                self.removed[event.device_id] = event.device
+            self.changed.discard(event.device_id)
+        elif event_type is LimitChanged:
+            self.limit = event if self.limit is None else LimitChanged(self.limit.old, event.new)
+        elif event_type is BudgetChanged:
+            self.budget = event if self.budget is None else BudgetChanged(self.budget.old, event.new)
+
+    def device_changed(self, device_id: int):
+        # Same as adding a toggle or option event, without building one.
+        self.events += 1
+        if device_id not in self.added:
+            self.changed.add(device_id)
+
+    def __bool__(self):
+        return bool(self.events)
+
+    def __str__(self):
+        parts = [f"{len(self.changed)} changed", f"{len(self.added)} added", f"{len(self.removed)} removed"]
+
+        if self.limit is not None:
+            parts.append(f"limit {self.limit.old} -> {self.limit.new}")
+        if self.budget is not None:
+            parts.append(f"budget {self.budget.old} -> {self.budget.new}")
+
+        return f"ChangeBatch of {self.events} event(s): {', '.join(parts)}"
@@ -0,0 +1,379 @@
+import inspect
+import multiprocessing
+import os
+import pickle
+from collections import namedtuple
+from collections.abc import Iterable
+from contextlib import contextmanager
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, SmartDeviceBase
+from smart_home_async import BulkResult
+from smart_home_concurrent import DeviceState
+from smart_home_snapshot import device_fields, decode_device
+
+# SmartHome methods a command may call on a home by name; anything else is refused by the worker.
+HOME_METHODS = frozenset((
+    "toggle_device_by_id", "update_option_by_id", "remove_device_by_id",
+    "toggle_devices", "update_options", "switch_all_on", "switch_all_off",
+    "query", "count_of", "type_counts", "device_ids", "check_draw_change",
+))
+
+# Of those, the ones whose first argument is a collection of ids or updates.
+BULK_METHODS = frozenset(("toggle_devices", "update_options"))
+
+
+class FleetAggregates(namedtuple("FleetAggregates", ("homes", "devices", "devices_on", "total_power_draw"))):
+    __slots__ = ()
+
+    def __add__(self, other):
+        return FleetAggregates(*(mine + theirs for mine, theirs in zip(self, other)))
+
+    def __str__(self):
+        return f"{self.homes} home(s), {self.devices} device(s), {self.devices_on} on, drawing {self.total_power_draw}W"
+
+
+NO_AGGREGATES = FleetAggregates(0, 0, 0, 0)
+
+
+class FleetResult(BulkResult):
+    # Succeeded and failed are keyed by home id.
+    subject = "home"
+
+
+def _aggregates(homes):
+    return FleetAggregates(len(homes), sum(len(home) for home in homes),
+                           sum(home.devices_on for home in homes), sum(home.total_power_draw for home in homes))
+
+
+def _state(value):
+    # Devices stay in the worker; callers get a copy of their state.
+    if isinstance(value, SmartDeviceBase):
+        return DeviceState(type(value), value.switch_on, value.option)
+    return value
+
+
+def _run(homes, command):
+    operation, home_id, *args = command
+
+    if operation == "add_home":
+        if home_id in homes:
+            raise ValueError(f"Home {home_id} already exists")
+        max_limit, power_budget, devices = args
+        home = homes[home_id] = SmartHome(max_limit, power_budget)
+        return home.add_devices([decode_device(*fields) for fields in devices]) if devices else []
+
+    if operation == "homes":
+        return list(homes)
+    if operation == "aggregates":
+        return _aggregates(list(homes.values()))
+    if operation == "switch_all":
+        # Fleet-wide: each home is all-or-nothing, one failing home does not hold back the rest.
+        switch_on, = args
+        result = FleetResult()
+        for each_id, home in homes.items():
+            try:
+                home.switch_all_on() if switch_on else home.switch_all_off()
+            except ValueError as error:
+                result.failed[each_id] = error
+            else:
+                result.succeeded.append(each_id)
+        return result
+
+    home = homes.get(home_id)
+    if home is None:
+        raise KeyError(f"No home with id {home_id}")
+
+    if operation == "remove_home":
+        del homes[home_id]
+        return _aggregates([home])
+    if operation == "add_device":
+        fields, = args
+        return home.add_device(decode_device(*fields))
+    if operation == "add_devices":
+        devices, = args
+        return home.add_devices([decode_device(*fields) for fields in devices])
+    if operation == "get_device":
+        device_id, = args
+        return _state(home.get_device_by_id(device_id))
+    if operation == "home_aggregates":
+        return _aggregates([home])
+    if operation == "summary":
+        return str(home)
+    if operation == "call":
+        method, *method_args = args
+        if method not in HOME_METHODS:
+            raise ValueError(f"{method} cannot be called on a fleet home")
+        return _state(getattr(home, method)(*method_args))
+
+    raise ValueError(f"Unknown fleet operation {operation}")
+
+
+def _check_call(method, args):
+    # Caught before anything is sent, so a malformed call fails in the caller, not in a worker.
+    if method not in HOME_METHODS:
+        raise ValueError(f"{method} cannot be called on a fleet home")
+
+    inspect.signature(getattr(SmartHome, method)).bind(None, *args)
+    if method in BULK_METHODS and (not isinstance(args[0], Iterable) or isinstance(args[0], (str, bytes))):
+        raise TypeError(f"{method} takes a collection, not {type(args[0]).__name__}")
+
+
+def _portable(error):
+    # The error goes back over the pipe; one that cannot make the trip is sent as its text.
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+    return error
+
+
+def _serve(connection):
+    # One worker process: it owns its homes and runs each batch of commands in order.
+    homes = {}
+
+    while True:
+        try:
+            commands = connection.recv()
+        except EOFError:
+            break
+        if commands is None:
+            break
+
+        # A failing command is returned to its caller; it never takes the worker and its homes down.
+        results = []
+        for command in commands:
+            try:
+                results.append((True, _run(homes, command)))
+            except Exception as error:
+                results.append((False, _portable(error)))
+        connection.send(results)
+
+    connection.close()
+
+
+class Pending:
+    # The result of a command queued inside HomeManager.batch(); ready once the batch is sent.
+    __slots__ = ("_ok", "_value", "done")
+
+    def __init__(self):
+        self.done = False
+
+    def _set(self, ok, value):
+        self._ok = ok
+        self._value = value
+        self.done = True
+
+    def result(self):
+        if not self.done:
+            raise RuntimeError("The batch has not been sent yet")
+        if not self._ok:
+            raise self._value
+        return self._value
+
+
+class HomeManager:
+    def __init__(self, workers: int = None, context = None):
+        # Homes are owned by one worker process each, chosen by home id; a worker's homes never
+        # share a lock or an interpreter with another worker's.
+        context = multiprocessing.get_context(context)
+        self.workers = workers or os.cpu_count() or 1
+
+        self._connections = []
+        self._processes = []
+        for _ in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(child,), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+        self._queued = None
+        self.messages = 0
+
+    def shard_of(self, home_id):
+        return hash(home_id) % self.workers
+
+    def _send(self, queued):
+        # Every shard gets its whole batch before any reply is read, so the workers run side by side.
+        for shard, commands in queued.items():
+            self._connections[shard].send([command for command, _ in commands])
+            self.messages += 1
+
+        for shard, commands in queued.items():
+            for (_, pending), (ok, value) in zip(commands, self._connections[shard].recv()):
+                pending._set(ok, value)
+
+    def _submit(self, shard, command):
+        pending = Pending()
+
+        if self._queued is not None:
+            self._queued.setdefault(shard, []).append((command, pending))
+            return pending
+
+        self._send({shard: [(command, pending)]})
+        return pending.result()
+
+    def _broadcast(self, command):
+        queued = {shard: [(command, Pending())] for shard in range(self.workers)}
+        self._send(queued)
+        return [commands[0][1].result() for commands in queued.values()]
+
+    @contextmanager
+    def batch(self):
+        # Commands inside the block are queued per shard and sent as one message per worker on exit;
+        # each call returns a Pending whose result() is ready after the block.
+        if self._queued is not None:
+            yield
+            return
+
+        self._queued = {}
+        try:
+            yield
+            queued = self._queued
+        finally:
+            self._queued = None
+        self._send(queued)
+
+    # Commands for one home, routed to the worker that owns it.
+
+    def add_home(self, home_id, max_limit = 5, power_budget = None, devices = ()):
+        return self._submit(self.shard_of(home_id), ("add_home", home_id, max_limit, power_budget,
+                                                     [device_fields(device) for device in devices]))
+
+    def remove_home(self, home_id):
+        return self._submit(self.shard_of(home_id), ("remove_home", home_id))
+
+    def add_device(self, home_id, device):
+        return self._submit(self.shard_of(home_id), ("add_device", home_id, device_fields(device)))
+
+    def add_devices(self, home_id, devices):
+        return self._submit(self.shard_of(home_id), ("add_devices", home_id, [device_fields(device) for device in devices]))
+
+    def get_device(self, home_id, device_id: int):
+        return self._submit(self.shard_of(home_id), ("get_device", home_id, device_id))
+
+    def toggle_device(self, home_id, device_id: int):
+        return self.call(home_id, "toggle_device_by_id", device_id)
+
+    def update_option(self, home_id, device_id: int, value):
+        return self.call(home_id, "update_option_by_id", device_id, value)
+
+    def remove_device(self, home_id, device_id: int):
+        return self.call(home_id, "remove_device_by_id", device_id)
+
+    def call(self, home_id, method: str, *args):
+        _check_call(method, args)
+        return self._submit(self.shard_of(home_id), ("call", home_id, method, *args))
+
+    def home_aggregates(self, home_id):
+        return self._submit(self.shard_of(home_id), ("home_aggregates", home_id))
+
+    def summary(self, home_id):
+        return self._submit(self.shard_of(home_id), ("summary", home_id))
+
+    # Fleet-wide commands go to every worker at once and their results are merged. They are not
+    # queued by batch(), so inside one they see the fleet as of the last batch sent.
+
+    def home_ids(self):
+        return [home_id for home_ids in self._broadcast(("homes", None)) for home_id in home_ids]
+
+    def aggregates(self):
+        return sum(self._broadcast(("aggregates", None)), NO_AGGREGATES)
+
+    def switch_all_on(self):
+        return self._merge(self._broadcast(("switch_all", None, True)))
+
+    def switch_all_off(self):
+        return self._merge(self._broadcast(("switch_all", None, False)))
+
+    def _merge(self, results):
+        merged = FleetResult()
+        for result in results:
+            merged.succeeded += result.succeeded
+            merged.failed.update(result.failed)
+        return merged
+
+    def close(self):
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+
+        for process in self._processes:
+            process.join()
+
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def test_home_manager():
+
+    print(f"        Smart Home fleet      \n")
+
+    with HomeManager(workers = 2) as manager:
+        for home_id in range(1, 7):
+            manager.add_home(home_id, max_limit = 4, power_budget = 100,
+                             devices = [SmartPlug(20 * home_id), SmartTV(home_id), SmartDoor()])
+
+        print(f"Homes: {sorted(manager.home_ids())}")
+        print(manager.aggregates())
+
+        print("\n       Commands go to the worker that owns the home       ")
+        tv_id = manager.add_device(3, SmartTV(100))
+        manager.toggle_device(3, tv_id)
+        manager.update_option(3, 1, 150)
+        print(manager.summary(3))
+        print(manager.get_device(3, tv_id))
+        print(manager.home_aggregates(3))
+
+        try:
+            manager.update_option(3, 1, 500)
+        except ValueError as error:
+            print(f"Error: {error}")
+
+        try:
+            manager.call(3, "toggle_devices", 5)
+        except TypeError as error:
+            print(f"Error: {error}")
+
+        # Passes the checks but fails inside the worker, which keeps serving its homes.
+        try:
+            manager.call(3, "query", 5)
+        except TypeError as error:
+            print(f"Error: {error}")
+        print(manager.home_aggregates(3))
+
+        print("\n       A batch is one message per worker       ")
+        messages = manager.messages
+        with manager.batch():
+            toggled = [manager.toggle_device(home_id, 1) for home_id in range(1, 7)]
+            missing = manager.get_device(4, 99)
+        print(f"{len(toggled)} toggles in {manager.messages - messages} message(s)")
+        try:
+            missing.result()
+        except KeyError as error:
+            print(f"Error: {error}")
+        print(manager.aggregates())
+
+        print("\n       Fleet-wide switching       ")
+        print(manager.switch_all_on())
+        print(manager.aggregates())
+        print(manager.switch_all_off())
+        print(manager.aggregates())
+
+        print(f"\nRemoved home 6: {manager.remove_home(6)}")
+        print(manager.aggregates())
+
+
+if __name__ == "__main__":
+    test_home_manager()
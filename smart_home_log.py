@@ -0,0 +1,377 @@
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES
+from smart_home_rules import Rule, RuleEngine, shed_highest
+from smart_home_snapshot import SWITCH_ON, device_fields, decode_device, encode_snapshot, write_snapshot, load_snapshot
+
+# sequence number, operation, device id, type code, flags, value; followed by a CRC32 of those bytes
+RECORD = struct.Struct("<QBIBBi")
+CHECKSUM = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + CHECKSUM.size
+
+ADD, REMOVE, SWITCH, OPTION, ALL_ON, ALL_OFF, LIMIT, BUDGET = range(1, 9)
+
+INT32_MAX = (1 << 31) - 1
+
+
+def _record_value(value, name):
+    # Limits and budgets go in the record's signed 32-bit value field.
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= INT32_MAX:
+        raise ValueError(f"The {name} is {value!r}, which cannot be logged (a whole number from 0 to {INT32_MAX})")
+    return value
+
+
+class EventLog:
+    def __init__(self, path, sequence: int = 0, group_size: int = 64, group_interval: float = 0.05,
+                 clock=time.monotonic, on_commit=None):
+        self.path = path
+        self.sequence = sequence
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.clock = clock
+        self.on_commit = on_commit
+
+        self._file = open(path, "ab")
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._last_commit = clock()
+
+        self.size = self._file.tell()
+        self.commits = 0
+
+        # Appends only commit when the group is full or due, so a background flusher commits the
+        # tail of a burst within group_interval even if nothing else is appended.
+        self._lock = threading.Condition()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def append(self, operation: int, device_id: int = 0, code: int = 0, flags: int = 0, value: int = 0):
+        with self._lock:
+            self.sequence += 1
+            record = RECORD.pack(self.sequence, operation, device_id, code, flags, value)
+            if not self._buffer:
+                self._lock.notify()
+            self._buffer += record
+            self._buffer += CHECKSUM.pack(zlib.crc32(record))
+            self._buffered += 1
+
+            # Group commit: one fsync covers every record buffered since the last one.
+            due = self._buffered >= self.group_size or self.clock() - self._last_commit >= self.group_interval
+            if due:
+                self._write_buffer()
+
+        if due and self.on_commit is not None:
+            self.on_commit(self)
+
+    def commit(self):
+        with self._lock:
+            written = self._write_buffer()
+
+        if written and self.on_commit is not None:
+            self.on_commit(self)
+
+    def _write_buffer(self):
+        # Called with the lock held.
+        self._last_commit = self.clock()
+        if not self._buffer:
+            return False
+
+        self._file.write(self._buffer)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self.size += len(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        self.commits += 1
+        return True
+
+    def _flush_loop(self):
+        # on_commit is left to the writer's own commits, so it never runs on this thread.
+        with self._lock:
+            while not self._closed:
+                if not self._buffer:
+                    self._lock.wait()
+                    continue
+
+                self._lock.wait(self.group_interval)
+                if self._buffer and not self._closed:
+                    self._write_buffer()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        self._flusher.join()
+
+        self.commit()
+        self._file.close()
+
+    # Journal interface called by SmartHome.
+
+    def device_added(self, device_id: int, device):
+        self.append(ADD, device_id, *device_fields(device))
+
+    def device_removed(self, device_id: int):
+        self.append(REMOVE, device_id)
+
+    def switch_changed(self, device_id: int, switch_on):
+        self.append(SWITCH, device_id, flags=SWITCH_ON if switch_on else 0)
+
+    def option_changed(self, device_id: int, value):
+        self.append(OPTION, device_id, value=int(value))
+
+    def all_switched(self, switch_on):
+        self.append(ALL_ON if switch_on else ALL_OFF)
+
+    def limit_changed(self, value):
+        self.append(LIMIT, value=_record_value(value, "max limit"))
+
+    def budget_changed(self, value):
+        self.append(BUDGET, value=-1 if value is None else _record_value(value, "power budget"))
+
+
+def scan_log(path):
+    with open(path, "rb") as file:
+        data = file.read()
+
+    # A torn or corrupt record ends the log; everything before it is intact.
+    records = []
+    valid_size = 0
+    for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        (checksum,) = CHECKSUM.unpack_from(data, offset + RECORD.size)
+        if zlib.crc32(data[offset:offset + RECORD.size]) != checksum:
+            break
+
+        records.append(RECORD.unpack_from(data, offset))
+        valid_size = offset + RECORD_SIZE
+
+    return records, valid_size
+
+
+def replay_log(home, records, after_sequence: int = 0):
+    # Replayed changes were already checked against the budget when they were logged.
+    journal, home.journal = home.journal, None
+    budget = home.power_budget
+    home.power_budget = None
+    last_sequence = after_sequence
+
+    try:
+        for sequence, operation, device_id, code, flags, value in records:
+            if sequence <= after_sequence:
+                continue
+
+            if operation == ADD:
+                home.restore_devices([(device_id, decode_device(code, flags, value))])
+            elif operation == REMOVE:
+                home.remove_device_by_id(device_id)
+            elif operation == SWITCH:
+                home.get_device_by_id(device_id).switch_on = bool(flags & SWITCH_ON)
+            elif operation == OPTION:
+                device = home.get_device_by_id(device_id)
+                device.option = bool(value) if DEVICE_TYPES[type(device)].option_kind == "bool" else value
+            elif operation == ALL_ON:
+                home.switch_all_on()
+            elif operation == ALL_OFF:
+                home.switch_all_off()
+            elif operation == LIMIT:
+                home.max_limit = value
+            elif operation == BUDGET:
+                budget = None if value < 0 else value
+            else:
+                raise ValueError(f"Unknown operation {operation} in event log")
+
+            last_sequence = sequence
+    finally:
+        home.power_budget = budget
+        home.journal = journal
+
+    return last_sequence
+
+
+def recover_home(snapshot_path, log_paths, max_limit = 5):
+    if os.path.exists(snapshot_path):
+        home, sequence = load_snapshot(snapshot_path)
+    else:
+        home, sequence = SmartHome(max_limit = max_limit), 0
+
+    for path in log_paths:
+        if not os.path.exists(path):
+            continue
+
+        records, valid_size = scan_log(path)
+        if valid_size < os.path.getsize(path):
+            os.truncate(path, valid_size)
+
+        sequence = replay_log(home, records, sequence)
+
+    return home, sequence
+
+
+class DurableHome:
+    def __init__(self, snapshot_path, log_path, max_limit = 5, compact_threshold: int = 1 << 20,
+                 group_size: int = 64, group_interval: float = 0.05):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.old_log_path = f"{log_path}.old"
+        self.max_limit = max_limit
+        self.compact_threshold = compact_threshold
+        self.group_size = group_size
+        self.group_interval = group_interval
+
+        self.home, sequence = recover_home(snapshot_path, (self.old_log_path, log_path), max_limit)
+
+        # A leftover old log means a compaction did not finish; fold it in before it can be overwritten.
+        if os.path.exists(self.old_log_path):
+            write_snapshot(encode_snapshot(self.home, sequence), snapshot_path)
+            os.remove(self.old_log_path)
+
+        self._compaction = None
+        self._compacting = False
+        self.compactions = 0
+
+        self.log = self._open_log(sequence)
+        self.home.journal = self.log
+
+    def _open_log(self, sequence: int):
+        return EventLog(self.log_path, sequence, self.group_size, self.group_interval, on_commit=self._maybe_compact)
+
+    def _maybe_compact(self, log):
+        if log.size >= self.compact_threshold and not self._compacting:
+            self.compact()
+
+    def compact(self):
+        self.wait_for_compaction()
+        self._compacting = True
+
+        try:
+            self.log.close()
+            sequence = self.log.sequence
+
+            # The writer only swaps logs; new changes go to a fresh one while the old one is folded
+            # into a snapshot in the background.
+            os.replace(self.log_path, self.old_log_path)
+            self.log = self._open_log(sequence)
+            self.home.journal = self.log
+        finally:
+            self._compacting = False
+
+        self._compaction = threading.Thread(target=self._write_snapshot, daemon=True)
+        self._compaction.start()
+
+    def _write_snapshot(self):
+        # The live home keeps changing, so the snapshot is rebuilt from the previous one and the
+        # closed log instead, off the writer thread.
+        home, sequence = recover_home(self.snapshot_path, (self.old_log_path,), self.max_limit)
+        write_snapshot(encode_snapshot(home, sequence), self.snapshot_path)
+        os.remove(self.old_log_path)
+        self.compactions += 1
+
+    def wait_for_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def close(self):
+        self.home.journal = None
+        self.log.close()
+        self.wait_for_compaction()
+
+
+def test_smart_home_log():
+
+    print(f"        Smart Home event log      \n")
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, "home.snapshot")
+        log_path = os.path.join(directory, "home.log")
+
+        durable = DurableHome(snapshot_path, log_path, max_limit = 3, group_size = 4)
+        home = durable.home
+
+        plug_id = home.add_device(SmartPlug(45))
+        tv_id = home.add_device(SmartTV(3))
+        door_id = home.add_device(SmartDoor())
+        home.max_limit = 6
+        home.switch_all_on()
+        home.update_option_by_id(plug_id, 120)
+        home.toggle_device_by_id(tv_id)
+        home.remove_device_by_id(door_id)
+        print(home)
+        print(f"{durable.log.sequence} records, {durable.log.commits} fsync(s)")
+        durable.close()
+
+        print("\n       Recovered from the log       ")
+        durable = DurableHome(snapshot_path, log_path)
+        print(durable.home)
+        print(f"Max limit: {durable.home.max_limit}")
+
+        print("\n       A torn record at the end is dropped       ")
+        durable.home.toggle_device_by_id(plug_id)
+        durable.close()
+        with open(log_path, "ab") as file:
+            file.write(b"\x01\x02\x03")
+
+        durable = DurableHome(snapshot_path, log_path)
+        print(durable.home)
+
+        print("\n       The tail of a burst is committed without another append       ")
+        durable.home.toggle_device_by_id(plug_id)
+        size = os.path.getsize(log_path)
+        time.sleep(4 * durable.group_interval)
+        print(f"Committed after {durable.group_interval * 1000:g}ms idle: {os.path.getsize(log_path) > size}")
+
+        print("\n       Compaction folds the log into a snapshot       ")
+        durable.compact_threshold = 10 * RECORD_SIZE
+        for _ in range(12):
+            durable.home.toggle_device_by_id(tv_id)
+        durable.log.commit()
+        durable.wait_for_compaction()
+        print(f"Compactions: {durable.compactions}, log is {os.path.getsize(log_path)} bytes")
+        durable.home.add_device(SmartDoor(False))
+        durable.close()
+
+        durable = DurableHome(snapshot_path, log_path)
+        print(durable.home)
+
+        print("\n       Values a record cannot hold are rejected before they are applied       ")
+        for value in (2.5, 1 << 40):
+            try:
+                durable.home.max_limit = value
+            except ValueError as error:
+                print(f"Error: {error}")
+        try:
+            durable.home.power_budget = 99.5
+        except ValueError as error:
+            print(f"Error: {error}")
+        print(f"Max limit: {durable.home.max_limit}, power budget: {durable.home.power_budget}")
+        durable.close()
+
+    print("\n       Rules reacting to a switch-all replay in order       ")
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, "home.snapshot")
+        log_path = os.path.join(directory, "home.log")
+
+        durable = DurableHome(snapshot_path, log_path, max_limit = 3)
+        durable.home.add_devices([SmartPlug(100) for _ in range(3)])
+        engine = RuleEngine(durable.home)
+        engine.add_rule(Rule("shed plugs over 150W", SmartPlug, "draw", shed_highest(SmartPlug, 150), above = 150))
+        durable.home.switch_all_on()
+        live = str(durable.home)
+        durable.close()
+
+        durable = DurableHome(snapshot_path, log_path)
+        print(durable.home)
+        print(f"Recovered the live state: {str(durable.home) == live}")
+        durable.close()
+
+
+if __name__ == "__main__":
+    test_smart_home_log()
@@ -0,0 +1,344 @@
+import functools
+import threading
+import time
+from collections import namedtuple
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDeviceBase
+
+# SmartHome methods timed while metrics are enabled.
+HOME_OPERATIONS = (
+    "add_device", "add_devices", "remove_device", "remove_device_by_id", "toggle_device", "toggle_device_by_id",
+    "update_option", "update_option_by_id", "switch_all_on", "switch_all_off", "__str__",
+)
+
+# Device setters timed while metrics are enabled, reported as device.<name>.
+DEVICE_SETTERS = ("switch_on", "option")
+
+# Histogram buckets: exact below 2 * SUB_BUCKETS ns, then SUB_BUCKETS per power of two (about 6% wide).
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# Upper bounds of the exported Prometheus buckets, powers of two from about 1us to 1s. They fall on
+# histogram bucket boundaries, so the exported counts are exact.
+EXPORT_BOUNDS_NS = tuple(1 << bits for bits in range(10, 31, 2))
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    # HDR-style: log-linear buckets of nanoseconds, so recording is a few integer operations and
+    # quantiles are within a bucket's width of the true value whatever the range.
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def bucket_of(value: int):
+        if value < 2 * SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+    @staticmethod
+    def bucket_bounds(index: int):
+        # The values [low, high) that land in a bucket.
+        if index < 2 * SUB_BUCKETS:
+            return index, index + 1
+        shift = (index >> SUB_BUCKET_BITS) - 1
+        mantissa = index - (shift << SUB_BUCKET_BITS)
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def record(self, value: int):
+        index = self.bucket_of(value)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        # The upper bound of the bucket holding the q-th value, capped at the largest value seen.
+        if not self.count:
+            return 0
+
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_bounds(index)[1] - 1, self.max)
+        return self.max
+
+    def count_below(self, bound: int):
+        # Values < bound; exact when bound is a bucket boundary.
+        return sum(self.counts[:self.bucket_of(bound)])
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+class OperationStats:
+    __slots__ = ("calls", "failures", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        # Exception class name -> count. ValueError is a validation failure (bad option, limit or budget).
+        self.failures = {}
+        self.latency = LatencyHistogram()
+
+
+class OperationSnapshot(namedtuple("OperationSnapshot", ("calls", "failures", "mean_ns", "p50_ns", "p90_ns",
+                                                         "p99_ns", "p999_ns", "max_ns"))):
+    __slots__ = ()
+
+    def __str__(self):
+        failed = sum(self.failures.values())
+        return (f"{self.calls} call(s), {failed} failed, mean {self.mean_ns / 1000:.1f}us, "
+                f"p50 {self.p50_ns / 1000:.1f}us, p99 {self.p99_ns / 1000:.1f}us, max {self.max_ns / 1000:.1f}us")
+
+
+# Homes being measured, by id, -> their Metrics. The timing wrappers are installed on the classes
+# while any home is measured and look the home up, so other homes only pay for that lookup.
+_measured = {}
+_originals = []
+
+
+class _Timing(threading.local):
+    # Set while a timed call runs on this thread, so the calls it makes in turn (toggle_device
+    # calling toggle_device_by_id, which sets device.switch_on) are not counted a second time.
+    active = False
+
+_timing = _Timing()
+
+
+def _timed_operation(operation, function):
+    @functools.wraps(function)
+    def timed(home, *args, **kwargs):
+        metrics = _measured.get(id(home))
+        if metrics is None or _timing.active:
+            return function(home, *args, **kwargs)
+        return metrics._time(operation, function, home, *args, **kwargs)
+
+    return timed
+
+
+def _timed_setter(operation, fset):
+    @functools.wraps(fset)
+    def timed(device, value):
+        # A device is measured through the home watching it.
+        if not _timing.active:
+            for watcher in device._watchers:
+                metrics = _measured.get(id(watcher))
+                if metrics is not None:
+                    return metrics._time(operation, fset, device, value)
+        return fset(device, value)
+
+    return timed
+
+
+def _install():
+    for name in HOME_OPERATIONS:
+        original = SmartHome.__dict__[name]
+        _originals.append((SmartHome, name, original))
+        setattr(SmartHome, name, _timed_operation(name, original))
+
+    for name in DEVICE_SETTERS:
+        original = SmartDeviceBase.__dict__[name]
+        _originals.append((SmartDeviceBase, name, original))
+        setattr(SmartDeviceBase, name, original.setter(_timed_setter(f"device.{name}", original.fset)))
+
+
+def _uninstall():
+    # Disabled everywhere, the original methods are back in place and nothing is left to pay for.
+    for owner, name, original in reversed(_originals):
+        setattr(owner, name, original)
+    _originals.clear()
+
+
+class Metrics:
+    def __init__(self, home, clock=time.perf_counter_ns):
+        # Only this home's operations, and setters on the devices in it, are measured.
+        self.home = home
+        self.clock = clock
+        self.operations = {}
+
+    @property
+    def enabled(self):
+        return _measured.get(id(self.home)) is self
+
+    def stats(self, operation: str):
+        stats = self.operations.get(operation)
+        if stats is None:
+            stats = self.operations[operation] = OperationStats()
+        return stats
+
+    def _time(self, operation, function, *args, **kwargs):
+        stats = self.stats(operation)
+        clock = self.clock
+        stats.calls += 1
+        _timing.active = True
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        except Exception as error:
+            failures = stats.failures
+            name = type(error).__name__
+            failures[name] = failures.get(name, 0) + 1
+            raise
+        finally:
+            stats.latency.record(clock() - start)
+            _timing.active = False
+
+    def enable(self):
+        key = id(self.home)
+        if _measured.get(key) is self:
+            return
+        if key in _measured:
+            raise RuntimeError("Another Metrics instance is already measuring this home")
+
+        if not _measured:
+            _install()
+        _measured[key] = self
+
+    def disable(self):
+        key = id(self.home)
+        if _measured.get(key) is not self:
+            return
+
+        del _measured[key]
+        if not _measured:
+            _uninstall()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def reset(self):
+        for stats in self.operations.values():
+            stats.calls = 0
+            stats.failures.clear()
+            stats.latency.clear()
+
+    def snapshot(self):
+        snapshot = {}
+        for operation, stats in sorted(self.operations.items()):
+            latency = stats.latency
+            snapshot[operation] = OperationSnapshot(stats.calls, dict(stats.failures), latency.mean(),
+                                                    *(latency.quantile(q) for q in QUANTILES), latency.max)
+        return snapshot
+
+    def prometheus(self, prefix: str = "smart_home"):
+        lines = [
+            f"# HELP {prefix}_operations_total Calls of each SmartHome operation and device setter.",
+            f"# TYPE {prefix}_operations_total counter",
+        ]
+        operations = sorted(self.operations.items())
+
+        for operation, stats in operations:
+            lines.append(f'{prefix}_operations_total{{operation="{operation}"}} {stats.calls}')
+
+        lines.append(f"# HELP {prefix}_operation_failures_total Calls that raised, by exception type.")
+        lines.append(f"# TYPE {prefix}_operation_failures_total counter")
+        for operation, stats in operations:
+            for error, count in sorted(stats.failures.items()):
+                lines.append(f'{prefix}_operation_failures_total{{operation="{operation}",error="{error}"}} {count}')
+
+        lines.append(f"# HELP {prefix}_operation_seconds Latency of each operation.")
+        lines.append(f"# TYPE {prefix}_operation_seconds histogram")
+        for operation, stats in operations:
+            latency = stats.latency
+            label = f'operation="{operation}"'
+            for bound in EXPORT_BOUNDS_NS:
+                lines.append(f'{prefix}_operation_seconds_bucket{{{label},le="{bound / 1e9:g}"}} {latency.count_below(bound)}')
+            lines.append(f'{prefix}_operation_seconds_bucket{{{label},le="+Inf"}} {latency.count}')
+            lines.append(f"{prefix}_operation_seconds_sum{{{label}}} {latency.total / 1e9:g}")
+            lines.append(f"{prefix}_operation_seconds_count{{{label}}} {latency.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+class FakeClock:
+    # A nanosecond clock that moves by a fixed step per reading, for repeatable test output.
+    def __init__(self, step: int = 1000):
+        self.now = 0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def test_metrics():
+
+    print(f"        Smart Home metrics      \n")
+
+    home = SmartHome(max_limit = 3, power_budget = 100)
+    plug_id = home.add_device(SmartPlug(45))
+
+    metrics = Metrics(home, clock = FakeClock())
+    other = SmartHome(max_limit = 3)
+    print(f"Disabled, setters are the originals: {SmartDeviceBase.option is SmartDeviceBase.__dict__['option']}")
+
+    with metrics:
+        tv_id = home.add_device(SmartTV(3))
+        home.toggle_device_by_id(plug_id)
+        home.update_option_by_id(tv_id, 42)
+        str(home)
+
+        for value in (200, 120):
+            try:
+                home.update_option_by_id(plug_id, value)
+            except ValueError as error:
+                print(f"Error: {error}")
+        try:
+            home.toggle_device_by_id(99)
+        except KeyError as error:
+            print(f"Error: {error}")
+
+        home.switch_all_off()
+
+        # Counted as device.option only: setters called by the home's own operations are not counted twice.
+        home.get_device_by_id(tv_id).channel = 7
+
+        # Not counted: another home, which is not being measured.
+        other.toggle_device_by_id(other.add_device(SmartPlug(10)))
+
+    # Not counted: metrics are off again.
+    home.toggle_device_by_id(plug_id)
+
+    print("\n       Snapshot       ")
+    for operation, snapshot in metrics.snapshot().items():
+        if snapshot.calls:
+            print(f"{operation}: {snapshot}")
+
+    print("\n       Prometheus       ")
+    text = metrics.prometheus()
+    for line in text.splitlines():
+        if "update_option_by_id" in line and ("_total" in line or "+Inf" in line or "_count" in line):
+            print(line)
+
+    print("\n       Histogram       ")
+    histogram = LatencyHistogram()
+    for value in range(1, 100_001):
+        histogram.record(value)
+    print(", ".join(f"p{q * 100:g} {histogram.quantile(q)}" for q in QUANTILES))
+    print(f"{len(histogram.counts)} buckets for 100000 distinct values")
+
+
+if __name__ == "__main__":
+    test_metrics()
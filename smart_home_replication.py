@@ -0,0 +1,353 @@
+import struct
+from collections import deque, namedtuple
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES
+from smart_home_snapshot import RECORD, SWITCH_ON, decode_device, device_fields
+
+# since, version, full, max limit, power budget (-1 for none), next device id, upserts, removes
+DELTA_HEADER = struct.Struct("<QQBiqIII")
+REMOVED_ID = struct.Struct("<I")
+
+# Tombstones of removed devices kept for diffs; a replica further behind gets the full state.
+TOMBSTONES = 10_000
+
+
+class Delta(namedtuple("Delta", ("since", "version", "full", "max_limit", "power_budget", "next_device_id",
+                                 "upserts", "removed"))):
+    # upserts: (device id, type code, flags, option) rows, the whole state of each device that changed.
+    __slots__ = ()
+
+    def __str__(self):
+        kind = "full state" if self.full else f"changes since {self.since}"
+        return f"Delta to version {self.version} ({kind}): {len(self.upserts)} upsert(s), {len(self.removed)} removed"
+
+
+def encode_delta(delta):
+    budget = -1 if delta.power_budget is None else delta.power_budget
+    parts = [DELTA_HEADER.pack(delta.since, delta.version, delta.full, delta.max_limit, budget,
+                               delta.next_device_id, len(delta.upserts), len(delta.removed))]
+    parts.extend(RECORD.pack(*row) for row in delta.upserts)
+    parts.extend(REMOVED_ID.pack(device_id) for device_id in delta.removed)
+    return b"".join(parts)
+
+
+def decode_delta(data):
+    since, version, full, max_limit, budget, next_device_id, upserts, removed = DELTA_HEADER.unpack_from(data)
+    offset = DELTA_HEADER.size
+
+    rows = [RECORD.unpack_from(data, offset + i * RECORD.size) for i in range(upserts)]
+    offset += upserts * RECORD.size
+    ids = [REMOVED_ID.unpack_from(data, offset + i * REMOVED_ID.size)[0] for i in range(removed)]
+
+    if offset + removed * REMOVED_ID.size != len(data):
+        raise ValueError("Delta has the wrong length")
+
+    return Delta(since, version, bool(full), max_limit, None if budget < 0 else budget, next_device_id, rows, ids)
+
+
+class ChangeTracker:
+    def __init__(self, home, tombstones: int = TOMBSTONES):
+        # Every operation on the home is one version. Devices are kept in the order they last
+        # changed, so the changes since a version are found walking back from the newest.
+        self.home = home
+        self.version = 0
+        self.tombstones = tombstones
+
+        self._versions = {device_id: 0 for device_id in home.device_ids()}
+        self._removed = {}
+        # Diffs from before the oldest tombstone that was dropped cannot list every removal.
+        self._floor = 0
+
+        home.subscribe(self._on_batch, coalesce=True)
+
+    def close(self):
+        self.home.unsubscribe(self._on_batch)
+
+    def version_of(self, device_id: int):
+        version = self._versions.get(device_id)
+        if version is None:
+            version = self._removed.get(device_id)
+        if version is None:
+            raise KeyError(f"No device with id {device_id}")
+        return version
+
+    def _on_batch(self, batch):
+        self.version += 1
+        version = self.version
+        versions = self._versions
+
+        for device_id in batch.removed:
+            versions.pop(device_id, None)
+            self._removed[device_id] = version
+
+        for device_id in (*batch.added, *batch.changed):
+            # Moved to the end: the dict stays ordered by version.
+            versions.pop(device_id, None)
+            versions[device_id] = version
+
+        while len(self._removed) > self.tombstones:
+            device_id = next(iter(self._removed))
+            self._floor = self._removed.pop(device_id)
+
+    def diff(self, since = None):
+        # None, a version from another primary or one older than the kept tombstones gets the full state.
+        home = self.home
+        full = since is None or since < self._floor or since > self.version
+
+        if full:
+            since = 0
+            upserts = [(device_id, *device_fields(device)) for device_id, device in home.items()]
+            removed = []
+        else:
+            upserts = []
+            for device_id, version in reversed(self._versions.items()):
+                if version <= since:
+                    break
+                upserts.append((device_id, *device_fields(home.get_device_by_id(device_id))))
+
+            removed = []
+            for device_id, version in reversed(self._removed.items()):
+                if version <= since:
+                    break
+                removed.append(device_id)
+
+        return Delta(since, self.version, full, home.max_limit, home.power_budget, home.next_device_id,
+                     upserts, removed)
+
+
+class Replica:
+    def __init__(self, home = None):
+        self.home = SmartHome() if home is None else home
+        # The primary's version this home matches, None until the first full state arrives.
+        self.version = None
+        self.applied = 0
+
+    def can_apply(self, delta):
+        return delta.full or (self.version is not None and delta.since <= self.version)
+
+    def apply(self, delta):
+        # Rows carry each device's whole state, so applying a delta twice or one that overlaps an
+        # earlier one is harmless; only a gap (since newer than this replica) cannot be applied.
+        if not self.can_apply(delta):
+            raise ValueError(f"Delta since version {delta.since} does not follow version {self.version}")
+        if self.version is not None and delta.version <= self.version and not delta.full:
+            return False
+
+        home = self.home
+        # The primary already checked every change against its budget.
+        with home.unchecked_budget(), home.batch():
+            if home.max_limit != delta.max_limit:
+                home.max_limit = delta.max_limit
+            if home.power_budget != delta.power_budget:
+                home.power_budget = delta.power_budget
+
+            if delta.full:
+                keep = {row[0] for row in delta.upserts}
+                removed = [device_id for device_id in home.device_ids() if device_id not in keep]
+            else:
+                removed = delta.removed
+
+            for device_id in removed:
+                try:
+                    home.remove_device_by_id(device_id)
+                except KeyError:
+                    pass
+
+            new_devices = []
+            for device_id, code, flags, option in delta.upserts:
+                try:
+                    device = home.get_device_by_id(device_id)
+                except KeyError:
+                    new_devices.append((device_id, decode_device(code, flags, option)))
+                    continue
+
+                device_type = DEVICE_TYPES[type(device)]
+                if device_type.code != code:
+                    raise ValueError(f"Device {device_id} is a {device_type.name} here, but not on the primary")
+
+                switch_on = bool(flags & SWITCH_ON)
+                if device_type.option_kind == "bool":
+                    option = bool(option)
+                if device.option != option:
+                    device_type.setter(device, option)
+                if device.switch_on != switch_on:
+                    device.switch_on = switch_on
+
+            home.restore_devices(new_devices, delta.next_device_id)
+
+        self.version = delta.version
+        self.applied += 1
+        return True
+
+
+class LoopbackTransport:
+    # Both ends in one process: deltas go one way, acknowledgements the other. While disconnected
+    # everything sent is lost, as it would be on a dropped connection.
+    def __init__(self):
+        self.connected = True
+        self._to_replica = deque()
+        self._to_primary = deque()
+        self.bytes_sent = 0
+        self.dropped = 0
+
+    def _send(self, queue, message, size):
+        if not self.connected:
+            self.dropped += 1
+            return
+        queue.append(message)
+        self.bytes_sent += size
+
+    def send_delta(self, data: bytes):
+        self._send(self._to_replica, data, len(data))
+
+    def receive_delta(self):
+        return self._to_replica.popleft() if self._to_replica else None
+
+    def send_reply(self, kind: str, version):
+        self._send(self._to_primary, (kind, version), REMOVED_ID.size)
+
+    def receive_reply(self):
+        return self._to_primary.popleft() if self._to_primary else None
+
+    def disconnect(self):
+        self.connected = False
+        self._to_replica.clear()
+        self._to_primary.clear()
+
+    def reconnect(self):
+        self.connected = True
+
+
+class ReplicationSource:
+    def __init__(self, tracker, transport):
+        self.tracker = tracker
+        self.transport = transport
+        # The version the replica is assumed to have once everything sent so far arrives.
+        self.sent = None
+        self.acked = None
+
+    def push(self):
+        # Replies first: a resync means the replica missed something and is really at its version.
+        while True:
+            reply = self.transport.receive_reply()
+            if reply is None:
+                break
+
+            kind, version = reply
+            if kind == "resync":
+                self.sent = version
+            elif self.acked is None or version > self.acked:
+                self.acked = version
+
+        if self.sent == self.tracker.version:
+            return None
+
+        delta = self.tracker.diff(self.sent)
+        self.transport.send_delta(encode_delta(delta))
+        self.sent = delta.version
+        return delta
+
+
+class ReplicationSink:
+    def __init__(self, replica, transport):
+        self.replica = replica
+        self.transport = transport
+
+    def connect(self):
+        # After every (re)connect: tell the primary what this replica has, so the next delta starts there.
+        self.transport.send_reply("resync", self.replica.version)
+
+    def receive(self):
+        applied = 0
+        while True:
+            data = self.transport.receive_delta()
+            if data is None:
+                return applied
+
+            delta = decode_delta(data)
+            if not self.replica.can_apply(delta):
+                # A delta went missing; ask for everything since what this replica has.
+                self.transport.send_reply("resync", self.replica.version)
+                continue
+
+            applied += self.replica.apply(delta)
+            self.transport.send_reply("ack", self.replica.version)
+
+
+def rows(home):
+    return sorted((device_id, *device_fields(device)) for device_id, device in home.items())
+
+
+def test_replication():
+
+    print(f"        Smart Home replication      \n")
+
+    primary = SmartHome(max_limit = 10, power_budget = 200)
+    plug_id = primary.add_device(SmartPlug(45))
+    tv_id = primary.add_device(SmartTV(3))
+    tracker = ChangeTracker(primary)
+
+    transport = LoopbackTransport()
+    source = ReplicationSource(tracker, transport)
+    replica = Replica()
+    sink = ReplicationSink(replica, transport)
+
+    print(source.push())
+    sink.receive()
+    print(replica.home)
+
+    print("\n       Only what changed is sent       ")
+    events = []
+    replica.home.subscribe(lambda event: events.append(type(event).__name__))
+    primary.toggle_device_by_id(plug_id)
+    primary.update_option_by_id(tv_id, 42)
+    door_id = primary.add_device(SmartDoor())
+    primary.remove_device_by_id(tv_id)
+    size = transport.bytes_sent
+    print(source.push())
+    sink.receive()
+    print(f"{transport.bytes_sent - size} bytes sent, replica events: {', '.join(sorted(events))}")
+    print(replica.home)
+    print(f"Versions: plug {tracker.version_of(plug_id)}, door {tracker.version_of(door_id)}, tv {tracker.version_of(tv_id)}")
+
+    print("\n       Deltas lost while disconnected are sent again       ")
+    transport.disconnect()
+    primary.switch_all_on()
+    source.push()
+    transport.reconnect()
+    primary.update_option_by_id(plug_id, 60)
+    print(source.push())
+    sink.receive()
+    print(source.push())
+    sink.receive()
+    print(replica.home)
+
+    print("\n       A reconnecting replica says where it is       ")
+    transport.disconnect()
+    primary.toggle_device_by_id(door_id)
+    source.push()
+    transport.reconnect()
+    sink.connect()
+    print(source.push())
+    sink.receive()
+    print(f"Replica at version {replica.version}, primary at {tracker.version}, budget {replica.home.power_budget}W")
+
+    print("\n       A replica too far behind gets the full state       ")
+    tracker.tombstones = 1
+    transport.disconnect()
+    primary.remove_device_by_id(door_id)
+    primary.add_devices([SmartTV(i + 1) for i in range(3)])
+    primary.remove_device(1)
+    primary.remove_device(1)
+    source.push()
+    transport.reconnect()
+    sink.connect()
+    print(source.push())
+    sink.receive()
+    print(replica.home)
+    print(f"Same as the primary: {rows(replica.home) == rows(primary)}")
+
+
+if __name__ == "__main__":
+    test_replication()
@@ -0,0 +1,416 @@
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from itertools import count
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES
+from smart_home_events import DeviceToggled, OptionChanged, DeviceAdded, DeviceRemoved
+
+ATTRIBUTES = ("switch_on", "option", "draw")
+
+_ANY = object()
+
+
+class RuleCycleError(RuntimeError):
+    pass
+
+
+class RuleBudgetExceeded(RuntimeError):
+    pass
+
+
+def _compile_condition(equals, above, below):
+    # Conditions are turned into one predicate when the rule is made, not interpreted per event.
+    if equals is not _ANY:
+        return lambda value: value == equals
+    if above is not None and below is not None:
+        return lambda value: above < value < below
+    if above is not None:
+        return lambda value: value > above
+    if below is not None:
+        return lambda value: value < below
+    return lambda value: True
+
+
+class Rule:
+    def __init__(self, name, target, attribute, action, equals=_ANY, above=None, below=None):
+        # target is a device class (the rule covers every device of that class) or a device id.
+        if isinstance(target, type):
+            device_type = DEVICE_TYPES.get(target)
+            if device_type is not None and attribute == device_type.option_attr:
+                attribute = "option"
+
+        if attribute not in ATTRIBUTES:
+            raise ValueError(f"Rules can watch {', '.join(ATTRIBUTES)}, not {attribute}")
+
+        if attribute == "draw" and not isinstance(target, (type, int)):
+            raise ValueError("Draw rules need a device class or a device id")
+
+        self.name = name
+        self.target = target
+        self.attribute = attribute
+        self.action = action
+        self.condition = _compile_condition(equals, above, below)
+        self.fired = 0
+
+        # How the rule is indexed: by the value it waits for, by its threshold, or not at all.
+        if equals is not _ANY:
+            self.kind, self.value = "equals", equals
+        elif above is not None and below is None:
+            self.kind, self.value = "above", above
+        elif below is not None and above is None:
+            self.kind, self.value = "below", below
+        else:
+            self.kind, self.value = "other", None
+
+    def applies_to(self, device_id: int, device_type, attribute):
+        if attribute != self.attribute:
+            return False
+        if isinstance(self.target, type):
+            return issubclass(device_type, self.target)
+        return device_id == self.target
+
+    def triggered(self, old, new):
+        # Rules fire when their condition becomes true, not on every change while it stays true.
+        return self.condition(new) and not self.condition(old)
+
+    def __str__(self):
+        target = self.target.__name__ if isinstance(self.target, type) else f"device {self.target}"
+        return f"{self.name} ({target} {self.attribute})"
+
+
+def switch_off(device_type):
+    def action(home, change):
+        device_ids = home.query(device_type, switch_on=True)
+        if device_ids:
+            home.toggle_devices(device_ids)
+    return action
+
+
+def switch_on(device_type):
+    def action(home, change):
+        device_ids = home.query(device_type, switch_on=False)
+        if device_ids:
+            home.toggle_devices(device_ids)
+    return action
+
+
+def shed_highest(device_type, limit: int):
+    def action(home, change):
+        # Switch off the biggest consumers first until the class is back under the limit.
+        draws = []
+        for device_id in home.query(device_type, switch_on=True):
+            device = home.get_device_by_id(device_id)
+            draws.append((device._power_draw(True, device.option), device_id))
+        total = sum(draw for draw, _ in draws)
+
+        shed = []
+        for draw, device_id in sorted(draws, reverse=True):
+            if total <= limit:
+                break
+            shed.append(device_id)
+            total -= draw
+
+        if shed:
+            home.toggle_devices(shed)
+    return action
+
+
+class RuleBucket:
+    # The rules watching one (attribute, target), arranged so a change only looks at the rules it triggers.
+    _order = count()
+
+    def __init__(self):
+        self.equals = {}
+        self.above = []
+        self.below = []
+        self.other = []
+
+    def __len__(self):
+        return sum(map(len, self.equals.values())) + len(self.above) + len(self.below) + len(self.other)
+
+    def add(self, rule):
+        if rule.kind == "equals":
+            self.equals.setdefault(rule.value, []).append(rule)
+        elif rule.kind == "other":
+            self.other.append(rule)
+        else:
+            insort(getattr(self, rule.kind), (rule.value, next(self._order), rule))
+
+    def remove(self, rule):
+        if rule.kind == "equals":
+            self.equals[rule.value].remove(rule)
+        elif rule.kind == "other":
+            self.other.remove(rule)
+        else:
+            entries = getattr(self, rule.kind)
+            entries.remove(next(entry for entry in entries if entry[2] is rule))
+
+    def candidates(self, old, new):
+        if old == new:
+            return
+
+        rules = self.equals.get(new)
+        if rules:
+            yield from rules
+
+        # "above t" becomes true when the value rises past t: old <= t < new; "below t" is the mirror.
+        if new > old:
+            start, stop = bisect_left(self.above, (old,)), bisect_left(self.above, (new,))
+            for _, _, rule in self.above[start:stop]:
+                yield rule
+        else:
+            start, stop = bisect_right(self.below, (new, float("inf"))), bisect_right(self.below, (old, float("inf")))
+            for _, _, rule in self.below[start:stop]:
+                yield rule
+
+        yield from self.other
+
+
+class Change:
+    # One device change as a rule sees it; chain is the rules whose actions led to it.
+    __slots__ = ("device_id", "device_type", "attribute", "old", "new", "old_draw", "new_draw", "chain")
+
+    def __init__(self, device_id, device_type, attribute, old, new, old_draw, new_draw, chain):
+        self.device_id = device_id
+        self.device_type = device_type
+        self.attribute = attribute
+        self.old = old
+        self.new = new
+        self.old_draw = old_draw
+        self.new_draw = new_draw
+        self.chain = chain
+
+
+class RuleEngine:
+    def __init__(self, home, time_budget: float = 0.05, max_depth: int = 16, clock=time.perf_counter, on_error=None):
+        self.home = home
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.clock = clock
+        self.on_error = on_error
+
+        self.rules = []
+        # (attribute, device class or device id) -> rules watching it.
+        self._index = {}
+        # Running draw per device class, kept only for classes that draw rules watch.
+        self._draw = {}
+
+        self._queue = deque()
+        self._chain = ()
+        self._running = False
+
+        self.evaluations = 0
+        self.rules_checked = 0
+        self.budget_overruns = 0
+        self.errors = []
+
+        # Changes are collected as they happen and evaluated once the operation that made them
+        # has finished, so actions always see a consistent home.
+        home.subscribe(self._on_event)
+        home.subscribe(self._on_operation_done, coalesce=True)
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        self._index.setdefault((rule.attribute, rule.target), RuleBucket()).add(rule)
+
+        if rule.attribute == "draw" and isinstance(rule.target, type) and rule.target not in self._draw:
+            self._draw[rule.target] = self._class_draw(rule.target)
+        return rule
+
+    def _class_draw(self, device_type):
+        return sum(
+            device._power_draw(device.switch_on, device.option)
+            for device in self.home.devices if isinstance(device, device_type)
+        )
+
+    def _drop_queue(self):
+        # The dropped changes (and one cut short by a cycle) never reached the running draw totals,
+        # so those are counted again from the home.
+        self._queue.clear()
+        for device_type in self._draw:
+            self._draw[device_type] = self._class_draw(device_type)
+
+    def remove_rule(self, rule):
+        self.rules.remove(rule)
+        self._index[(rule.attribute, rule.target)].remove(rule)
+
+    def _candidates(self, attribute, device_id, device_type, old, new):
+        for target in (device_id, *device_type.__mro__):
+            bucket = self._index.get((attribute, target))
+            if bucket:
+                yield from bucket.candidates(old, new)
+
+    def _on_event(self, event):
+        event_type = type(event)
+
+        if event_type is DeviceToggled:
+            device = self.home.get_device_by_id(event.device_id)
+            old, new = not event.switch_on, event.switch_on
+            old_draw = device._power_draw(old, device.option)
+            new_draw = device._power_draw(new, device.option)
+            attribute = "switch_on"
+        elif event_type is OptionChanged:
+            device = self.home.get_device_by_id(event.device_id)
+            old, new = event.old, event.new
+            old_draw = device._power_draw(device.switch_on, old)
+            new_draw = device._power_draw(device.switch_on, new)
+            attribute = "option"
+        elif event_type is DeviceAdded or event_type is DeviceRemoved:
+            device = event.device
+            draw = device._power_draw(device.switch_on, device.option)
+            old = new = None
+            old_draw, new_draw = (0, draw) if event_type is DeviceAdded else (draw, 0)
+            attribute = None
+        else:
+            return
+
+        self._queue.append(Change(event.device_id, type(device), attribute, old, new, old_draw, new_draw, self._chain))
+
+    def _on_operation_done(self, batch):
+        # Changes made by rule actions are queued and handled by the loop that is already running.
+        if not self._running:
+            self.evaluate()
+
+    def evaluate(self):
+        self._running = True
+        deadline = self.clock() + self.time_budget
+        self.evaluations += 1
+
+        try:
+            while self._queue:
+                change = self._queue.popleft()
+
+                if self.clock() > deadline:
+                    self.budget_overruns += 1
+                    dropped = len(self._queue) + 1
+                    self._drop_queue()
+                    self._report(RuleBudgetExceeded(f"Rule evaluation ran over its {self.time_budget}s budget; {dropped} change(s) not evaluated"))
+                    return
+
+                self._evaluate(change)
+        except RuleCycleError as error:
+            self._drop_queue()
+            self._report(error)
+        finally:
+            self._chain = ()
+            self._running = False
+
+    def _evaluate(self, change):
+        if change.attribute is not None:
+            self._check(self._candidates(change.attribute, change.device_id, change.device_type, change.old, change.new),
+                        change.old, change.new, change)
+
+        if change.old_draw != change.new_draw:
+            self._evaluate_draw(change)
+
+    def _check(self, candidates, old, new, change):
+        for rule in candidates:
+            self.rules_checked += 1
+            if rule.triggered(old, new):
+                self._fire(rule, change)
+
+    def _evaluate_draw(self, change):
+        bucket = self._index.get(("draw", change.device_id))
+        if bucket:
+            self._check(bucket.candidates(change.old_draw, change.new_draw), change.old_draw, change.new_draw, change)
+
+        for device_type in change.device_type.__mro__:
+            if device_type not in self._draw:
+                continue
+
+            old_total = self._draw[device_type]
+            new_total = self._draw[device_type] = old_total - change.old_draw + change.new_draw
+
+            bucket = self._index.get(("draw", device_type))
+            if bucket:
+                self._check(bucket.candidates(old_total, new_total), old_total, new_total, change)
+
+    def _fire(self, rule, change):
+        if rule in change.chain:
+            names = " -> ".join(str(r) for r in change.chain + (rule,))
+            raise RuleCycleError(f"Rule cycle: {names}")
+
+        if len(change.chain) >= self.max_depth:
+            raise RuleCycleError(f"Rules triggered each other more than {self.max_depth} levels deep")
+
+        rule.fired += 1
+        self._chain = change.chain + (rule,)
+        try:
+            rule.action(self.home, change)
+        except Exception as error:
+            # A broken action must not stop the other rules or leave the engine marked as running.
+            self._report(error)
+        finally:
+            self._chain = ()
+
+    def _report(self, error):
+        # Evaluation runs after the change was made, so errors are reported rather than raised into the writer.
+        self.errors.append(error)
+        if self.on_error is not None:
+            self.on_error(error)
+
+
+def test_rule_engine():
+
+    print(f"        Smart Home rules      \n")
+
+    home = SmartHome(max_limit = 20)
+    door_id = home.add_device(SmartDoor())
+    tv_ids = home.add_devices([SmartTV(i + 1) for i in range(3)])
+    plug_ids = home.add_devices([SmartPlug(rate) for rate in (40, 60, 80, 50)])
+    home.switch_all_on()
+
+    engine = RuleEngine(home, on_error = lambda error: print(f"Error: {error}"))
+    engine.add_rule(Rule("unlocked door turns TVs off", SmartDoor, "locked", switch_off(SmartTV), equals = False))
+    engine.add_rule(Rule("shed plugs over 250W", SmartPlug, "draw", shed_highest(SmartPlug, 250), above = 250))
+
+    print("       The door unlocks       ")
+    home.update_option_by_id(door_id, False)
+    print(home)
+
+    print("\n       Plug draw goes over 250W       ")
+    print(f"Plug draw before: {engine._draw[SmartPlug]}W")
+    home.update_option_by_id(plug_ids[0], 100)
+    print(f"Plug draw after: {engine._draw[SmartPlug]}W")
+    print(home)
+    print(f"{engine.rules_checked} rule check(s) for {len(engine.rules)} rules")
+
+    print("\n       Rules that trigger each other       ")
+    engine.add_rule(Rule("TV off locks the door", SmartTV, "switch_on", lambda home, change: home.update_option_by_id(door_id, True), equals = False))
+    engine.add_rule(Rule("locked door unlocks it", door_id, "option", lambda home, change: home.update_option_by_id(door_id, False), equals = True))
+    home.toggle_devices(tv_ids)
+    home.toggle_device_by_id(tv_ids[0])
+
+    print("\n       Time budget       ")
+    home = SmartHome(max_limit = 20)
+    home.add_devices([SmartTV(i + 1) for i in range(10)])
+    ticks = iter(range(1000))
+    engine = RuleEngine(home, time_budget = 3, clock = lambda: next(ticks), on_error = lambda error: print(f"Error: {error}"))
+    engine.add_rule(Rule("TV on", SmartTV, "switch_on", lambda home, change: None, equals = True))
+    home.switch_all_on()
+    print(f"Fired for {engine.rules[0].fired} of 10 TVs, {engine.budget_overruns} overrun(s)")
+
+    # The changes that were not evaluated still count towards the running draw.
+    plug_ids = home.add_devices([SmartPlug(10) for _ in range(10)])
+    engine.add_rule(Rule("plugs above 95W", SmartPlug, "draw", lambda home, change: None, above = 95))
+    home.toggle_devices(plug_ids)
+    home.toggle_device_by_id(plug_ids[0])
+    home.toggle_device_by_id(plug_ids[0])
+    print(f"Plug draw {engine._draw[SmartPlug]}W of {sum(home.get_device_by_id(i).consumption_rate for i in plug_ids)}W, rule fired {engine.rules[1].fired} time(s)")
+
+    print("\n       A failing action       ")
+    home = SmartHome(max_limit = 20)
+    tv_ids = home.add_devices([SmartTV(i + 1) for i in range(3)])
+    engine = RuleEngine(home, on_error = lambda error: print(f"Error: {type(error).__name__}: {error}"))
+    engine.add_rule(Rule("broken", SmartTV, "switch_on", lambda home, change: 1 / 0, equals = True))
+    engine.add_rule(Rule("TV on", SmartTV, "switch_on", lambda home, change: None, equals = True))
+    home.switch_all_on()
+    home.toggle_device_by_id(tv_ids[0])
+    home.toggle_device_by_id(tv_ids[0])
+    print(f"Other rule fired {engine.rules[1].fired} time(s), {len(engine.errors)} error(s) reported")
+
+
+if __name__ == "__main__":
+    test_rule_engine()
@@ -0,0 +1,408 @@
+import heapq
+import time
+from collections import namedtuple
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor
+from smart_home_events import OptionChanged, DeviceRemoved
+
+DAY = 24 * 60 * 60
+
+# Cancelled jobs stay in the heap until this many have piled up (and they are half of it).
+COMPACT_MIN_CANCELLED = 64
+
+
+class ScheduledAction(namedtuple("ScheduledAction", ("kind", "device_id", "value"))):
+    __slots__ = ()
+
+
+def switch(device_id: int, switch_on):
+    return ScheduledAction("switch", device_id, bool(switch_on))
+
+
+def set_option(device_id: int, value):
+    return ScheduledAction("option", device_id, value)
+
+
+def call(function):
+    # Anything else: function(home) runs inside the tick's batch.
+    return ScheduledAction("call", None, function)
+
+
+class ManualClock:
+    # A clock tests can move by hand; pass it as the scheduler's clock.
+    def __init__(self, now: float = 0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class Job:
+    __slots__ = ("due", "interval", "action", "name", "time_of_day", "cancelled", "scheduled", "runs")
+
+    def __init__(self, due, interval, action, name, time_of_day=None):
+        self.due = due
+        self.interval = interval
+        self.action = action
+        self.name = name
+        # (hour, minute) on the local clock for daily jobs, which are not always 24 hours apart.
+        self.time_of_day = time_of_day
+        self.cancelled = False
+        self.scheduled = False
+        self.runs = 0
+
+    def __str__(self):
+        repeat = f", every {self.interval}s" if self.interval else ""
+        return f"{self.name or self.action.kind} at {self.due}{repeat}"
+
+
+class Scheduler:
+    def __init__(self, home, clock=time.time, tick: float = 1.0, on_error=None, utc_offset=None):
+        self.home = home
+        self.clock = clock
+        self.tick = tick
+        self.on_error = on_error
+        # Seconds the local clock is ahead of UTC at a given time on the scheduler's clock.
+        self.utc_offset = utc_offset or (lambda when: time.localtime(when).tm_gmtoff)
+
+        # Jobs are bucketed by the tick they are due in; the heap only holds tick numbers, so jobs
+        # joining a tick that already has a bucket are a list append. Cancelled jobs are dropped
+        # when their tick comes up.
+        self._buckets = {}
+        self._ticks = []
+        self._count = 0
+        self._cancelled = 0
+        self._now = None
+
+        self.ticks_run = 0
+        self.actions_run = 0
+        self.errors = []
+
+    def __len__(self):
+        return self._count
+
+    def now(self):
+        # Inside a tick, "now" is that tick's time, so jobs scheduled by actions line up with it.
+        return self.clock() if self._now is None else self._now
+
+    def _tick_of(self, when):
+        # Jobs run at the end of the tick they fall in, never early.
+        return -int(-when // self.tick)
+
+    def _push(self, job):
+        tick = self._tick_of(job.due)
+        bucket = self._buckets.get(tick)
+
+        if bucket is None:
+            self._buckets[tick] = [job]
+            heapq.heappush(self._ticks, tick)
+        else:
+            bucket.append(job)
+
+        job.scheduled = True
+        self._count += 1
+        return job
+
+    def at(self, when, action, name=None):
+        return self._push(Job(when, None, action, name))
+
+    def after(self, delay, action, name=None):
+        return self.at(self.now() + delay, action, name)
+
+    def every(self, interval, action, start=None, name=None):
+        if interval <= 0:
+            raise ValueError("Interval must be positive")
+
+        return self._push(Job(self.now() + interval if start is None else start, interval, action, name))
+
+    def daily(self, hour: int, minute: int, action, name=None):
+        time_of_day = (hour, minute)
+        return self._push(Job(self._next_daily(self.now(), time_of_day), DAY, action, name, time_of_day))
+
+    def _next_daily(self, after, time_of_day):
+        # The first time after `after` that the local clock reads hour:minute. Days start at local
+        # midnight, and across a daylight saving change the job keeps its wall-clock time.
+        hour, minute = time_of_day
+        offset = self.utc_offset(after)
+        wall = after + offset
+        target = wall - wall % DAY + hour * 3600 + minute * 60
+        if target <= wall:
+            target += DAY
+
+        return target - self.utc_offset(target - offset)
+
+    def _reschedule(self, job, now):
+        # Occurrences missed while the scheduler was not run (a suspended host, a clock jump) are
+        # collapsed into the run that just happened; the job is next due after now.
+        if job.time_of_day is not None:
+            job.due = self._next_daily(max(job.due, now), job.time_of_day)
+        else:
+            job.due += job.interval
+            if job.due <= now:
+                job.due += ((now - job.due) // job.interval + 1) * job.interval
+
+    def cancel(self, job):
+        if job.cancelled:
+            return
+
+        # A job that is running now (from its own action, or a subscriber during its tick) is
+        # marked too, so a recurring one is not scheduled again; a one-off that already ran is not counted.
+        job.cancelled = True
+        if not job.scheduled:
+            return
+
+        job.scheduled = False
+        self._count -= 1
+        self._cancelled += 1
+
+        if self._cancelled >= COMPACT_MIN_CANCELLED and self._cancelled > self._count:
+            self._compact()
+
+    def _compact(self):
+        for tick, bucket in list(self._buckets.items()):
+            live = [job for job in bucket if not job.cancelled]
+            if live:
+                self._buckets[tick] = live
+            else:
+                del self._buckets[tick]
+
+        self._ticks = list(self._buckets)
+        heapq.heapify(self._ticks)
+        self._cancelled = 0
+
+    def _pop_tick(self):
+        tick = heapq.heappop(self._ticks)
+        jobs = []
+
+        for job in self._buckets.pop(tick):
+            if job.cancelled:
+                self._cancelled -= 1
+            else:
+                job.scheduled = False
+                jobs.append(job)
+
+        self._count -= len(jobs)
+        return tick, jobs
+
+    def next_due(self):
+        while self._ticks:
+            live = [job.due for job in self._buckets[self._ticks[0]] if not job.cancelled]
+            if live:
+                return min(live)
+            self._pop_tick()
+
+        return None
+
+    def run_due(self, now=None):
+        # Runs every tick up to now, in order, one batch per tick; a recurring job runs once however
+        # many of its occurrences fell before now.
+        now = self.clock() if now is None else now
+        last_tick = int(now // self.tick)
+        ran = 0
+
+        while self._ticks and self._ticks[0] <= last_tick:
+            tick, jobs = self._pop_tick()
+            if not jobs:
+                continue
+
+            self._now = tick * self.tick
+            try:
+                self._run_tick(jobs)
+            finally:
+                # Even if the tick raised, recurring jobs keep their place.
+                self._now = None
+                for job in jobs:
+                    job.runs += 1
+                    if job.interval and not job.cancelled:
+                        self._reschedule(job, now)
+                        self._push(job)
+
+            ran += len(jobs)
+
+        return ran
+
+    def _run_tick(self, jobs):
+        self.ticks_run += 1
+        self.actions_run += len(jobs)
+
+        # Later jobs in the tick win for the same device.
+        switches = {}
+        options = {}
+        calls = []
+        for job in jobs:
+            action = job.action
+            if action.kind == "switch":
+                switches[action.device_id] = action.value
+            elif action.kind == "option":
+                options[action.device_id] = action.value
+            else:
+                calls.append(action.value)
+
+        # One batch per tick: coalescing subscribers hear about the whole tick at once.
+        with self.home.batch():
+            turn_off = []
+            turn_on = []
+            for device_id, switch_on in switches.items():
+                try:
+                    device = self.home.get_device_by_id(device_id)
+                except KeyError as error:
+                    self._report(error)
+                    continue
+
+                if device.switch_on != switch_on:
+                    (turn_on if switch_on else turn_off).append(device_id)
+
+            # Switching off first makes room in the power budget for what is switched on.
+            self._bulk(self.home.toggle_devices, turn_off, lambda device_id: self.home.toggle_device_by_id(device_id))
+            self._bulk(self.home.update_options, options, lambda device_id: self.home.update_option_by_id(device_id, options[device_id]))
+            self._bulk(self.home.toggle_devices, turn_on, lambda device_id: self.home.toggle_device_by_id(device_id))
+
+            # Calls run arbitrary code; whatever one raises is reported and the rest of the tick goes on.
+            for function in calls:
+                try:
+                    function(self.home)
+                except Exception as error:
+                    self._report(error)
+
+    def _bulk(self, apply, device_ids, apply_one):
+        if not device_ids:
+            return
+
+        try:
+            apply(device_ids)
+        except (ValueError, KeyError):
+            # The bulk call is all-or-nothing; retry one by one so one bad device does not hold back the rest.
+            for device_id in list(device_ids):
+                try:
+                    apply_one(device_id)
+                except (ValueError, KeyError) as error:
+                    self._report(error)
+
+    def _report(self, error):
+        self.errors.append(error)
+        if self.on_error is not None:
+            self.on_error(error)
+
+
+class AutoLock:
+    # Locks every door of device_type delay seconds after it is unlocked, unless it is locked first.
+    def __init__(self, scheduler, delay: float, device_type=SmartDoor):
+        self.scheduler = scheduler
+        self.delay = delay
+        self.device_type = device_type
+        self.pending = {}
+
+        home = scheduler.home
+        self._is_door = lambda device_id: isinstance(home.get_device_by_id(device_id), device_type)
+        home.subscribe(self._on_event)
+
+    def _on_event(self, event):
+        if type(event) is DeviceRemoved:
+            job = self.pending.pop(event.device_id, None)
+            if job is not None:
+                self.scheduler.cancel(job)
+            return
+
+        if type(event) is not OptionChanged or not self._is_door(event.device_id):
+            return
+
+        job = self.pending.pop(event.device_id, None)
+        if job is not None:
+            self.scheduler.cancel(job)
+
+        if not event.new:
+            self.pending[event.device_id] = self.scheduler.after(self.delay, set_option(event.device_id, True), "auto-lock")
+
+
+def test_scheduler():
+
+    print(f"        Smart Home scheduler      \n")
+
+    clock = ManualClock()
+    home = SmartHome(max_limit = 10, power_budget = 200)
+    plug_id = home.add_device(SmartPlug(120))
+    heater_id = home.add_device(SmartPlug(150))
+    tv_id = home.add_device(SmartTV(1))
+    door_id = home.add_device(SmartDoor())
+
+    scheduler = Scheduler(home, clock = clock, tick = 60, on_error = lambda error: print(f"Error: {error}"),
+                          utc_offset = lambda when: 0)
+    batches = []
+    home.subscribe(batches.append, coalesce = True)
+
+    scheduler.daily(6, 0, switch(plug_id, True), "plug on at 06:00")
+    scheduler.daily(6, 0, switch(tv_id, True), "tv on at 06:00")
+    scheduler.daily(22, 30, switch(plug_id, False), "plug off at 22:30")
+    channels = iter(range(2, 1000))
+    scheduler.every(3 * 3600, call(lambda home: home.update_option_by_id(tv_id, next(channels))), name = "next channel")
+    heater = scheduler.at(7 * 3600, switch(heater_id, True), "heater on at 07:00")
+    AutoLock(scheduler, delay = 300)
+
+    print(f"{len(scheduler)} job(s), next at {scheduler.next_due()}s")
+
+    print("\n       06:00       ")
+    clock.now = 6 * 3600
+    print(f"Ran {scheduler.run_due()} job(s) in {len(batches)} batch(es)")
+    print(home)
+
+    print("\n       07:00, the heater would go over budget       ")
+    clock.now = 7 * 3600
+    scheduler.run_due()
+
+    print("\n       The door is unlocked at 08:00 and locks itself       ")
+    scheduler.cancel(heater)
+    clock.now = 8 * 3600
+    home.update_option_by_id(door_id, False)
+    clock.advance(299)
+    scheduler.run_due()
+    print(home.get_device_by_id(door_id))
+    clock.advance(1)
+    scheduler.run_due()
+    print(home.get_device_by_id(door_id))
+
+    print("\n       The rest of the day       ")
+    clock.now = DAY
+    scheduler.run_due()
+    print(home)
+    print(f"{scheduler.ticks_run} tick(s), {scheduler.actions_run} action(s), {len(scheduler)} job(s) left")
+
+    print("\n       Jobs that cancel themselves or fail       ")
+    jobs = len(scheduler)
+    def stop_after_two(home):
+        if countdown.runs == 1:
+            scheduler.cancel(countdown)
+    countdown = scheduler.every(60, call(stop_after_two), name = "countdown")
+    scheduler.every(300, call(lambda home: home.toggle_devices(5)), name = "broken")
+    for _ in range(10):
+        clock.advance(60)
+        scheduler.run_due()
+    print(f"Countdown ran {countdown.runs} time(s), {len(scheduler) - jobs} of the new jobs still scheduled")
+
+    print("\n       Missed runs are collapsed into one       ")
+    home = SmartHome(max_limit = 10)
+    clock = ManualClock()
+    scheduler = Scheduler(home, clock = clock, tick = 60, utc_offset = lambda when: 0)
+    hourly = scheduler.every(3600, call(lambda home: None), name = "hourly")
+    clock.now = 10 * 3600 + 30
+    scheduler.run_due()
+    print(f"Ran {hourly.runs} time(s) after ten hours away, next at {hourly.due}s")
+
+    print("\n       Daily jobs follow the local clock       ")
+    # UTC+1, moving to UTC+2 at the start of the third day.
+    clock = ManualClock()
+    scheduler = Scheduler(home, clock = clock, tick = 60,
+                          utc_offset = lambda when: 3600 if when < 2 * DAY - 3600 else 7200)
+    morning = scheduler.daily(6, 0, call(lambda home: None), "06:00 local")
+    for _ in range(3):
+        due = morning.due
+        clock.now = due
+        scheduler.run_due()
+        print(f"Ran at {due / 3600:g}h UTC, day {int(due // DAY) + 1}")
+
+
+if __name__ == "__main__":
+    test_scheduler()
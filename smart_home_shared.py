@@ -0,0 +1,423 @@
+import multiprocessing
+import os
+import struct
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES_BY_CODE
+from smart_home_concurrent import DeviceState
+from smart_home_snapshot import SWITCH_ON, device_fields
+
+MAGIC = b"SHSM"
+FORMAT_VERSION = 1
+
+# The header is a row of 8-byte words, each written with a single store. Word 0 holds the magic
+# and format version; the rest are indexed by these names. The power budget is -1 for none.
+IDENTITY = struct.Struct("<4sHxx")
+(SEQUENCE, MOVED, SEGMENT, LAYOUT, CAPACITY, COUNT, DEVICES_ON, MAX_LIMIT, POWER_BUDGET,
+ TOTAL_POWER_DRAW) = range(1, 11)
+HEADER_WORDS = 12
+HEADER_SIZE = HEADER_WORDS * 8
+
+# Set in a row's flags while a device lives in it; SWITCH_ON is shared with the snapshot format.
+PRESENT = 0x02
+
+# Rows are columns: device ids, options, type codes and flags, one entry per row each.
+ROW_SIZE = 4 + 4 + 1 + 1
+
+# Attempts a reader makes before it backs off between tries.
+READ_SPINS = 100
+
+
+def _segment_size(capacity: int):
+    return HEADER_SIZE + capacity * ROW_SIZE
+
+
+def _views_of(buffer, capacity: int):
+    header = buffer[:HEADER_SIZE].cast("q")
+    offset = HEADER_SIZE
+    ids = buffer[offset:offset + 4 * capacity].cast("I")
+    offset += 4 * capacity
+    options = buffer[offset:offset + 4 * capacity].cast("i")
+    offset += 4 * capacity
+    codes = buffer[offset:offset + capacity]
+    flags = buffer[offset + capacity:offset + 2 * capacity]
+    return header, ids, options, codes, flags
+
+
+def _segment_name(name: str, segment: int):
+    return name if segment == 0 else f"{name}.{segment}"
+
+
+def _create(name, capacity: int):
+    memory = shared_memory.SharedMemory(name, create=True, size=_segment_size(capacity))
+    IDENTITY.pack_into(memory.buf, 0, MAGIC, FORMAT_VERSION)
+    _untrack(memory)
+    return memory
+
+
+def _untrack(memory):
+    # Before Python 3.13 every process that opens a segment registers it with its resource tracker,
+    # and processes started by multiprocessing share their parent's. Segments are not tracked at
+    # all here; the publisher removes them in close(), and readers never do.
+    if os.name == "posix":
+        resource_tracker.unregister(memory._name, "shared_memory")
+
+
+def _unlink(memory):
+    memory.close()
+    if os.name == "posix":
+        # SharedMemory.unlink() would unregister the segment a second time.
+        shared_memory._posixshmem.shm_unlink(memory._name)
+    else:
+        memory.unlink()
+
+
+class SharedHomePublisher:
+    def __init__(self, home, name: str = None, capacity: int = None):
+        # The home stays the owner of its devices; this keeps a copy of their switch and option
+        # columns in shared memory, one row per device, rewritten after every operation.
+        self.home = home
+        self.capacity = max(capacity or home.max_limit, len(home), 1)
+        self.segment = 0
+
+        self._base = _create(name, self.capacity)
+        self.name = self._base.name
+        self._memory = self._base
+        self._attach()
+
+        self._rows = {}
+        self._free_rows = []
+        self._layout = 0
+        self.writes = 0
+
+        with self._write():
+            for device_id, device in home.items():
+                self._write_row(self._new_row(device_id), device_id, device)
+            self._layout += 1
+
+        home.subscribe(self._on_batch, coalesce=True)
+
+    def _attach(self):
+        self._header, self._ids, self._options, self._codes, self._flags = _views_of(self._memory.buf, self.capacity)
+        self._header[CAPACITY] = self.capacity
+
+    def _release(self):
+        for view in (self._header, self._ids, self._options, self._codes, self._flags):
+            view.release()
+
+    @contextmanager
+    def _write(self):
+        # Seqlock: the sequence is odd while rows and header are rewritten, and turning it even
+        # again is the last store.
+        header = self._header
+        header[SEQUENCE] += 1
+        try:
+            yield
+        finally:
+            header = self._header
+            home = self.home
+            header[LAYOUT] = self._layout
+            header[COUNT] = len(self._rows)
+            header[DEVICES_ON] = home.devices_on
+            header[MAX_LIMIT] = home.max_limit
+            header[POWER_BUDGET] = -1 if home.power_budget is None else home.power_budget
+            header[TOTAL_POWER_DRAW] = home.total_power_draw
+            header[SEQUENCE] += 1
+            self.writes += 1
+
+    def _new_row(self, device_id: int):
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._rows)
+            if row == self.capacity:
+                self._grow()
+
+        self._rows[device_id] = row
+        return row
+
+    def _write_row(self, row: int, device_id: int, device):
+        code, flags, option = device_fields(device)
+        self._ids[row] = device_id
+        self._options[row] = option
+        self._codes[row] = code
+        self._flags[row] = flags | PRESENT
+
+    def _on_batch(self, batch):
+        layout_changed = batch.added or batch.removed
+
+        with self._write():
+            for device_id in batch.removed:
+                row = self._rows.pop(device_id, None)
+                if row is not None:
+                    self._flags[row] = 0
+                    self._free_rows.append(row)
+
+            for device_id, device in batch.added.items():
+                self._write_row(self._new_row(device_id), device_id, device)
+
+            get_device = self.home.get_device_by_id
+            for device_id in batch.changed:
+                row = self._rows.get(device_id)
+                if row is not None:
+                    self._write_row(row, device_id, get_device(device_id))
+
+            if layout_changed:
+                self._layout += 1
+
+    def _grow(self):
+        # Shared memory cannot be resized in place: the rows move to a segment twice as large, in
+        # the middle of a write, so the new segment starts out with an odd sequence too. The base
+        # segment is the one readers know by name; it says which segment is current.
+        old_memory, old_header = self._memory, self._header
+        old_columns = (self._ids, self._options, self._codes, self._flags)
+        old_capacity = self.capacity
+
+        self.capacity *= 2
+        self.segment += 1
+        self._memory = _create(_segment_name(self.name, self.segment), self.capacity)
+        self._attach()
+        for new, old in zip((self._ids, self._options, self._codes, self._flags), old_columns):
+            new[:old_capacity] = old
+        self._header[SEQUENCE] = old_header[SEQUENCE]
+        self._header[SEGMENT] = self.segment
+
+        base_header = old_header if old_memory is self._base else _views_of(self._base.buf, 0)[0]
+        base_header[SEGMENT] = self.segment
+        base_header[MOVED] = 1
+        old_header[MOVED] = 1
+
+        for view in {id(view): view for view in (base_header, old_header, *old_columns)}.values():
+            view.release()
+        if old_memory is not self._base:
+            _unlink(old_memory)
+
+    def close(self):
+        self.home.unsubscribe(self._on_batch)
+        self._release()
+
+        if self._memory is not self._base:
+            _unlink(self._memory)
+        _unlink(self._base)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SharedHomeView:
+    def __init__(self, name: str):
+        # Read-only: rows are read in place from the publisher's segment, never copied as a whole.
+        self.name = name
+        self.segment = None
+        self._memory = None
+        self._views = None
+        self._base = self._attach(name)
+        self._base_header = _views_of(self._base.buf, 0)[0]
+        self._layout = None
+        self._index = {}
+        self.retries = 0
+
+        identity = IDENTITY.unpack_from(self._base.buf, 0)
+        if identity != (MAGIC, FORMAT_VERSION):
+            self.close()
+            raise ValueError("Not a shared home segment")
+
+        self._open_current()
+
+    @staticmethod
+    def _attach(name):
+        memory = shared_memory.SharedMemory(name)
+        _untrack(memory)
+        return memory
+
+    def _open_current(self):
+        while True:
+            segment = self._base_header[SEGMENT]
+            try:
+                memory = self._base if segment == 0 else self._attach(_segment_name(self.name, segment))
+            except FileNotFoundError:
+                # The publisher grew again between the two reads.
+                continue
+            break
+
+        self._close_segment()
+        self._memory = memory
+        self.segment = segment
+        self.capacity = _views_of(memory.buf, 0)[0][CAPACITY]
+        self._views = _views_of(memory.buf, self.capacity)
+        self._layout = None
+
+    def _close_segment(self):
+        if self._views is not None:
+            for view in self._views:
+                view.release()
+            self._views = None
+
+        if self._memory is not None and self._memory is not self._base:
+            self._memory.close()
+        self._memory = None
+
+    def close(self):
+        self._close_segment()
+        self._base_header.release()
+        self._base.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, read):
+        # read(header, ids, options, codes, flags) runs against the live header words and columns,
+        # and is retried if the publisher wrote while it ran, so whatever it returns comes from
+        # one consistent state.
+        spins = 0
+        while True:
+            views = self._views
+            header = views[0]
+
+            if header[MOVED] and self._base_header[SEGMENT] != self.segment:
+                self._open_current()
+                continue
+
+            sequence = header[SEQUENCE]
+            if not sequence & 1:
+                try:
+                    result = read(*views)
+                except (KeyError, IndexError, ValueError):
+                    if header[SEQUENCE] == sequence:
+                        raise
+                    result = None
+
+                if header[SEQUENCE] == sequence:
+                    return result
+
+            self.retries += 1
+            spins += 1
+            if spins >= READ_SPINS:
+                time.sleep(0)
+
+    @property
+    def sequence(self):
+        return self.read(lambda header, *columns: header[SEQUENCE])
+
+    def __len__(self):
+        return self.read(lambda header, *columns: header[COUNT])
+
+    @property
+    def devices_on(self):
+        return self.read(lambda header, *columns: header[DEVICES_ON])
+
+    @property
+    def max_limit(self):
+        return self.read(lambda header, *columns: header[MAX_LIMIT])
+
+    @property
+    def power_budget(self):
+        budget = self.read(lambda header, *columns: header[POWER_BUDGET])
+        return None if budget < 0 else budget
+
+    @property
+    def total_power_draw(self):
+        return self.read(lambda header, *columns: header[TOTAL_POWER_DRAW])
+
+    def _index_for(self, header, ids, flags):
+        # Rows only move when devices are added or removed, so the id -> row index is rebuilt then.
+        # The layout is read before the rows, so an index built while rows moved is never tagged
+        # with the newer layout.
+        layout = header[LAYOUT]
+        if layout == self._layout:
+            return layout, self._index
+        return layout, {ids[row]: row for row in range(self.capacity) if flags[row]}
+
+    def get_device_by_id(self, device_id: int):
+        def read(header, ids, options, codes, flags):
+            layout, index = self._index_for(header, ids, flags)
+            row = index.get(device_id)
+            if row is None or ids[row] != device_id or not flags[row]:
+                raise KeyError(f"Cannot get device. No device with id {device_id}")
+            return layout, index, _state(codes[row], flags[row], options[row])
+
+        layout, index, state = self.read(read)
+        # Only an index from a read the sequence check accepted is kept for the next lookup.
+        self._layout, self._index = layout, index
+        return state
+
+    def items(self):
+        def read(header, ids, options, codes, flags):
+            return [(ids[row], _state(codes[row], flags[row], options[row]))
+                    for row in range(self.capacity) if flags[row]]
+
+        return sorted(self.read(read))
+
+    def __str__(self):
+        items = self.items()
+        summary = [f"SmartHome with {len(items)} device(s):"]
+
+        for i, (_, state) in enumerate(items):
+            summary.append(f"{i+1}- {state}")
+
+        return "\n".join(summary)
+
+
+def _state(code, flags, option):
+    device_type = DEVICE_TYPES_BY_CODE[code]
+    return DeviceState(device_type.device_class, bool(flags & SWITCH_ON),
+                       bool(option) if device_type.option_kind == "bool" else option)
+
+
+def _read_in_child(name, connection):
+    with SharedHomeView(name) as view:
+        connection.send((str(view), view.total_power_draw, view.devices_on))
+    connection.close()
+
+
+def test_shared_home():
+
+    print(f"        Smart Home in shared memory      \n")
+
+    home = SmartHome(max_limit = 10, power_budget = 300)
+    plug_id = home.add_device(SmartPlug(45))
+    tv_id = home.add_device(SmartTV(3))
+
+    with SharedHomePublisher(home, capacity = 2) as publisher:
+        view = SharedHomeView(publisher.name)
+        print(view)
+
+        print("\n       Changes show up in the view       ")
+        home.toggle_device_by_id(plug_id)
+        home.update_option_by_id(tv_id, 42)
+        door_id = home.add_device(SmartDoor())
+        print(view.get_device_by_id(tv_id))
+        print(f"Devices: {len(view)}, on: {view.devices_on}, drawing {view.total_power_draw}W of {view.power_budget}W")
+        print(f"Segment {publisher.segment}, capacity {publisher.capacity}")
+
+        print("\n       A removed device is gone       ")
+        home.remove_device_by_id(door_id)
+        try:
+            view.get_device_by_id(door_id)
+        except KeyError as error:
+            print(f"Error: {error}")
+
+        print("\n       Read from another process       ")
+        home.switch_all_on()
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_read_in_child, args=(publisher.name, child))
+        process.start()
+        text, draw, devices_on = parent.recv()
+        process.join()
+        print(text)
+        print(f"Drawing {draw}W, {devices_on} device(s) on")
+
+        view.close()
+
+
+if __name__ == "__main__":
+    test_shared_home()
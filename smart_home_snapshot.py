@@ -0,0 +1,252 @@
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES, DEVICE_TYPES_BY_CODE
+
+MAGIC = b"SHSN"
+FORMAT_VERSION = 2
+
+# magic, version, record size, device count, max limit, next device id, power budget (-1 for none),
+# sequence number of the last event log record the snapshot includes
+HEADER = struct.Struct("<4sHHIIIqQ")
+
+# device id, type code, flags (bit 0 is the switch), option value
+RECORD = struct.Struct("<IBBi")
+
+SWITCH_ON = 0x01
+
+
+def device_fields(device):
+    device_type = DEVICE_TYPES.get(type(device))
+
+    if device_type is None or device_type.option_kind == "choice":
+        raise ValueError(f"{type(device).__name__} cannot be stored in a snapshot")
+
+    return device_type.code, SWITCH_ON if device.switch_on else 0, int(device.option)
+
+
+def encode_device(device_id: int, device):
+    return RECORD.pack(device_id, *device_fields(device))
+
+
+def decode_device(code: int, flags: int, option: int):
+    device_type = DEVICE_TYPES_BY_CODE.get(code)
+
+    if device_type is None:
+        raise ValueError(f"Unknown device type code {code} in snapshot")
+
+    device = device_type.device_class(bool(option) if device_type.option_kind == "bool" else option)
+    device.switch_on = bool(flags & SWITCH_ON)
+    return device
+
+
+def _header_value(value, name, maximum):
+    # The header stores limits as unsigned and signed integers; anything else would fail in struct.
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= maximum:
+        raise ValueError(f"The {name} is {value!r}, which cannot be stored in a snapshot (a whole number from 0 to {maximum})")
+    return value
+
+
+def encode_snapshot(home, sequence: int = 0):
+    max_limit = _header_value(home.max_limit, "max limit", (1 << 32) - 1)
+    budget = -1 if home.power_budget is None else _header_value(home.power_budget, "power budget", (1 << 63) - 1)
+
+    # Records are written in id order so a reader can find any id by bisecting the file.
+    items = sorted(home.items(), key=lambda item: item[0])
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size, len(items), max_limit, home.next_device_id, budget, sequence)
+    return header + b"".join(encode_device(device_id, device) for device_id, device in items)
+
+
+def write_snapshot(data, path):
+    # Write next to the target and rename, so a crash never leaves a half-written snapshot.
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_path, path)
+
+
+def save_snapshot(home, path, sequence: int = 0):
+    write_snapshot(encode_snapshot(home, sequence), path)
+
+
+def _read_header(buffer, size: int):
+    if size < HEADER.size:
+        raise ValueError("Snapshot is too short")
+
+    magic, version, record_size, count, max_limit, next_id, budget, sequence = HEADER.unpack_from(buffer, 0)
+
+    if magic != MAGIC:
+        raise ValueError("Not a smart home snapshot")
+    if version != FORMAT_VERSION or record_size != RECORD.size:
+        raise ValueError(f"Unsupported snapshot version {version}")
+    if size < HEADER.size + count * RECORD.size:
+        raise ValueError("Snapshot is truncated")
+
+    return count, max_limit, next_id, None if budget < 0 else budget, sequence
+
+
+def load_snapshot(path):
+    with open(path, "rb") as file:
+        data = file.read()
+
+    count, max_limit, next_id, budget, sequence = _read_header(data, len(data))
+    records = memoryview(data)[HEADER.size:HEADER.size + count * RECORD.size]
+
+    home = SmartHome(max_limit = max_limit, power_budget = budget)
+    home.restore_devices(
+        ((device_id, decode_device(code, flags, option)) for device_id, code, flags, option in RECORD.iter_unpack(records)),
+        next_device_id = next_id,
+    )
+    return home, sequence
+
+
+def load_home(path):
+    return load_snapshot(path)[0]
+
+
+class SnapshotView:
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = None
+
+        # A file that fails the header check is closed again, mapping and all.
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+
+            # An empty file cannot be mapped, so let the header check reject it first.
+            if size < HEADER.size:
+                raise ValueError("Snapshot is too short")
+
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._count, self.max_limit, self.next_device_id, self.power_budget, self.sequence = _read_header(self._map, size)
+        except BaseException:
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+            raise
+
+        # Devices are built the first time they are looked at.
+        self._devices = {}
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._devices.clear()
+        self._map.close()
+        self._file.close()
+
+    def _record(self, index: int):
+        return RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+
+    def device_id_at(self, index: int):
+        if not 0 <= index < self._count:
+            raise IndexError("Cannot get device. Index out of bound")
+
+        return self._record(index)[0]
+
+    def _index_of(self, device_id: int):
+        index = bisect_left(range(self._count), device_id, key=self.device_id_at)
+
+        if index == self._count or self.device_id_at(index) != device_id:
+            raise KeyError(f"Cannot get device. No device with id {device_id}")
+
+        return index
+
+    def get_device(self, index: int):
+        device = self._devices.get(index)
+
+        if device is None:
+            if not 0 <= index < self._count:
+                raise IndexError("Cannot get device. Index out of bound")
+
+            _, code, flags, option = self._record(index)
+            device = self._devices[index] = decode_device(code, flags, option)
+
+        return device
+
+    def get_device_by_id(self, device_id: int):
+        return self.get_device(self._index_of(device_id))
+
+    def device_ids(self):
+        return [self.device_id_at(index) for index in range(self._count)]
+
+    def items(self):
+        for index in range(self._count):
+            yield self.device_id_at(index), self.get_device(index)
+
+    def materialized(self):
+        return len(self._devices)
+
+    def to_home(self):
+        home = SmartHome(max_limit = self.max_limit, power_budget = self.power_budget)
+        home.restore_devices(self.items(), next_device_id = self.next_device_id)
+        return home
+
+
+def test_smart_home_snapshot():
+
+    print(f"        Smart Home snapshots      \n")
+
+    home = SmartHome(max_limit = 10, power_budget = 300)
+    plug_id = home.add_device(SmartPlug(120))
+    tv_id = home.add_device(SmartTV(5))
+    door_id = home.add_device(SmartDoor(False))
+    home.toggle_device_by_id(plug_id)
+    home.toggle_device_by_id(door_id)
+    home.remove_device_by_id(tv_id)
+    print(home)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "home.snapshot")
+        save_snapshot(home, path)
+        print(f"\nSnapshot is {os.path.getsize(path)} bytes for {len(home)} device(s)")
+
+        print("\n       Eager restore       ")
+        restored = load_home(path)
+        print(restored)
+        print(f"Total draw: {restored.total_power_draw}W, next id: {restored.add_device(SmartTV(9))}")
+
+        print("\n       Lazy restore       ")
+        with SnapshotView(path) as view:
+            print(f"Mapped {len(view)} device(s), built so far: {view.materialized()}")
+            print(f"Device {door_id}: {view.get_device_by_id(door_id)}")
+            print(f"Built so far: {view.materialized()}")
+
+            try:
+                view.get_device_by_id(tv_id)
+            except KeyError as k:
+                print(f"Error: {k}")
+
+        print("\n       Invalid snapshot       ")
+        with open(path, "r+b") as file:
+            file.write(b"JUNK")
+
+        try:
+            load_home(path)
+        except ValueError as e:
+            print(f"Error: {e}")
+
+        print("\n       Limits the header cannot hold       ")
+        home.power_budget = 250.5
+        try:
+            save_snapshot(home, path)
+        except ValueError as e:
+            print(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    test_smart_home_snapshot()
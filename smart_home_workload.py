@@ -0,0 +1,354 @@
+import json
+import os
+import random
+import tempfile
+import time
+from collections import namedtuple
+
+from smart_home import SmartHome
+from smart_devices import SmartPlug, SmartTV, SmartDoor, DEVICE_TYPES, DEVICE_TYPES_BY_NAME
+from smart_home_metrics import LatencyHistogram, QUANTILES, FakeClock
+
+TRACE_FORMAT = "smart-home-trace"
+TRACE_VERSION = 1
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Relative command rate for each hour of the day: quiet nights, a morning bump, busy evenings.
+HOURLY_LOAD = (0.1, 0.05, 0.05, 0.05, 0.05, 0.1, 0.4, 1.0, 0.8, 0.4, 0.3, 0.3,
+               0.4, 0.3, 0.3, 0.4, 0.6, 1.2, 2.0, 2.5, 2.5, 2.0, 1.2, 0.5)
+
+# Evenings are toggle-heavy; the rest of the day has relatively more option changes.
+EVENING_HOURS = range(17, 23)
+
+# Every night at this hour the whole home is switched off in one command.
+NIGHT_OFF_HOUR = 23
+
+OPERATIONS = ("add", "remove", "toggle", "option", "all_on", "all_off")
+
+
+class Command(namedtuple("Command", ("t", "op", "device_id", "value"))):
+    # t: seconds since the start of the trace. For add, value is (type name, option) and device_id
+    # the id the device got when the trace was recorded.
+    __slots__ = ()
+
+    def to_json(self):
+        record = {"t": round(self.t, 6), "op": self.op}
+        if self.device_id is not None:
+            record["id"] = self.device_id
+        if self.op == "add":
+            record["type"], record["value"] = self.value
+        elif self.value is not None:
+            record["value"] = self.value
+        return record
+
+    @classmethod
+    def from_json(cls, record):
+        value = record.get("value")
+        if record["op"] == "add":
+            value = (record["type"], value)
+        return cls(record["t"], record["op"], record.get("id"), value)
+
+
+def random_option(device_type, rng):
+    if device_type.option_kind == "bool":
+        return rng.random() < 0.5
+    if device_type.option_kind == "choice":
+        return rng.choice(device_type.choices)
+    return rng.randint(device_type.min_value, device_type.max_value)
+
+
+class WorkloadGenerator:
+    def __init__(self, devices: int = 1000, rate: float = 1.0, option_churn: float = 0.2, device_churn: float = 0.01,
+                 mix = ((SmartPlug, 0.5), (SmartTV, 0.3), (SmartDoor, 0.2)), seed = None):
+        # rate: commands per second at an hour with load 1.0. option_churn and device_churn are the
+        # shares of option changes and of adds and removes among the commands outside the evening.
+        self.devices = devices
+        self.rate = rate
+        self.option_churn = option_churn
+        self.device_churn = device_churn
+        self.mix = [(DEVICE_TYPES[device_class], weight) for device_class, weight in mix]
+        self.seed = seed
+        self._random = random.Random(seed)
+
+        self.initial = [self._new_device() for _ in range(devices)]
+        # Ids are handed out by SmartHome in order from 1, so the generator knows them in advance.
+        self._live = list(range(1, devices + 1))
+        self._types = dict(zip(self._live, (device_type for device_type, _ in self.initial)))
+        self._next_id = devices + 1
+
+    def _new_device(self):
+        types, weights = zip(*self.mix)
+        device_type = self._random.choices(types, weights)[0]
+        return device_type, random_option(device_type, self._random)
+
+    def header(self):
+        return {
+            "format": TRACE_FORMAT,
+            "version": TRACE_VERSION,
+            "seed": self.seed,
+            # Room for the home to grow through the adds in the trace.
+            "max_limit": max(self.devices * 2, 10),
+            "power_budget": None,
+            "devices": [[device_type.name, option] for device_type, option in self.initial],
+        }
+
+    def commands(self, duration: float, start: float = 0):
+        # A Poisson stream whose rate follows HOURLY_LOAD, plus a switch_all_off every night.
+        rng = self._random
+        peak = self.rate * max(HOURLY_LOAD)
+        t = start
+        next_night = (t // DAY) * DAY + NIGHT_OFF_HOUR * HOUR
+        if next_night < t:
+            next_night += DAY
+
+        while True:
+            # Thinning: candidates arrive at the peak rate and are kept in proportion to the hour's load.
+            t += rng.expovariate(peak)
+            while next_night <= min(t, start + duration):
+                yield Command(next_night - start, "all_off", None, None)
+                next_night += DAY
+            if t >= start + duration:
+                return
+
+            hour = int(t % DAY // HOUR)
+            if rng.random() * max(HOURLY_LOAD) > HOURLY_LOAD[hour]:
+                continue
+
+            yield self._command(t - start, hour in EVENING_HOURS)
+
+    def _command(self, t, evening):
+        rng = self._random
+        live = self._live
+        roll = rng.random()
+
+        churn = self.device_churn if live else 1.0
+        if roll < churn / 2 or not live:
+            device_type, option = self._new_device()
+            device_id = self._next_id
+            self._next_id += 1
+            live.append(device_id)
+            self._types[device_id] = device_type
+            return Command(t, "add", device_id, (device_type.name, option))
+
+        if roll < churn:
+            index = rng.randrange(len(live))
+            live[index], live[-1] = live[-1], live[index]
+            device_id = live.pop()
+            del self._types[device_id]
+            return Command(t, "remove", device_id, None)
+
+        device_id = live[rng.randrange(len(live))]
+        option_share = self.option_churn / 4 if evening else self.option_churn
+        if roll < churn + option_share * (1 - churn):
+            return Command(t, "option", device_id, random_option(self._types[device_id], rng))
+
+        return Command(t, "toggle", device_id, None)
+
+
+def write_trace(path, header, commands):
+    count = 0
+    with open(path, "w") as file:
+        file.write(json.dumps(header) + "\n")
+        for command in commands:
+            file.write(json.dumps(command.to_json()) + "\n")
+            count += 1
+    return count
+
+
+def read_trace(path):
+    with open(path) as file:
+        header = json.loads(file.readline())
+        if header.get("format") != TRACE_FORMAT or header.get("version") != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} smart home trace")
+        commands = [Command.from_json(json.loads(line)) for line in file if line.strip()]
+    return header, commands
+
+
+def home_from_header(header):
+    home = SmartHome(max_limit = header["max_limit"], power_budget = header.get("power_budget"))
+    home.add_devices([make_device(name, option) for name, option in header["devices"]])
+    return home
+
+
+def initial_ids(header, home):
+    # The trace numbers its initial devices 1..n in header order. A home built elsewhere may have
+    # given them other ids, so they are matched up in id order and checked against the header.
+    device_ids = sorted(home.device_ids())
+    devices = header["devices"]
+    if len(device_ids) != len(devices):
+        raise ValueError(f"The home has {len(device_ids)} device(s), but the trace starts with {len(devices)}")
+
+    for device_id, (name, option) in zip(device_ids, devices):
+        device = home.get_device_by_id(device_id)
+        if type(device).__name__ != name or device.option != option:
+            raise ValueError(f"Device {device_id} is a {device}, but the trace starts with a {name} with option {option}")
+
+    return {trace_id: device_id for trace_id, device_id in enumerate(device_ids, 1)}
+
+
+def make_device(name, option):
+    device_type = DEVICE_TYPES_BY_NAME.get(name)
+    if device_type is None:
+        raise ValueError(f"Unknown device type {name} in trace")
+    return device_type.device_class(option)
+
+
+class ReplayReport:
+    def __init__(self):
+        self.commands = 0
+        self.elapsed = 0.0
+        self.latency = LatencyHistogram()
+        self.by_operation = {}
+        self.errors = {}
+        # Commands that started later than scheduled because the previous ones ran long.
+        self.late = 0
+
+    @property
+    def throughput(self):
+        return self.commands / self.elapsed if self.elapsed else 0.0
+
+    def _record(self, op, latency_ns):
+        self.commands += 1
+        self.latency.record(latency_ns)
+        histogram = self.by_operation.get(op)
+        if histogram is None:
+            histogram = self.by_operation[op] = LatencyHistogram()
+        histogram.record(latency_ns)
+
+    def __str__(self):
+        summary = [
+            f"{self.commands} command(s) in {self.elapsed:.3f}s: {self.throughput:,.0f} ops/s, {self.late} late",
+            f"{'operation':<10} {'count':>8} " + " ".join(f"{f'p{q * 100:g} us':>10}" for q in QUANTILES) + f" {'max us':>10}",
+        ]
+
+        rows = sorted(self.by_operation.items()) + [("all", self.latency)]
+        for op, histogram in rows:
+            quantiles = " ".join(f"{histogram.quantile(q) / 1000:>10.1f}" for q in QUANTILES)
+            summary.append(f"{op:<10} {histogram.count:>8} {quantiles} {histogram.max / 1000:>10.1f}")
+
+        if self.errors:
+            summary.append("Errors: " + ", ".join(f"{name} {count}" for name, count in sorted(self.errors.items())))
+        return "\n".join(summary)
+
+
+def replay(header, commands, home = None, rate: float = None, speed: float = None,
+           clock = time.perf_counter_ns, sleep = time.sleep):
+    # As fast as possible by default; at a fixed rate of commands per second; or following the
+    # trace's own timing, sped up by speed. When paced, latency runs from when a command was due,
+    # so time spent queued behind a slow command counts against the ones it delayed.
+    if rate is not None and speed is not None:
+        raise ValueError("Replay either at a fixed rate or at a speed, not both")
+
+    home = home_from_header(header) if home is None else home
+    report = ReplayReport()
+    # Trace ids -> ids in this home; devices added by the trace are mapped as they are added.
+    ids = initial_ids(header, home)
+
+    def run(command):
+        op = command.op
+        if op == "toggle":
+            home.toggle_device_by_id(ids[command.device_id])
+        elif op == "option":
+            home.update_option_by_id(ids[command.device_id], command.value)
+        elif op == "add":
+            ids[command.device_id] = home.add_device(make_device(*command.value))
+        elif op == "remove":
+            home.remove_device_by_id(ids.pop(command.device_id))
+        elif op == "all_off":
+            home.switch_all_off()
+        elif op == "all_on":
+            home.switch_all_on()
+        else:
+            raise ValueError(f"Unknown operation {op} in trace")
+
+    start = clock()
+    for index, command in enumerate(commands):
+        if rate is not None:
+            due = start + int(index * 1e9 / rate)
+        elif speed is not None:
+            due = start + int(command.t * 1e9 / speed)
+        else:
+            due = None
+
+        if due is not None:
+            wait = due - clock()
+            if wait > 0:
+                sleep(wait / 1e9)
+            elif wait < 0:
+                report.late += 1
+            begin = due
+        else:
+            begin = clock()
+
+        try:
+            run(command)
+        except (ValueError, KeyError) as error:
+            name = type(error).__name__
+            report.errors[name] = report.errors.get(name, 0) + 1
+
+        report._record(command.op, clock() - begin)
+
+    report.elapsed = (clock() - start) / 1e9
+    return report
+
+
+def home_after(header, commands):
+    home = home_from_header(header)
+    replay(header, commands, home = home)
+    return home
+
+
+class SleepingClock(FakeClock):
+    # Sleeping moves the fake clock forward instead of waiting.
+    def sleep(self, seconds):
+        self.now += int(seconds * 1e9)
+
+
+def test_workload():
+
+    print(f"        Smart Home workload      \n")
+
+    generator = WorkloadGenerator(devices = 50, rate = 0.01, seed = 7)
+    commands = list(generator.commands(2 * DAY))
+    counts = {}
+    for command in commands:
+        counts[command.op] = counts.get(command.op, 0) + 1
+    print(f"{len(commands)} commands over two days: {', '.join(f'{op} {counts[op]}' for op in OPERATIONS if op in counts)}")
+
+    evening = sum(1 for command in commands if int(command.t % DAY // HOUR) in EVENING_HOURS)
+    print(f"{evening} of them in the evening")
+    print(f"Nightly switch offs at: {', '.join(f'{command.t / HOUR:g}h' for command in commands if command.op == 'all_off')}")
+
+    print("\n       Traces round-trip through JSON lines       ")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        write_trace(path, generator.header(), commands)
+        header, loaded = read_trace(path)
+    print(f"{len(header['devices'])} initial devices, {len(loaded)} commands, same commands: {loaded == [Command.from_json(command.to_json()) for command in commands]}")
+
+    print("\n       Replayed as fast as possible       ")
+    report = replay(header, loaded)
+    print(f"{report.commands} commands, errors: {report.errors or 'none'}")
+    print(f"Replays agree: {str(home_after(header, loaded)) == str(home_after(header, commands))}")
+
+    # A home that already handed out ids gives the trace's devices different ones.
+    home = SmartHome(max_limit = header["max_limit"])
+    home.remove_device_by_id(home.add_device(SmartPlug(1)))
+    home.add_devices([make_device(name, option) for name, option in header["devices"]])
+    report = replay(header, loaded, home = home)
+    print(f"Replayed on a home with shifted ids, errors: {report.errors or 'none'}, same result: {str(home) == str(home_after(header, loaded))}")
+    try:
+        replay(header, loaded, home = SmartHome(max_limit = header["max_limit"]))
+    except ValueError as error:
+        print(f"Error: {error}")
+
+    print("\n       Paced on a fake clock       ")
+    clock = SleepingClock()
+    report = replay(header, loaded[:5], rate = 100, clock = clock, sleep = clock.sleep)
+    print(f"Finished after {report.elapsed * 1000:g}ms, {report.late} late")
+
+
+if __name__ == "__main__":
+    test_workload()